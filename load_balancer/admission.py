@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from collections import deque
+
+# Why a request was not admitted to a backend
+QUEUE_FULL = 'queue_full'
+QUEUE_TIMEOUT = 'queue_timeout'
+
+
+class ConcurrencyLimit:
+    """How many requests one backend may have in flight
+
+    A fixed limit stays at `max_limit`. An adaptive one follows the backend's
+    latency with AIMD: every response within `tolerance` times the baseline
+    latency raises the limit by 1/limit (about one per limit's worth of
+    requests), and every slower response or failure multiplies it by
+    `backoff`. The baseline is the lowest recent latency; it creeps up 1% per
+    response so it can follow a backend that got slower for good.
+    """
+
+    def __init__(self, max_limit, adaptive=False, min_limit=1, tolerance=2.0, backoff=0.9):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.value = float(max_limit)
+        self.baseline = None
+
+    def get(self):
+        return max(self.min_limit, int(self.value))
+
+    def observe(self, latency, ok):
+        if not self.adaptive:
+            return
+        if ok:
+            self.baseline = latency if self.baseline is None else min(latency, self.baseline * 1.01)
+        if not ok or latency > self.tolerance * self.baseline:
+            self.value = max(self.min_limit, self.value * self.backoff)
+        else:
+            self.value = min(self.max_limit, self.value + 1 / self.value)
+
+
+class AdmissionController:
+    """Per-backend concurrency limits with a bounded wait queue in front of each backend
+
+    A request over its backend's limit waits in that backend's queue, first
+    come first served, for at most `queue_timeout`. When the queue already
+    holds `queue_size` requests it is turned away at once, so a burst costs
+    fast rejections instead of unbounded requests piling up on a slow backend.
+    """
+
+    def __init__(self, max_in_flight, queue_size=100, queue_timeout=1.0, adaptive=False, min_limit=1):
+        """
+        Initialize the controller
+        :param max_in_flight: Most requests in flight on each backend (the ceiling of an adaptive limit)
+        :param queue_size: Most requests waiting for each backend
+        :param queue_timeout: Seconds a request may wait for its backend
+        :param adaptive: Adapt each backend's limit to its latency (AIMD)
+        :param min_limit: Floor of an adaptive limit
+        """
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.lock = threading.Lock()
+        self.limits = {}  # server_name -> ConcurrencyLimit
+        self.active = {}  # server_name -> admitted requests
+        self.queues = {}  # server_name -> deque of waiters, set once admitted
+
+    def _limit(self, server_name):
+        limit = self.limits.get(server_name)
+        if limit is None:
+            limit = self.limits[server_name] = ConcurrencyLimit(
+                self.max_in_flight, adaptive=self.adaptive, min_limit=self.min_limit)
+        return limit
+
+    def _admit_waiters(self, server_name):
+        """Hand free slots to the longest waiting requests (lock held)"""
+        queue = self.queues.get(server_name)
+        limit = self._limit(server_name).get()
+        while queue and self.active.get(server_name, 0) < limit:
+            self.active[server_name] = self.active.get(server_name, 0) + 1
+            queue.popleft().set()
+
+    def _enter(self, server_name, new_waiter):
+        """Admit a request (None), turn it away (QUEUE_FULL) or queue a new waiter and return it"""
+        with self.lock:
+            queue = self.queues.setdefault(server_name, deque())
+            active = self.active.get(server_name, 0)
+            if not queue and active < self._limit(server_name).get():
+                self.active[server_name] = active + 1
+                return None
+            if len(queue) >= self.queue_size:
+                return QUEUE_FULL
+            waiter = new_waiter()
+            queue.append(waiter)
+            return waiter
+
+    def _leave(self, server_name, waiter):
+        """After waiting: None if the waiter was admitted in time, else dequeue it and return QUEUE_TIMEOUT"""
+        with self.lock:
+            if waiter.is_set():
+                return None
+            self.queues[server_name].remove(waiter)
+            return QUEUE_TIMEOUT
+
+    def acquire(self, server_name, timeout):
+        """Wait for a slot on a backend; returns None once admitted, or why the request was turned away"""
+        waiter = self._enter(server_name, threading.Event)
+        if waiter is None or waiter == QUEUE_FULL:
+            return waiter
+        waiter.wait(min(timeout, self.queue_timeout))
+        return self._leave(server_name, waiter)
+
+    def release(self, server_name):
+        with self.lock:
+            self.active[server_name] = max(0, self.active.get(server_name, 0) - 1)
+            self._admit_waiters(server_name)
+
+    def observe(self, server_name, latency, ok):
+        """Feed a response time (or a failure) to the backend's adaptive limit"""
+        if not self.adaptive:
+            return
+        with self.lock:
+            self._limit(server_name).observe(latency, ok)
+            self._admit_waiters(server_name)
+
+    def snapshot(self):
+        """Get {server_name: (limit, admitted, queued)}"""
+        with self.lock:
+            return {
+                server_name: (limit.get(), self.active.get(server_name, 0), len(self.queues.get(server_name, ())))
+                for server_name, limit in self.limits.items()
+            }
+
+
+class AsyncAdmissionController(AdmissionController):
+    """AdmissionController for coroutines running on one event loop"""
+
+    async def acquire(self, server_name, timeout):
+        waiter = self._enter(server_name, asyncio.Event)
+        if waiter is None or waiter == QUEUE_FULL:
+            return waiter
+        try:
+            await asyncio.wait_for(waiter.wait(), min(timeout, self.queue_timeout))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client went away; give back a slot handed over meanwhile
+            if self._leave(server_name, waiter) is None:
+                self.release(server_name)
+            raise
+        return self._leave(server_name, waiter)
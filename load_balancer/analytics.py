@@ -0,0 +1,34 @@
+from .ring import arc_length
+
+
+def compare_rings(old, new):
+    """
+    Compare two ConsistentHash states analytically from their arcs
+    Every key hashing into an arc whose owner differs between the rings is
+    remapped, so the fractions are exact for uniformly hashed keys and cost
+    one pass over the virtual servers instead of sampling requests.
+    :param old: Ring before the change
+    :param new: Ring after the change; must use the same hash space as old
+    :return: Remapped fraction overall and per (from, to) server pair, and
+        the load imbalance (max/mean owned arc per unit of weight) of both rings
+    """
+    if old.num_slots != new.num_slots:
+        raise ValueError("Rings with different hash spaces cannot be compared")
+    space = old.num_slots
+
+    pairs = {}
+    for start, end, old_owner, new_owner in old.ring.moved_arcs(new.ring):
+        pair = (old_owner, new_owner)
+        pairs[pair] = pairs.get(pair, 0) + arc_length(start, end, space)
+
+    return {
+        'moved_fraction': sum(pairs.values()) / space,
+        'moved': [
+            {'from': old_owner, 'to': new_owner, 'fraction': length / space}
+            for (old_owner, new_owner), length in sorted(pairs.items(), key=lambda item: -item[1])
+        ],
+        'imbalance': {
+            'before': old.get_distribution(report=True)['max_mean_ratio'],
+            'after': new.get_distribution(report=True)['max_mean_ratio']
+        }
+    }
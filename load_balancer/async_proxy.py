@@ -0,0 +1,340 @@
+import asyncio
+import os
+import time
+from functools import partial
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+
+from .admission import AsyncAdmissionController
+from .cache import AsyncSingleFlight
+from .failover import UpstreamError
+from .load_balancer import LoadBalancer, HOP_BY_HOP_HEADERS, config_from_env
+from .metrics import ProxyMetrics, configure_logging
+
+
+class AsyncLoadBalancer(LoadBalancer):
+    """Load balancer serving requests from an asyncio event loop
+
+    Upstream requests go through one aiohttp session per backend hostname, so
+    each backend gets its own bounded pool of keep-alive connections and no
+    thread is blocked per in-flight request.
+    """
+
+    admission_class = AsyncAdmissionController
+    transport_errors = (aiohttp.ClientError, asyncio.TimeoutError)
+
+    def __init__(self, *args, keepalive_timeout=30, **kwargs):
+        """
+        Initialize the load balancer
+        :param keepalive_timeout: Seconds an idle upstream connection is kept open
+        Remaining arguments are passed to LoadBalancer; pool_size caps the
+        connections to each backend.
+        """
+        self.keepalive_timeout = keepalive_timeout
+        self.sessions = {}  # backend base URL -> aiohttp.ClientSession
+        super().__init__(*args, **kwargs)
+        self.cache_flight = AsyncSingleFlight()
+
+    def _create_app(self):
+        @web.middleware
+        async def sync_ring(request, handler):
+            self._sync_ring()
+            return await handler(request)
+
+        app = web.Application(middlewares=[sync_ring])
+        app.on_cleanup.append(self._close_sessions)
+        return app
+
+    def _create_session(self):
+        # Sessions are made per backend on first use, see _session_for
+        return None
+
+    def _create_hedge_executor(self):
+        # Hedged attempts are tasks on the event loop
+        return None
+
+    def _session_for(self, server_url):
+        """Get the pooled session for a backend, creating it on first use"""
+        session = self.sessions.get(server_url)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            # Forward bodies exactly as the backend encoded them
+            session = aiohttp.ClientSession(connector=connector, auto_decompress=False,
+                                            trace_configs=[self._connect_trace()])
+            self.sessions[server_url] = session
+        return session
+
+    def _connect_trace(self):
+        """Trace config recording how long new upstream connections take to open"""
+        async def on_start(session, context, params):
+            context.connect_start = time.monotonic()
+
+        async def on_end(session, context, params):
+            server_name = context.trace_request_ctx['server_name']
+            self.metrics.connect_seconds.observe(time.monotonic() - context.connect_start, server_name)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_start)
+        trace_config.on_connection_create_end.append(on_end)
+        return trace_config
+
+    async def _close_sessions(self, app):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+    async def _json_body(self, request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def _relay(self, request, response):
+        """Stream a backend response to the client"""
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() not in HOP_BY_HOP_HEADERS}
+        client_response = web.StreamResponse(status=response.status, headers=headers)
+        await client_response.prepare(request)
+
+        # write() waits for the client to drain, bounding what is buffered
+        try:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                await client_response.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Headers are already sent; cut the response short
+            if request.transport is not None:
+                request.transport.close()
+            return client_response
+        await client_response.write_eof()
+        return client_response
+
+    async def _admit(self, server_name, timeout):
+        if self.admission is None:
+            return None
+        queued = time.monotonic()
+        rejected = await self.admission.acquire(server_name, timeout)
+        self._record_admission(server_name, queued, rejected)
+        return rejected
+
+    async def _forward_request(self, request, path, header_overrides=None, relay=None):
+        """Proxy a request to its backends with failover; relay(request, response) answers the client"""
+        arrived = time.monotonic()
+        request_id = self._request_id(path, request.headers, request.cookies, request.query, request.remote)
+
+        # Stream the body upstream; aiohttp sends it chunked unless the
+        # client gave a Content-Length, which is forwarded as is
+        body = request.content.iter_chunked(self.chunk_size) if request.body_exists else None
+        headers = self._forward_headers(request.headers, header_overrides)
+
+        def send(server_name, server_url, timeout):
+            return self._send(server_name, server_url, timeout, request.method,
+                              self._upstream_url(server_url, path, request.query_string), headers=headers, data=body)
+
+        try:
+            server_name, response, attempts = await self._run(
+                self._proxy(request.method, path, request_id, body is not None), send)
+        except UpstreamError as e:
+            self._record_request(request.method, path, None, e.status, arrived, e.attempts)
+            return web.json_response({"message": e.message, "status": "failure"}, status=e.status, headers=e.headers)
+
+        try:
+            return await (relay or self._relay)(request, response)
+        finally:
+            response.release()
+            self._release(server_name)
+            self._record_request(request.method, path, server_name, response.status, arrived, attempts)
+
+    async def _run(self, steps, send):
+        """Run a _proxy generator, doing its I/O on the event loop"""
+        async def wait(attempts, timeout):
+            return await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        io = {
+            'admit': self._admit,
+            'send': send,
+            'start': lambda *args: asyncio.ensure_future(send(*args)),
+            'wait': wait
+        }
+        result = error = None
+        try:
+            while True:
+                try:
+                    step = steps.send(result) if error is None else steps.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                op, *args = step
+                try:
+                    result, error = io[op](*args), None
+                    if op != 'start':
+                        result = await result
+                except self.transport_errors as e:
+                    result, error = None, e
+        finally:
+            # Cancelled while the client went away: abandon any hedged attempts
+            steps.close()
+
+    async def _send(self, server_name, server_url, timeout, method, url, **kwargs):
+        """Send one attempt to a backend; returns the response once its headers are in"""
+        self.in_flight.acquire(server_name)
+        start = time.monotonic()
+        try:
+            response = await self._session_for(server_url).request(
+                method,
+                url,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout),
+                trace_request_ctx={'server_name': server_name},
+                **kwargs
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Count the failure; repeated failures eject the server for a while
+            self.metrics.upstream_errors.inc(server_name)
+            self._release(server_name)
+            self._record_outcome(server_name, False, time.monotonic() - start)
+            raise
+        except asyncio.CancelledError:
+            # The other copy of a hedged request won
+            self._release(server_name)
+            raise
+
+        # The request returns once the response headers are in
+        ttfb = time.monotonic() - start
+        self.metrics.ttfb_seconds.observe(ttfb, server_name, str(response.status))
+        self._record_outcome(server_name, response.status < 500, ttfb)
+        return response
+
+    def _status(self, response):
+        return response.status
+
+    def _discard(self, server_name, response):
+        response.release()
+        self._release(server_name)
+
+    def _abandon(self, server_name, attempt):
+        """Cancel a hedged attempt that lost"""
+        attempt.cancel()
+        attempt.add_done_callback(partial(self._discard_attempt, server_name))
+
+    def _discard_attempt(self, server_name, task):
+        # A cancelled request has already given back its slot
+        if not task.cancelled() and task.exception() is None:
+            self._discard(server_name, task.result())
+
+    async def _cached_request(self, request, path):
+        """Answer a GET from the response cache; concurrent misses for one key share a single fetch"""
+        arrived = time.monotonic()
+        key, entry = self._cache_lookup(request.method, path, request.query_string, request.headers)
+        if entry is not None and entry.is_fresh():
+            return self._cache_hit(request, path, entry, 'HIT', arrived)
+
+        async def store(request, response):
+            """Relay that caches the backend response if it may be stored"""
+            if self._cache_revalidated(path, key, entry, response.status, response.headers):
+                await response.read()
+                return self._cache_response(request, entry, 'REVALIDATED')
+
+            ttl = self._cache_ttl(path, response.status, response.headers, response.content_length)
+            if ttl is None:
+                return await self._relay(request, response)
+
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+            new_entry = self._cache_store(key, response.status, headers, await response.read(), ttl)
+            return self._cache_response(request, new_entry, 'MISS')
+
+        async def fetch():
+            # A stale entry with an ETag is revalidated instead of fetched again; the
+            # client's own conditional headers would make the response unstorable
+            etag = entry.etag if entry is not None else None
+            return await self._forward_request(request, path, {'If-None-Match': etag, 'If-Modified-Since': None},
+                                               relay=store)
+
+        response = await self.cache_flight.do(key, fetch, self.failover_policy.deadline)
+        if response is not None:
+            return response
+
+        # Another request has just fetched the key
+        _, entry = self._cache_lookup(request.method, path, request.query_string, request.headers)
+        if entry is not None and entry.is_fresh():
+            return self._cache_hit(request, path, entry, 'COALESCED', arrived)
+        return await self._forward_request(request, path)
+
+    def _cache_hit(self, request, path, entry, state, arrived):
+        self.metrics.cache_requests.inc(state)
+        response = self._cache_response(request, entry, state)
+        self._record_request(request.method, path, 'cache', response.status, arrived, 0)
+        return response
+
+    def _cache_response(self, request, entry, state):
+        status, headers, body = self._cached_answer(entry, state, request.headers.get('If-None-Match'))
+        return web.Response(body=body, status=status, headers=CIMultiDict(headers))
+
+    def _register_routes(self):
+        async def get_replicas(request):
+            payload, status = self.get_replicas()
+            return web.json_response(payload, status=status)
+
+        async def add_servers(request):
+            payload, status = self.add_servers(await self._json_body(request))
+            return web.json_response(payload, status=status)
+
+        async def set_weights(request):
+            payload, status = self.set_weights(await self._json_body(request))
+            return web.json_response(payload, status=status)
+
+        async def preview_changes(request):
+            payload, status = self.preview_changes(await self._json_body(request))
+            return web.json_response(payload, status=status)
+
+        async def remove_servers(request):
+            payload, status = self.remove_servers(await self._json_body(request))
+            return web.json_response(payload, status=status)
+
+        async def get_metrics(request):
+            return web.Response(body=self.metrics.render().encode('utf-8'),
+                                headers={'Content-Type': ProxyMetrics.CONTENT_TYPE})
+
+        async def route_request(request):
+            path = request.match_info['path']
+            if self._use_cache(request.method, request.headers):
+                return await self._cached_request(request, path)
+            return await self._forward_request(request, path)
+
+        self.app.router.add_get('/rep', get_replicas)
+        self.app.router.add_get('/metrics', get_metrics)
+        self.app.router.add_post('/add', add_servers)
+        self.app.router.add_put('/weight', set_weights)
+        self.app.router.add_post('/preview', preview_changes)
+        self.app.router.add_delete('/rm', remove_servers)
+        for method in ('GET', 'POST', 'PUT', 'DELETE'):
+            self.app.router.add_route(method, '/{path:.*}', route_request)
+
+    def run(self, host='0.0.0.0', port=5000):
+        # Requests are logged by the sampled access log instead of aiohttp's per-request one;
+        # on SIGTERM run_app stops accepting and waits for in-flight requests
+        web.run_app(self.app, host=host, port=port, access_log=None, shutdown_timeout=self.drain_timeout)
+
+    def serve(self, sock):
+        """Serve on an already listening socket"""
+        web.run_app(self.app, sock=sock, print=None, access_log=None, shutdown_timeout=self.drain_timeout)
+
+def config_from_env_async():
+    """Read AsyncLoadBalancer settings from the environment"""
+    config = config_from_env()
+    config['keepalive_timeout'] = float(os.environ.get('KEEPALIVE_TIMEOUT', 30))
+    return config
+
+def create_app():
+    """aiohttp app for production servers, e.g. gunicorn with LB_MODE=async"""
+    configure_logging()
+    lb = AsyncLoadBalancer(**config_from_env_async())
+    return lb.app
+
+if __name__ == '__main__':
+    configure_logging()
+    lb = AsyncLoadBalancer(**config_from_env_async())
+    lb.run()
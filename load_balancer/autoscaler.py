@@ -0,0 +1,458 @@
+import atexit
+import bisect
+import fcntl
+import math
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from .metrics import LATENCY_BUCKETS
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server', 'server.py')
+
+
+class Provisioner:
+    """Starts and stops backend servers for the autoscaler"""
+
+    name = None
+
+    def provision(self, count):
+        """Start up to count servers and return the hostnames of those ready to serve"""
+        raise NotImplementedError
+
+    def release(self, hostname):
+        """Stop a server started by provision()"""
+        raise NotImplementedError
+
+    def heartbeat_port(self, hostname):
+        """Port a server started by provision() answers heartbeats on apart from its traffic, or None"""
+        return None
+
+
+class LocalProcessProvisioner(Provisioner):
+    """Runs each backend as a local server/server.py process on its own port
+
+    A stand-in for a container platform, so scaling can be tried out and
+    tested without Docker.
+    """
+
+    name = 'local'
+
+    def __init__(self, base_port=6000, host='127.0.0.1', ready_timeout=10):
+        """
+        Initialize the provisioner
+        :param base_port: First port handed out to a server
+        :param host: Address the servers listen on and are reached at
+        :param ready_timeout: Seconds a new server has to answer its heartbeat
+        """
+        self.base_port = base_port
+        self.host = host
+        self.ready_timeout = ready_timeout
+        self.processes = {}  # hostname -> subprocess.Popen
+        self.heartbeat_ports = {}  # hostname -> port its heartbeat is answered on
+        # The servers would otherwise outlive the load balancer
+        atexit.register(self.close)
+
+    def _free_ports(self, count):
+        used = {int(hostname.rsplit(':', 1)[1]) for hostname in self.processes}
+        used.update(self.heartbeat_ports.values())
+        ports = []
+        port = self.base_port
+        while len(ports) < count:
+            if port not in used:
+                ports.append(port)
+            port += 1
+        return ports
+
+    def _wait_ready(self, hostname):
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if self.processes[hostname].poll() is not None:
+                return False
+            try:
+                if requests.get(f"http://{hostname}/heartbeat", timeout=0.5).status_code == 200:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        return False
+
+    def provision(self, count):
+        started = []
+        for _ in range(count):
+            # Servers share the host, so each answers heartbeats on a port of its own
+            port, heartbeat_port = self._free_ports(2)
+            hostname = f"{self.host}:{port}"
+            self.heartbeat_ports[hostname] = heartbeat_port
+            self.processes[hostname] = subprocess.Popen(
+                [sys.executable, SERVER_SCRIPT],
+                env=dict(os.environ, SERVER_ID=f"auto-{port}", PORT=str(port), HEARTBEAT_PORT=str(heartbeat_port)),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            started.append(hostname)
+
+        ready = []
+        for hostname in started:
+            if self._wait_ready(hostname):
+                ready.append(hostname)
+            else:
+                print(f"Provisioned server {hostname} did not become ready")
+                self.release(hostname)
+        return ready
+
+    def release(self, hostname):
+        self.heartbeat_ports.pop(hostname, None)
+        process = self.processes.pop(hostname, None)
+        if process is None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def heartbeat_port(self, hostname):
+        return self.heartbeat_ports.get(hostname)
+
+    def close(self):
+        for hostname in list(self.processes):
+            self.release(hostname)
+
+
+PROVISIONERS = {cls.name: cls for cls in (LocalProcessProvisioner,)}
+
+
+def create_provisioner(spec):
+    """Build a provisioner from "name" or "name:base_port" (e.g. "local:6000")"""
+    name, _, arg = spec.partition(':')
+    if name not in PROVISIONERS:
+        raise ValueError(f"Unknown provisioner {name!r}, expected one of {sorted(PROVISIONERS)}")
+    return PROVISIONERS[name](int(arg)) if arg else PROVISIONERS[name]()
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _quantile(buckets, q):
+    """Estimate a quantile from counts per LATENCY_BUCKETS bucket, interpolating within the bucket"""
+    rank = q * sum(buckets)
+    below = 0
+    for index, count in enumerate(buckets):
+        if count and below + count >= rank:
+            lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+            upper = LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+            return lower + (upper - lower) * (rank - below) / count
+        below += count
+    return 0.0
+
+
+class LoadBoard:
+    """Upstream load of every worker process, so the one running the autoscaler sees all of it
+
+    Each worker owns a slot of an mmap'd file holding its pid, its requests
+    in flight, and running totals of its finished requests, the seconds they
+    spent upstream and a histogram of their latencies. A worker only writes
+    its own slot; readers skip slots of processes that have exited.
+    """
+
+    def __init__(self, path=None, slots=256):
+        """
+        Open the board and claim a slot for this process
+        :param path: File shared by the worker processes; None keeps the board private to this process
+        :param slots: Most worker processes on the board
+        """
+        self.slot = struct.Struct(f'<qqQd{len(LATENCY_BUCKETS) + 1}Q')
+        self.slots = slots
+        size = self.slot.size * slots
+        if path is None:
+            self.mm = mmap.mmap(-1, size)
+            self.index = self._claim()
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self.mm = mmap.mmap(fd, size)
+                self.index = self._claim()
+            finally:
+                # The mmap holds a duplicate of fd, so closing fd alone would keep the lock
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.requests = 0
+        self.busy = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _claim(self):
+        for index in range(self.slots):
+            pid = struct.unpack_from('<q', self.mm, index * self.slot.size)[0]
+            if pid == 0 or not _is_running(pid):
+                self.slot.pack_into(self.mm, index * self.slot.size, os.getpid(), 0, 0, 0.0,
+                                    *[0] * (len(LATENCY_BUCKETS) + 1))
+                return index
+        raise RuntimeError(f"All {self.slots} load board slots are taken")
+
+    def observe(self, latency):
+        """Count one finished upstream request of this process"""
+        with self.lock:
+            self.requests += 1
+            self.busy += latency
+            self.buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def publish(self, in_flight):
+        """Write this process's totals and requests in flight to its slot"""
+        with self.lock:
+            self.slot.pack_into(self.mm, self.index * self.slot.size, self.pid, in_flight, self.requests,
+                                self.busy, *self.buckets)
+
+    def read(self):
+        """Get {slot: (pid, in_flight, requests, busy, buckets)} of every running worker"""
+        reports = {}
+        for index in range(self.slots):
+            pid, in_flight, requests, busy, *buckets = self.slot.unpack_from(self.mm, index * self.slot.size)
+            if pid and _is_running(pid):
+                reports[index] = (pid, in_flight, requests, busy, buckets)
+        return reports
+
+
+class Autoscaler:
+    """Adds and removes servers as the load on the backends changes
+
+    Every `interval` it measures the average number of requests in flight on
+    each backend (by Little's law: the time requests spent upstream, divided
+    by the interval) and the p90 upstream latency, over all worker processes.
+    The load is the larger of the two relative to `target_in_flight` and
+    `latency_slo`. It scales out once the load has stayed at or above
+    `scale_out_at` for `out_periods` intervals, before the SLO itself is
+    breached, adding enough servers to bring the load down to `target_load`.
+    It scales in one server at a time once the load has stayed at or below
+    `scale_in_at` for `in_periods` intervals, and only if the remaining
+    servers stay below `target_load`. Separate cooldowns follow every change.
+    Only servers the autoscaler added are removed, and each is drained before
+    it is stopped. Servers it added that are taken off the ring through /rm
+    are stopped too; ones only ejected by health checks are kept, since they
+    come back.
+    """
+
+    def __init__(self, lb, provisioner, min_servers=1, max_servers=10, target_in_flight=50, latency_slo=0.5,
+                 interval=5, scale_out_cooldown=30, scale_in_cooldown=120, scale_out_at=0.8, scale_in_at=0.3,
+                 target_load=0.6, out_periods=2, in_periods=6, max_step=4, min_samples=20, drain_timeout=30,
+                 state_path=None):
+        """
+        Initialize the autoscaler
+        :param lb: LoadBalancer whose ring is scaled
+        :param provisioner: Provisioner that starts and stops the servers
+        :param min_servers: Fewest servers kept on the ring
+        :param max_servers: Most servers on the ring
+        :param target_in_flight: Requests in flight per backend that count as full load
+        :param latency_slo: p90 upstream latency in seconds that counts as full load
+        :param interval: Seconds between measurements
+        :param scale_out_cooldown: Seconds after any change before scaling out
+        :param scale_in_cooldown: Seconds after any change before scaling in
+        :param scale_out_at: Load that triggers scaling out
+        :param scale_in_at: Load that triggers scaling in
+        :param target_load: Load aimed for after scaling out, and not exceeded by scaling in
+        :param out_periods: Consecutive intervals at scale_out_at before scaling out
+        :param in_periods: Consecutive intervals at scale_in_at before scaling in
+        :param max_step: Most servers added at once
+        :param min_samples: Requests an interval needs before its latency counts
+        :param drain_timeout: Seconds a removed server gets to finish its requests before it is stopped
+        :param state_path: Prefix of the files through which worker processes elect the one that scales,
+            report their load and pass on /rm removals; None for a single process
+        """
+        self.lb = lb
+        self.provisioner = provisioner
+        self.min_servers = min_servers
+        self.max_servers = max_servers
+        self.target_in_flight = target_in_flight
+        self.latency_slo = latency_slo
+        self.interval = interval
+        self.scale_out_cooldown = scale_out_cooldown
+        self.scale_in_cooldown = scale_in_cooldown
+        self.scale_out_at = scale_out_at
+        self.scale_in_at = scale_in_at
+        self.target_load = target_load
+        self.out_periods = out_periods
+        self.in_periods = in_periods
+        self.max_step = max_step
+        self.min_samples = min_samples
+        self.drain_timeout = drain_timeout
+        self.lock_path = f"{state_path}.autoscaler" if state_path else None
+        self.removals_path = f"{state_path}.removed" if state_path else None
+
+        self.active = False
+        self.board = LoadBoard(f"{state_path}.load" if state_path else None)
+        self.reports = {}  # board slot -> report at the last measurement
+        self.removals = []  # servers removed through /rm, without a removals file
+        self.window_start = time.monotonic()
+        self.hot = 0  # consecutive intervals at or above scale_out_at
+        self.cold = 0  # consecutive intervals at or below scale_in_at
+        self.last_change = float('-inf')
+        self.provisioned = []  # hostnames this autoscaler added, oldest first
+        self.load = 0.0
+
+    def start(self):
+        if self.lock_path and not self._elect():
+            # Leave scaling to the holder, but keep the requests in flight on the board up to date
+            threading.Thread(target=self._publish, daemon=True).start()
+            return
+        self.active = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _elect(self):
+        """Take the autoscaler lock; other worker processes leave scaling to the holder"""
+        self.lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            os.close(self.lock_fd)
+            return False
+
+    def observe(self, latency):
+        """Record how long one upstream request took; called for every proxied request"""
+        self.board.observe(latency)
+
+    def removed(self, server_names):
+        """Note servers taken off the ring through /rm, so the ones the autoscaler started are stopped"""
+        if not server_names:
+            return
+        if self.removals_path is None:
+            self.removals.extend(server_names)
+            return
+        with open(self.removals_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(''.join(f"{name}\n" for name in server_names))
+
+    def _take_removals(self):
+        if self.removals_path is None:
+            removals, self.removals = self.removals, []
+            return removals
+        with open(self.removals_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            removals = f.read().split()
+            f.truncate(0)
+        return removals
+
+    def _publish(self):
+        while True:
+            time.sleep(min(1, self.interval))
+            self.board.publish(self.lb.in_flight.total)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Autoscaler step failed: {e}")
+
+    def measure(self):
+        """Get the load of all worker processes over the last interval and start a new one"""
+        self.board.publish(self.lb.in_flight.total)
+        reports, previous = self.board.read(), self.reports
+        self.reports = reports
+        now = time.monotonic()
+        elapsed, self.window_start = max(now - self.window_start, 1e-9), now
+
+        in_flight = requests = busy = 0
+        buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        for index, (pid, flight, total, seconds, counts) in reports.items():
+            last = previous.get(index)
+            if last is None or last[0] != pid:
+                last = (pid, 0, 0, 0.0, [0] * len(counts))  # a worker new to the slot
+            in_flight += flight
+            requests += total - last[2]
+            busy += seconds - last[3]
+            buckets = [b + count - before for b, count, before in zip(buckets, counts, last[4])]
+
+        servers = self.lb.consistent_hash.get_servers()
+        if not servers:
+            return 0.0
+        # Little's law, or the requests in flight right now if more of them are stuck
+        load = max(busy / elapsed, in_flight) / len(servers) / self.target_in_flight
+        if requests >= self.min_samples:
+            load = max(load, _quantile(buckets, 0.9) / self.latency_slo)
+        return load
+
+    def step(self):
+        """Measure the load and scale out or in if it calls for it"""
+        self.lb._sync_ring()
+        self._release_removed()
+        self.load = load = self.measure()
+        self.hot = self.hot + 1 if load >= self.scale_out_at else 0
+        self.cold = self.cold + 1 if load <= self.scale_in_at else 0
+        count = self.lb.consistent_hash.get_server_count()
+        since_change = time.monotonic() - self.last_change
+
+        if self.hot >= self.out_periods and since_change >= self.scale_out_cooldown and count < self.max_servers:
+            desired = math.ceil(count * load / self.target_load)
+            self.scale_out(min(desired, count + self.max_step, self.max_servers) - count)
+        elif self.cold >= self.in_periods and since_change >= self.scale_in_cooldown and count > self.min_servers:
+            # Stop short of a ring the remaining load would push back over target
+            if count > 1 and load * count / (count - 1) < self.target_load:
+                self.scale_in()
+
+    def _release_removed(self):
+        """Stop the servers this autoscaler started that were removed through /rm"""
+        for hostname in self._take_removals():
+            if hostname in self.provisioned:
+                self.provisioned.remove(hostname)
+                self.lb.health_checker.forget(hostname)
+                self.provisioner.release(hostname)
+                print(f"Stopped server {hostname}, removed through /rm")
+
+    def scale_out(self, count):
+        hostnames = self.provisioner.provision(max(1, count))
+        if not hostnames:
+            return
+        payload, status = self.lb.add_servers({'n': len(hostnames), 'hostnames': hostnames})
+        if status != 200:
+            print(f"Could not add provisioned servers {hostnames}: {payload['message']}")
+            for hostname in hostnames:
+                self.provisioner.release(hostname)
+            return
+        self.provisioned += hostnames
+        self._changed('out', f"Scaled out by {len(hostnames)} at load {self.load:.2f}: {hostnames}")
+
+    def scale_in(self):
+        # Servers ejected by health checks are off the ring for now, but come back
+        servers = self.lb.consistent_hash.get_servers()
+        candidates = [hostname for hostname in self.provisioned if hostname in servers]
+        if not candidates:
+            return
+
+        hostname = candidates[-1]
+        self.provisioned.remove(hostname)
+        payload, status = self.lb.remove_servers({'n': 1, 'hostnames': [hostname]})
+        if status != 200:
+            self.provisioned.append(hostname)
+            print(f"Could not remove server {hostname}: {payload['message']}")
+            return
+        deadline = time.monotonic() + self.drain_timeout
+        while self.lb.in_flight.get(hostname) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.provisioner.release(hostname)
+        self._changed('in', f"Scaled in by 1 at load {self.load:.2f}: {hostname}")
+
+    def _changed(self, direction, message):
+        self.last_change = time.monotonic()
+        self.hot = self.cold = 0
+        self.lb.metrics.autoscaler_actions.inc(direction)
+        print(message)
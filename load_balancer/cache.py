@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# Request headers that make a response specific to one client
+PRIVATE_REQUEST_HEADERS = ('authorization',)
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into {directive: value or None}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match request header matches an entity tag"""
+    if not etag or not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def parse_route_ttls(spec):
+    """Parse "/prefix=seconds,..." into a {prefix: ttl} dict"""
+    routes = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        prefix, _, ttl = item.partition('=')
+        routes[prefix.strip()] = float(ttl)
+    return routes
+
+
+class CachedResponse:
+    """A buffered backend response and how long it stays fresh"""
+
+    __slots__ = ('status', 'headers', 'body', 'etag', 'stored_at', 'expires', 'size')
+
+    def __init__(self, status, headers, body, ttl):
+        self.status = status
+        self.headers = headers  # list of (name, value), hop-by-hop headers removed
+        self.body = body
+        self.etag = next((v for k, v in headers if k.lower() == 'etag'), None)
+        self.stored_at = time.monotonic()
+        self.expires = self.stored_at + ttl
+        self.size = len(body) + sum(len(k) + len(v) for k, v in headers)
+
+    def is_fresh(self):
+        return time.monotonic() < self.expires
+
+    def age(self):
+        return int(time.monotonic() - self.stored_at)
+
+
+class ResponseCache:
+    """Byte-bounded LRU cache of backend responses to idempotent GETs
+
+    Entries are keyed by method, path, query string and the `vary` request
+    headers. Their lifetime comes from the backend's Cache-Control
+    (s-maxage, then max-age), or else from the TTL of the longest matching
+    route prefix. Responses marked no-store or private, setting cookies, or
+    varying on headers outside `vary` are not stored. Stale entries with an
+    ETag are revalidated with If-None-Match instead of being fetched again.
+    """
+
+    def __init__(self, max_bytes, default_ttl=0, route_ttls=None, vary=('Accept', 'Accept-Encoding'),
+                 max_entry_fraction=0.125):
+        """
+        Initialize the cache
+        :param max_bytes: Total size of the cached bodies and headers
+        :param default_ttl: Seconds responses without Cache-Control freshness stay fresh (0: not cached)
+        :param route_ttls: {path_prefix: seconds} overriding default_ttl per route
+        :param vary: Request headers that are part of the cache key
+        :param max_entry_fraction: Largest share of max_bytes a single response may take
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = int(max_bytes * max_entry_fraction)
+        self.default_ttl = default_ttl
+        self.route_ttls = sorted((route_ttls or {}).items(), key=lambda route: len(route[0]), reverse=True)
+        self.vary = tuple(h.lower() for h in vary)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> CachedResponse, least recently used first
+        self.size = 0
+
+    def accepts(self, method, headers):
+        """Whether a request may be answered from the cache"""
+        if method != 'GET' or any(h in headers for h in PRIVATE_REQUEST_HEADERS):
+            return False
+        directives = parse_cache_control(headers.get('Cache-Control'))
+        return 'no-store' not in directives and 'no-cache' not in directives
+
+    def key(self, method, path, query_string, headers):
+        if isinstance(query_string, bytes):
+            query_string = query_string.decode('latin-1')
+        return (method, '/' + path.lstrip('/'), query_string) + tuple(headers.get(h, '') for h in self.vary)
+
+    def route_ttl(self, path):
+        path = '/' + path.lstrip('/')
+        for prefix, ttl in self.route_ttls:
+            if path.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def ttl_for(self, path, status, headers):
+        """Seconds a response may be served from the cache, or None if it must not be stored"""
+        if status != 200 or 'Set-Cookie' in headers:
+            return None
+        vary = headers.get('Vary')
+        if vary and any(h.strip().lower() not in self.vary for h in vary.split(',')):
+            return None  # includes Vary: *
+
+        directives = parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in directives or 'private' in directives:
+            return None
+        for name in ('s-maxage', 'max-age'):
+            if (directives.get(name) or '').isdigit():
+                ttl = int(directives[name])
+                break
+        else:
+            ttl = 0 if 'no-cache' in directives else self.route_ttl(path)
+        # Without an ETag an entry that is never fresh is useless
+        if ttl <= 0 and not headers.get('ETag'):
+            return None
+        return ttl
+
+    def fits(self, content_length):
+        return content_length is not None and int(content_length) <= self.max_entry_bytes
+
+    def get(self, key):
+        """Get an entry, fresh or stale, and mark it recently used"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            if entry.size > self.max_entry_bytes:
+                return
+            self.entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def refresh(self, key, entry, path, headers):
+        """Extend the life of an entry the backend confirmed with 304 Not Modified
+
+        A 304 without freshness headers keeps the stored response's
+        Cache-Control, so the entry stays fresh as long as it did before.
+        """
+        stored = {name.lower(): value for name, value in entry.headers}
+        freshness = {
+            'Cache-Control': headers.get('Cache-Control') or stored.get('cache-control'),
+            'ETag': entry.etag,
+        }
+        ttl = self.ttl_for(path, 200, {name: value for name, value in freshness.items() if value})
+        entry.stored_at = time.monotonic()
+        entry.expires = entry.stored_at + (ttl or 0)
+        self.put(key, entry)
+
+
+class SingleFlight:
+    """Lets one thread fetch a key while concurrent callers for the same key wait for it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> threading.Event set when the fetch finishes
+
+    def do(self, key, fetch, timeout):
+        """Run fetch() and return its result, or wait for the running fetch of key and return None"""
+        with self.lock:
+            event = self.calls.get(key)
+            leader = event is None
+            if leader:
+                event = self.calls[key] = threading.Event()
+        if not leader:
+            event.wait(timeout)
+            return None
+        try:
+            return fetch()
+        finally:
+            with self.lock:
+                del self.calls[key]
+            event.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop"""
+
+    def __init__(self):
+        self.calls = {}  # key -> asyncio.Event set when the fetch finishes
+
+    async def do(self, key, fetch, timeout):
+        """Await fetch() and return its result, or wait for the running fetch of key and return None"""
+        event = self.calls.get(key)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return None
+        event = self.calls[key] = asyncio.Event()
+        try:
+            return await fetch()
+        finally:
+            del self.calls[key]
+            event.set()
@@ -1,80 +1,243 @@
+import copy
+import functools
+import random
+
+from .ring import HashRing, arc_length
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the bulk hashing API
+    np = None
+
+# FNV-1a offset basis and prime for each supported hash width
+FNV_PARAMS = {
+    32: (0x811c9dc5, 0x01000193),
+    64: (0xcbf29ce484222325, 0x100000001b3),
+}
+
+# MurmurHash3 finalizer shifts and multipliers for each supported hash width
+FMIX_PARAMS = {
+    32: (16, 0x85ebca6b, 13, 0xc2b2ae35, 16),
+    64: (33, 0xff51afd7ed558ccd, 33, 0xc4ceb9fe1a85ec53, 33),
+}
+
+
 class ConsistentHash:
-    def __init__(self, num_servers=3, num_slots=512, num_virtual_servers=100):
+    def __init__(self, num_servers=3, num_slots=512, num_virtual_servers=100, hash_bits=None,
+                 hash_cache_size=16384):
         """
         Initialize the consistent hash map
         :param num_servers: Number of server containers (N)
         :param num_slots: Total number of slots in the hash map
         :param num_virtual_servers: Number of virtual servers per physical server (K)
+        :param hash_bits: Key the ring on the full 32- or 64-bit hash space instead of
+            num_slots; virtual servers are then placed without linear probing
+        :param hash_cache_size: Number of request hashes kept in the LRU memo (0 disables it)
         """
-        self.num_slots = num_slots
+        if hash_bits is not None and hash_bits not in FNV_PARAMS:
+            raise ValueError(f"hash_bits must be one of {sorted(FNV_PARAMS)}")
+        self.hash_bits = hash_bits
+        self.full_ring = hash_bits is not None
+        self.num_slots = 2 ** hash_bits if self.full_ring else num_slots
         self.num_virtual_servers = num_virtual_servers
-        self.hash_map = [None] * num_slots
+        self.ring = HashRing()  # occupied slots, sorted for binary search lookups
         self.servers = {}  # server_id -> server_info
         self.server_counter = 0
+        
+        # Hot request IDs skip the byte loop; the memo is bounded and evicts LRU entries
+        if hash_cache_size:
+            self.hash_request = functools.lru_cache(maxsize=hash_cache_size)(self._hash_request)
     
     def _fnv1a_hash(self, data):
         """FNV-1a hash function for better distribution"""
-        if isinstance(data, int):
-            data = str(data).encode('utf-8')
+        if type(data) is int:
+            data = b'%d' % data  # same bytes as str(data).encode() without the str round trip
         elif isinstance(data, str):
             data = data.encode('utf-8')
         
-        # 32-bit FNV-1a hash
-        h = 0x811c9dc5  # FNV offset basis
+        # 32-bit FNV-1a hash unless the ring uses the 64-bit hash space
+        bits = self.hash_bits or 32
+        h, prime = FNV_PARAMS[bits]
+        mask = (1 << bits) - 1
         for byte in data:
             h ^= byte
-            h = (h * 0x01000193) & 0xffffffff  # FNV prime for 32-bit
+            h = (h * prime) & mask
+        
+        if self.full_ring:
+            # FNV-1a barely mixes the high bits of short keys, which only matter
+            # once positions are no longer reduced modulo a small slot count
+            s1, m1, s2, m2, s3 = FMIX_PARAMS[bits]
+            h ^= h >> s1
+            h = (h * m1) & mask
+            h ^= h >> s2
+            h = (h * m2) & mask
+            h ^= h >> s3
         return h
     
-    def hash_request(self, i):
+    def _hash_request(self, i):
         """Improved hash function for request mapping using FNV-1a"""
-        # Convert to string to handle both string and integer inputs
-        hash_val = self._fnv1a_hash(str(i))
+        # Integers and strings are hashed directly; anything else by its string form
+        if type(i) is not int and not isinstance(i, str):
+            i = str(i)
+        hash_val = self._fnv1a_hash(i)
         return hash_val % self.num_slots
     
-    def hash_virtual_server(self, i, j):
+    hash_request = _hash_request
+    
+    def _fnv1a_hash_bulk(self, keys):
+        """Vectorized FNV-1a over a numpy array of byte strings"""
+        bits = self.hash_bits or 32
+        basis, prime = FNV_PARAMS[bits]
+        mask = np.uint64((1 << bits) - 1)
+        
+        width = max(keys.dtype.itemsize, 1)
+        data = np.frombuffer(keys.tobytes(), dtype=np.uint8).reshape(len(keys), width)
+        lengths = np.char.str_len(keys)
+        
+        h = np.full(len(keys), basis, dtype=np.uint64)
+        prime = np.uint64(prime)
+        for col in range(width):
+            # Shorter keys are NUL padded; leave their hash alone past the end
+            active = lengths > col
+            mixed = ((h ^ data[:, col]) * prime) & mask
+            h = np.where(active, mixed, h)
+        
+        if self.full_ring:
+            s1, m1, s2, m2, s3 = (np.uint64(v) for v in FMIX_PARAMS[bits])
+            h ^= h >> s1
+            h = (h * m1) & mask
+            h ^= h >> s2
+            h = (h * m2) & mask
+            h ^= h >> s3
+        return h
+    
+    def hash_requests(self, ids):
+        """Hash many request IDs in one call; returns a numpy uint64 array of ring positions"""
+        if np is None:
+            raise ImportError("hash_requests requires numpy")
+        
+        ids = np.asarray(ids)
+        if ids.dtype.kind in 'iu':
+            keys = ids.astype('S')  # decimal digits, as hash_request hashes integers
+        elif ids.dtype.kind == 'U':
+            keys = np.char.encode(ids, 'utf-8')
+        elif ids.dtype.kind == 'S':
+            keys = ids
+        else:
+            keys = np.array([
+                b'%d' % i if type(i) is int else (i if isinstance(i, str) else str(i)).encode('utf-8')
+                for i in ids.ravel()
+            ], dtype='S')
+        keys = keys.ravel()
+        
+        hashes = self._fnv1a_hash_bulk(keys)
+        if not self.full_ring:
+            hashes %= np.uint64(self.num_slots)
+        return hashes
+    
+    def get_servers_bulk(self, ids):
+        """Map many request IDs to servers in one call; returns a numpy array of server names"""
+        hashes = self.hash_requests(ids)
+        positions, owners = self.ring.positions, self.ring.owners
+        if not positions:
+            return np.full(len(hashes), None, dtype=object)
+        
+        idx = np.searchsorted(np.array(positions, dtype=np.uint64), hashes, side='left')
+        idx[idx == len(positions)] = 0  # wrap around the ring
+        return np.array(owners, dtype=object)[idx]
+    
+    def hash_virtual_server(self, server_name, j):
         """Improved hash function for virtual server mapping using FNV-1a"""
-        # Create a unique string combining server_id and replica_id
-        key = f"{i}:{j}"
+        # Keyed by the server's name rather than the order it joined in, so a
+        # server gets the same slots on every ring and after every restart
+        key = f"{server_name}:{j}"
         hash_val = self._fnv1a_hash(key)
         return hash_val % self.num_slots
     
-    def add_server(self, server_name, hostname=None):
-        """Add a server to the consistent hash map"""
+    def virtual_server_count(self, weight):
+        """Number of virtual servers of a server with the given weight (at least 1)"""
+        return max(1, round(self.num_virtual_servers * weight))
+    
+    def add_server(self, server_name, hostname=None, weight=1):
+        """
+        Add a server to the consistent hash map
+        :param weight: Relative capacity; the server gets weight * num_virtual_servers virtual servers
+        """
         if server_name in self.servers:
             return False
-            
+        if weight <= 0:
+            raise ValueError("Server weight must be positive")
+        count = self.virtual_server_count(weight)
+        self._check_capacity(count)
+        
         server_id = self.server_counter
         self.server_counter += 1
         
         self.servers[server_name] = {
             'id': server_id,
             'hostname': hostname or f'server{server_id}',
+            'weight': weight,
             'virtual_servers': []
         }
         
-        # Add virtual servers
-        for j in range(self.num_virtual_servers):
-            slot = self.hash_virtual_server(server_id, j)
+        self._add_virtual_servers(server_name, count)
+        return True
+    
+    def _check_capacity(self, count):
+        """Raise ValueError if count more virtual servers would not fit in the free slots"""
+        # Linear probing would never find a free slot for the rest
+        if not self.full_ring and len(self.ring) + count > self.num_slots:
+            raise ValueError(f"{len(self.ring) + count} virtual servers do not fit in {self.num_slots} slots; "
+                             f"lower the weights or use a larger ring")
+    
+    def _add_virtual_servers(self, server_name, count):
+        """Grow a server to count virtual servers; replica j always hashes to the same slot"""
+        server_info = self.servers[server_name]
+        slots = server_info['virtual_servers']
+        for j in range(len(slots), count):
+            slot = self.hash_virtual_server(server_name, j)
             
-            # Linear probing in case of collision
-            while self.hash_map[slot] is not None:
+            # Linear probing in case of collision; on the full hash ring
+            # colliding virtual servers share the position instead
+            while not self.full_ring and slot in self.ring:
                 slot = (slot + 1) % self.num_slots
-                
-            self.hash_map[slot] = server_name
-            self.servers[server_name]['virtual_servers'].append(slot)
+            
+            self.ring.insert(slot, server_name)
+            slots.append(slot)
+    
+    def set_weight(self, server_name, weight):
+        """
+        Change the weight of a server by adding or removing only the difference in
+        virtual servers, so keys move only to or from this server
+        """
+        if server_name not in self.servers:
+            return False
+        if weight <= 0:
+            raise ValueError("Server weight must be positive")
         
+        server_info = self.servers[server_name]
+        count = self.virtual_server_count(weight)
+        slots = server_info['virtual_servers']
+        if count > len(slots):
+            self._check_capacity(count - len(slots))
+            self._add_virtual_servers(server_name, count)
+        else:
+            # Drop the most recently added replicas first
+            for slot in slots[count:]:
+                self.ring.remove(slot, server_name)
+            del slots[count:]
+        server_info['weight'] = weight
         return True
     
     def remove_server(self, server_name):
         """Remove a server and all its virtual servers from the hash map"""
         if server_name not in self.servers:
             return False
-            
+        
         # Remove all virtual servers for this server
         for slot in self.servers[server_name]['virtual_servers']:
-            self.hash_map[slot] = None
-            
+            self.ring.remove(slot, server_name)
+        
         del self.servers[server_name]
         return True
     
@@ -82,26 +245,100 @@ class ConsistentHash:
         """Get the server that should handle the given request"""
         if not self.servers:
             return None
-            
-        slot = self.hash_request(request_id)
         
-        # Use binary search for better performance with many slots
-        for i in range(self.num_slots):
-            current_slot = (slot + i) % self.num_slots
-            if self.hash_map[current_slot] is not None:
-                return self.hash_map[current_slot]
+        slot = self._slot(request_id)
+        
+        # Binary search for the first occupied slot clockwise from the request
+        server_name = self.ring.lookup(slot)
+        if server_name is not None:
+            return server_name
         
         # Fallback: Find first available server (shouldn't happen in normal operation)
         for server_name in self.servers:
             if self.servers[server_name]['virtual_servers']:
                 return server_name
-                
+        
         return None
     
+    def iter_servers(self, request_id):
+        """Yield the distinct servers clockwise from the request's slot, the owner first"""
+        return self.ring.iter_owners(self._slot(request_id))
+    
+    def _slot(self, request_id):
+        # Without a key any position will do; hashing a one-off random key
+        # would only push hot keys out of the memo
+        if request_id is None:
+            return random.randrange(self.num_slots)
+        return self.hash_request(request_id)
+    
     def get_servers(self):
         """Get list of all server names"""
         return list(self.servers.keys())
     
+    def get_membership(self):
+        """Get [server_name, hostname, server_id, slots, weight] for each server, in the order they were added"""
+        return [[name, info['hostname'], info['id'], info['virtual_servers'], info['weight']]
+                for name, info in self.servers.items()]
+    
+    def set_membership(self, membership):
+        """Add the servers of a get_membership() list at exactly the slots they held"""
+        for server_name, hostname, server_id, slots, weight in membership:
+            self.servers[server_name] = {
+                'id': server_id,
+                'hostname': hostname,
+                'weight': weight,
+                'virtual_servers': list(slots)
+            }
+            self.server_counter = max(self.server_counter, server_id + 1)
+            for slot in slots:
+                self.ring.insert(slot, server_name)
+    
+    def copy(self):
+        """Get an independent copy of the ring sharing the configuration and the hash memo"""
+        clone = copy.copy(self)
+        clone.ring = self.ring.copy()
+        clone.servers = {
+            name: dict(info, virtual_servers=list(info['virtual_servers']))
+            for name, info in self.servers.items()
+        }
+        return clone
+    
+    def apply_batch(self, add=(), remove=(), weights=None, restore=()):
+        """
+        Apply a batch of membership changes copy-on-write
+        The changes are made on a copy, so lookups keep running lock-free on this
+        ring until the caller swaps in the new one with a single reference assignment.
+        Raises ValueError, leaving this ring unchanged, if the servers would need more
+        virtual servers than there are slots.
+        :param add: (server_name, hostname, weight) of each server to add
+        :param remove: Names of the servers to remove
+        :param weights: {server_name: weight} of the servers to reweight
+        :param restore: get_membership() entries re-added at exactly their old slots
+        :return: The new ConsistentHash and a report of the changes and of the key ranges that moved
+        """
+        new = self.copy()
+        removed = [name for name in remove if new.remove_server(name)]
+        added = [name for name, hostname, weight in add if new.add_server(name, hostname, weight)]
+        for entry in restore:
+            if entry[0] not in new.servers:
+                new.set_membership([entry])
+                added.append(entry[0])
+        reweighted = [name for name, weight in (weights or {}).items() if new.set_weight(name, weight)]
+        
+        moved = []
+        moved_slots = 0
+        for start, end, old_owner, new_owner in self.ring.moved_arcs(new.ring):
+            moved.append({'start': start, 'end': end, 'from': old_owner, 'to': new_owner})
+            moved_slots += arc_length(start, end, self.num_slots)
+        
+        return new, {
+            'added': added,
+            'removed': removed,
+            'reweighted': reweighted,
+            'moved': moved,
+            'moved_fraction': moved_slots / self.num_slots
+        }
+    
     def get_server_info(self, server_name):
         """Get information about a specific server"""
         return self.servers.get(server_name)
@@ -110,6 +347,31 @@ class ConsistentHash:
         """Get the number of servers"""
         return len(self.servers)
     
-    def get_distribution(self):
-        """Get the distribution of virtual servers across physical servers"""
-        return {name: len(info['virtual_servers']) for name, info in self.servers.items()}
+    def get_distribution(self, report=False):
+        """
+        Get the distribution of virtual servers across physical servers
+        :param report: Also report each server's weight, the fraction of the ring it
+            owns next to the fraction its weight entitles it to, and the max/mean ratio
+            of the owned fractions relative to the weights
+        """
+        if not report:
+            return {name: len(info['virtual_servers']) for name, info in self.servers.items()}
+        
+        arcs = self.ring.arc_lengths(self.num_slots)
+        total_weight = sum(info['weight'] for info in self.servers.values())
+        servers = {
+            name: {
+                'weight': info['weight'],
+                'virtual_servers': len(info['virtual_servers']),
+                'arc_fraction': arcs.get(name, 0) / self.num_slots,
+                'weight_fraction': info['weight'] / total_weight
+            }
+            for name, info in self.servers.items()
+        }
+        # Load per unit of weight; equal for every server on a perfectly balanced ring
+        loads = [s['arc_fraction'] / s['weight_fraction'] for s in servers.values()]
+        mean = sum(loads) / len(loads) if loads else 0
+        return {
+            'servers': servers,
+            'max_mean_ratio': max(loads) / mean if mean else 0
+        }
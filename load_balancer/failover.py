@@ -0,0 +1,63 @@
+import time
+
+# Methods whose repetition has the same effect as sending them once (RFC 9110)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'})
+
+
+class FailoverPolicy:
+    """How a failed request is retried on the next distinct servers clockwise on the ring
+
+    Ring membership is left alone; a retry only moves on to the next owner.
+    Every attempt gets its own timeout, and all attempts together must finish
+    within `deadline`, so one slow backend costs at most one attempt timeout.
+    Only idempotent methods without a request body are retried, because the
+    body is streamed upstream and cannot be sent again.
+    """
+
+    def __init__(self, max_attempts=3, attempt_timeout=2, deadline=5, retry_statuses=(502, 503, 504)):
+        """
+        Initialize the policy
+        :param max_attempts: Distinct servers tried per request, the ring owner included
+        :param attempt_timeout: Seconds each attempt may wait to connect and for each read
+        :param deadline: Seconds all attempts of a request may take together
+        :param retry_statuses: Backend status codes that are retried like connection failures
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def attempts(self, method, has_body):
+        """Number of servers a request may be sent to"""
+        if method.upper() in IDEMPOTENT_METHODS and not has_body:
+            return self.max_attempts
+        return 1
+
+    def start(self):
+        """Get the time by which all attempts of a request started now must finish"""
+        return time.monotonic() + self.deadline
+
+    def timeout(self, deadline):
+        """Timeout for the next attempt, or None once the deadline has passed"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        return min(self.attempt_timeout, remaining)
+
+
+class UpstreamError(Exception):
+    """No backend response to relay: the status, message and headers the client gets instead"""
+
+    def __init__(self, status, message, attempts, headers=None):
+        """
+        Initialize the error
+        :param status: Status code for the client
+        :param message: What went wrong, for the client
+        :param attempts: Servers the request was sent to
+        :param headers: Extra response headers, e.g. Retry-After
+        """
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.attempts = attempts
+        self.headers = headers or {}
@@ -0,0 +1,45 @@
+"""gunicorn settings for the load balancer: gunicorn -c load_balancer/gunicorn.conf.py
+
+LB_MODE=flask (the default) runs create_app() on threaded workers;
+LB_MODE=async runs the aiohttp app on one event loop per worker. Every
+worker builds its own load balancer after the fork, and they share the ring
+through RING_STATE_PATH, so only the first one adds the initial servers.
+"""
+import os
+
+from load_balancer.shared_state import default_state_path
+
+if os.environ.get('LB_MODE', 'flask') == 'async':
+    wsgi_app = 'load_balancer.async_proxy:create_app()'
+    worker_class = 'aiohttp.GunicornWebWorker'
+else:
+    wsgi_app = 'load_balancer.load_balancer:create_app()'
+    worker_class = 'gthread'
+    # Threads per worker, i.e. requests each worker proxies at once
+    threads = int(os.environ.get('THREADS', 32))
+
+bind = f"0.0.0.0:{os.environ.get('SERVER_PORT', 5000)}"
+workers = int(os.environ.get('WORKERS') or os.cpu_count() or 1)
+backlog = 2048
+keepalive = int(os.environ.get('CLIENT_KEEPALIVE', 5))
+# On SIGTERM workers stop accepting and get this long to finish their requests
+graceful_timeout = int(float(os.environ.get('DRAIN_TIMEOUT', 30)))
+# Each worker starts health-check threads, which must not be created before the fork
+preload_app = False
+# Requests are logged by the load balancer's sampled access log
+accesslog = None
+
+
+def on_starting(server):
+    # One ring state file for all workers
+    if not os.environ.get('RING_STATE_PATH'):
+        os.environ['RING_STATE_PATH'] = server.ring_state_path = default_state_path()
+
+
+def on_exit(server):
+    path = getattr(server, 'ring_state_path', None)
+    if path:
+        # The ring, and the autoscaler's lock, load board and removals next to it
+        for name in (path, f"{path}.autoscaler", f"{path}.load", f"{path}.removed"):
+            if os.path.exists(name):
+                os.remove(name)
@@ -0,0 +1,304 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+
+class HealthChecker:
+    """Active health checks that probe every backend in parallel
+
+    Each sweep sends all heartbeat probes at once and waits at most `timeout`
+    for them, so a sweep takes about one probe deadline however many servers
+    are down. A server is ejected from the ring only after `fall` consecutive
+    failed probes and re-admitted at its previous ring positions after `rise`
+    consecutive successes. The probe pool grows with the number of servers,
+    so hung servers never hold up the probes of healthy ones; a probe that
+    still could not start in time leaves its server unchecked for that sweep.
+    """
+
+    def __init__(self, lb, interval=5, timeout=2, jitter=0.2, fall=3, rise=2, port=None):
+        """
+        Initialize the health checker
+        :param lb: LoadBalancer whose servers are checked
+        :param interval: Seconds between sweeps
+        :param timeout: Deadline in seconds for each probe
+        :param jitter: Random +/- fraction applied to the interval so workers do not probe in lockstep
+        :param fall: Consecutive failures before a server is ejected
+        :param rise: Consecutive successes before an ejected server is re-admitted
+        :param port: Port the heartbeats are sent to, if servers answer them apart from their traffic;
+            servers with nothing listening on it, and all servers if None, are probed on their own port
+        """
+        self.lb = lb
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.fall = fall
+        self.rise = rise
+        self.port = port
+        self.pool_size = 0
+        self.executor = None
+        self.hanging = set()  # probe futures still running past the end of their sweep
+        self.failures = {}  # server_name -> consecutive failed probes
+        self.successes = {}  # server_name -> consecutive successful probes while ejected
+        self.ejected = {}  # server_name -> membership entry to restore on re-admission
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Health check sweep failed: {e}")
+
+    def _heartbeat_port(self, hostname):
+        # Servers the autoscaler started on this host each answer heartbeats on a port of their own
+        autoscaler = self.lb.autoscaler
+        port = autoscaler.provisioner.heartbeat_port(hostname) if autoscaler is not None else None
+        return port or self.port
+
+    def _probe(self, server_url, port=None):
+        try:
+            if port:
+                try:
+                    return self._heartbeat(f"{server_url.rsplit(':', 1)[0]}:{port}")
+                except requests.exceptions.ConnectTimeout:
+                    return False
+                except requests.exceptions.ConnectionError:
+                    pass  # nothing listens there, e.g. a server started without HEARTBEAT_PORT
+            return self._heartbeat(server_url)
+        except requests.exceptions.RequestException:
+            return False
+
+    def _heartbeat(self, server_url):
+        response = requests.get(f"{server_url}/heartbeat", timeout=self.timeout)
+        return response.status_code == 200
+
+    def sweep(self):
+        """Probe every ring server and every ejected server once, in parallel"""
+        self.lb._sync_ring()
+        consistent_hash = self.lb.consistent_hash
+
+        targets = {}  # server_name -> hostname
+        for server_name in consistent_hash.get_servers():
+            targets[server_name] = consistent_hash.get_server_info(server_name)['hostname']
+        for server_name, entry in list(self.ejected.items()):
+            targets[server_name] = entry[1]
+
+        # Probes still hanging from earlier sweeps keep their threads
+        self.hanging = {future for future in self.hanging if not future.done()}
+        executor = self._executor(len(targets) + len(self.hanging))
+        futures = {
+            executor.submit(self._probe, self.lb._hostname_url(hostname), self._heartbeat_port(hostname)): name
+            for name, hostname in targets.items()
+        }
+        done, _ = wait(futures, timeout=self.timeout + 0.5)
+        for future, server_name in futures.items():
+            if future not in done and future.cancel():
+                # Never started, e.g. behind probes of the last sweep still hanging: not checked
+                continue
+            # Probes still running past their deadline count as failures
+            healthy = future in done and future.result()
+            if future not in done:
+                self.hanging.add(future)
+            if server_name in self.ejected:
+                self._record_ejected(server_name, healthy)
+            else:
+                self._record(server_name, healthy)
+
+    def _executor(self, probes):
+        """Get a pool with a thread for each of `probes` probes"""
+        if probes > self.pool_size:
+            if self.executor is not None:
+                # Its hanging probes finish on their own
+                self.executor.shutdown(wait=False)
+                self.hanging.clear()
+            self.pool_size = max(probes, 2 * self.pool_size)
+            self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='health-check')
+        return self.executor
+
+    def _record(self, server_name, healthy):
+        if healthy:
+            self.failures.pop(server_name, None)
+            return
+
+        failures = self.failures.get(server_name, 0) + 1
+        self.failures[server_name] = failures
+        print(f"Health check failed for {server_name} ({failures}/{self.fall})")
+        if failures < self.fall:
+            return
+
+        with self.lb._membership_change():
+            entry = next((e for e in self.lb.consistent_hash.get_membership() if e[0] == server_name), None)
+            removed = self.lb._apply_batch(remove=[server_name])['removed']
+        self.failures.pop(server_name, None)
+        if removed:
+            self.ejected[server_name] = entry
+            self.successes[server_name] = 0
+            self.lb._set_server_status(server_name, 'unhealthy')
+            print(f"Removed server {server_name} from pool")
+
+    def _record_ejected(self, server_name, healthy):
+        successes = self.successes.get(server_name, 0) + 1 if healthy else 0
+        self.successes[server_name] = successes
+        if successes < self.rise:
+            return
+
+        entry = self.ejected.pop(server_name)
+        self.successes.pop(server_name, None)
+        with self.lb._membership_change():
+            # Skipped if another worker has re-admitted it already
+            self.lb._apply_batch(restore=[entry])
+        self.lb._set_server_status(server_name, 'healthy')
+        print(f"Re-admitted server {server_name} to pool")
+
+    def forget(self, server_name):
+        """Stop tracking a server that was removed on purpose"""
+        self.failures.pop(server_name, None)
+        self.successes.pop(server_name, None)
+        self.ejected.pop(server_name, None)
+
+
+class _Window:
+    """A backend's most recent request results, with running totals kept as results come and go"""
+
+    __slots__ = ('results', 'errors', 'latency')
+
+    def __init__(self, size):
+        self.results = deque(maxlen=size)  # (ok, latency)
+        self.errors = 0
+        self.latency = 0.0
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self, ok, latency):
+        if len(self.results) == self.results.maxlen:
+            old_ok, old_latency = self.results.popleft()
+            self.errors -= not old_ok
+            self.latency -= old_latency
+        self.results.append((ok, latency))
+        self.errors += not ok
+        self.latency += latency
+
+    def clear(self):
+        self.results.clear()
+        self.errors = 0
+        self.latency = 0.0
+
+    def error_rate(self):
+        return self.errors / len(self.results)
+
+    def mean_latency(self):
+        return self.latency / len(self.results)
+
+
+class OutlierDetector:
+    """Passive health tracking from the outcome of proxied requests
+
+    Keeps a window of recent results per backend. A backend whose error rate
+    reaches `error_rate`, or whose mean latency exceeds `latency_factor` times
+    the median of the other backends, is ejected for `ejection_time` seconds,
+    doubling with each repeated ejection up to `max_ejection_time`. Ejected
+    backends come back on their own once the period has passed. Recording a
+    result is O(1); the medians are recomputed every `baseline_every` results.
+    """
+
+    def __init__(self, error_rate=0.5, latency_factor=3.0, ejection_time=10, max_ejection_time=300,
+                 window=50, min_requests=10, max_ejection_fraction=0.5, baseline_every=100):
+        """
+        Initialize the detector
+        :param error_rate: Fraction of failed requests in the window that ejects a backend
+        :param latency_factor: Mean latency, relative to the median of the other backends, that ejects a backend
+        :param ejection_time: Seconds a backend is ejected the first time
+        :param max_ejection_time: Upper bound of the doubling ejection time
+        :param window: Number of recent requests kept per backend
+        :param min_requests: Requests a backend needs in its window before it can be ejected
+        :param max_ejection_fraction: Largest fraction of the tracked backends ejected at once
+        :param baseline_every: Results recorded between recomputing the other backends' median latency
+        """
+        self.error_rate = error_rate
+        self.latency_factor = latency_factor
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.window = window
+        self.min_requests = min_requests
+        self.max_ejection_fraction = max_ejection_fraction
+        self.baseline_every = baseline_every
+        self.lock = threading.Lock()
+        self.stats = {}  # server_name -> _Window
+        self.baselines = {}  # server_name -> median mean latency of the other backends
+        self.recorded = 0
+        self.ejected_until = {}  # server_name -> time the ejection ends
+        self.ejections = {}  # server_name -> consecutive ejections, for the backoff
+
+    def is_available(self, server_name):
+        until = self.ejected_until.get(server_name)
+        return until is None or time.monotonic() >= until
+
+    def get_ejected(self):
+        """Get the backends currently ejected and the seconds left for each"""
+        now = time.monotonic()
+        return {name: until - now for name, until in list(self.ejected_until.items()) if until > now}
+
+    def record(self, server_name, ok, latency):
+        """Record the outcome and latency in seconds of one proxied request"""
+        with self.lock:
+            stats = self.stats.get(server_name)
+            if stats is None:
+                stats = self.stats[server_name] = _Window(self.window)
+            stats.add(ok, latency)
+            self.recorded += 1
+            if self.recorded % self.baseline_every == 0:
+                self._update_baselines()
+            if len(stats) >= self.min_requests and self._is_outlier(server_name, stats):
+                self._eject(server_name)
+
+    def _update_baselines(self):
+        """Recompute, for every backend, the median mean latency of the others with enough traffic to judge"""
+        means = sorted((s.mean_latency(), name) for name, s in self.stats.items() if len(s) >= self.min_requests)
+        self.baselines = {}
+        if len(means) < 2:
+            return
+        # Leaving out one backend shifts the median of the rest past it
+        middle = (len(means) - 1) // 2
+        for index, (_, name) in enumerate(means):
+            self.baselines[name] = means[middle if middle < index else middle + 1][0]
+
+    def _is_outlier(self, server_name, stats):
+        if stats.error_rate() >= self.error_rate:
+            return True
+        median = self.baselines.get(server_name)
+        return bool(median) and stats.mean_latency() > self.latency_factor * median
+
+    def _eject(self, server_name):
+        now = time.monotonic()
+        ejected = sum(1 for until in self.ejected_until.values() if until > now)
+        if ejected + 1 > self.max_ejection_fraction * len(self.stats):
+            return
+
+        # Start the backoff over once a backend has stayed healthy for a while
+        until = self.ejected_until.get(server_name)
+        if until is not None and now - until > self.max_ejection_time:
+            self.ejections[server_name] = 0
+
+        ejections = self.ejections.get(server_name, 0) + 1
+        self.ejections[server_name] = ejections
+        duration = min(self.ejection_time * 2 ** (ejections - 1), self.max_ejection_time)
+        self.ejected_until[server_name] = now + duration
+        # Judge the backend afresh when it comes back
+        self.stats[server_name].clear()
+        print(f"Ejected server {server_name} for {duration:.0f}s as an outlier")
+
+    def forget(self, server_name):
+        """Drop the history of a server that left the pool"""
+        with self.lock:
+            self.stats.pop(server_name, None)
+            self.baselines.pop(server_name, None)
+            self.ejected_until.pop(server_name, None)
+            self.ejections.pop(server_name, None)
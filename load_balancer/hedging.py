@@ -0,0 +1,60 @@
+import threading
+from collections import deque
+
+
+class HedgePolicy:
+    """When a slow request gets a second copy sent to the next ring owner
+
+    The hedge delay is the `percentile` of recent upstream response times:
+    a request with no response headers by then is sent again, and whichever
+    copy answers first is used. Each hedgeable request earns `budget` hedges
+    (up to `burst` saved up) and each hedge spends one. So at most about
+    `budget` of the requests add load to a second backend, even when every
+    backend is slow.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, burst=10, window=1000, min_samples=100, min_delay=0.001):
+        """
+        Initialize the policy
+        :param percentile: Percentile of recent response times after which a request is hedged
+        :param budget: Most hedges per request, on average
+        :param burst: Most unspent hedges saved up
+        :param window: Number of recent response times the delay is taken from
+        :param min_samples: Response times needed before requests are hedged
+        :param min_delay: Shortest hedge delay in seconds
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.observed = 0
+        self.delay = None  # None until min_samples response times are in
+        self.tokens = 0.0
+
+    def observe(self, latency):
+        """Record the response time of a successful upstream request"""
+        with self.lock:
+            self.latencies.append(latency)
+            self.observed += 1
+            # Re-sorting the window on every response would cost more than the requests
+            if self.observed % 50 == 0 and len(self.latencies) >= self.min_samples:
+                latencies = sorted(self.latencies)
+                index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+                self.delay = max(self.min_delay, latencies[index])
+
+    def start(self):
+        """Add a hedgeable request to the budget; returns the hedge delay, or None to send it only once"""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.budget)
+        return self.delay
+
+    def try_hedge(self):
+        """Spend one hedge from the budget; False if it is used up"""
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
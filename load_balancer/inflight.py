@@ -0,0 +1,33 @@
+import threading
+
+
+class InFlightCounter:
+    """Number of requests currently outstanding on each backend"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}  # server_name -> requests in flight
+        self.total = 0
+
+    def acquire(self, server_name):
+        with self.lock:
+            self.counts[server_name] = self.counts.get(server_name, 0) + 1
+            self.total += 1
+
+    def release(self, server_name):
+        with self.lock:
+            count = self.counts.get(server_name, 0)
+            if count <= 1:
+                self.counts.pop(server_name, None)
+            else:
+                self.counts[server_name] = count - 1
+            if count:
+                self.total -= 1
+
+    def get(self, server_name):
+        return self.counts.get(server_name, 0)
+
+    def snapshot(self):
+        """Get a copy of the per-backend counts"""
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,68 @@
+# Sources a request's ring key can be taken from
+KEY_SOURCES = ('header', 'cookie', 'query', 'ip', 'path')
+# The client's own request ID, else a random key; `ip` is opt-in because
+# every client behind one NAT or ingress shares an address
+DEFAULT_KEY_RULES = 'header:X-Request-ID'
+
+
+class KeyRule:
+    """One place to look for a request's ring key"""
+
+    def __init__(self, source, name=None):
+        if source not in KEY_SOURCES:
+            raise ValueError(f"Unknown key source {source!r}, expected one of {list(KEY_SOURCES)}")
+        if source == 'path':
+            name = int(name or 0)
+        elif source != 'ip' and not name:
+            raise ValueError(f"Key source {source!r} needs a name, e.g. {source}:session")
+        self.source = source
+        self.name = name
+
+    def extract(self, path, headers, cookies, query, remote_addr):
+        """Get the key from a request, or None if the request does not have it"""
+        if self.source == 'header':
+            return headers.get(self.name)
+        if self.source == 'cookie':
+            return cookies.get(self.name)
+        if self.source == 'query':
+            return query.get(self.name)
+        if self.source == 'ip':
+            return remote_addr
+        segments = [s for s in path.split('/') if s]
+        return segments[self.name] if self.name < len(segments) else None
+
+    def __repr__(self):
+        return self.source if self.name is None else f"{self.source}:{self.name}"
+
+
+class KeyExtractor:
+    """Picks the string a request is hashed by from the first rule that matches it
+
+    Keys are hashed as strings, so any value works as a key, and a client
+    that sends the same session cookie, header or address always lands on
+    the same backend. Requests no rule matches have no key (None); they are
+    placed at a random ring position instead of a random key being hashed.
+    """
+
+    def __init__(self, rules):
+        """
+        Initialize the extractor
+        :param rules: KeyRules tried in order
+        """
+        self.rules = list(rules)
+
+    def extract(self, path, headers, cookies, query, remote_addr):
+        for rule in self.rules:
+            key = rule.extract(path, headers, cookies, query, remote_addr)
+            if key:
+                return key
+        return None
+
+
+def parse_key_rules(spec):
+    """Parse "source[:name],..." (e.g. "cookie:session,header:X-Request-ID,ip") into KeyRules"""
+    rules = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        source, _, name = item.partition(':')
+        rules.append(KeyRule(source.strip().lower(), name.strip() or None))
+    return rules
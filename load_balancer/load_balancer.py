@@ -1,30 +1,215 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import requests
 import os
+import signal
 import threading
 import time
 import random
 import string
 import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from werkzeug.serving import make_server
+from .admission import AdmissionController
+from .analytics import compare_rings
+from .autoscaler import Autoscaler, create_provisioner
+from .cache import CachedResponse, ResponseCache, SingleFlight, etag_matches, parse_route_ttls
 from .consistent_hash import ConsistentHash
+from .failover import FailoverPolicy, UpstreamError
+from .health import HealthChecker, OutlierDetector
+from .hedging import HedgePolicy
+from .inflight import InFlightCounter
+from .keys import DEFAULT_KEY_RULES, KeyExtractor, parse_key_rules
+from .metrics import AccessLog, ProxyMetrics, TimedHTTPAdapter, configure_logging, pop_connect_time
+from .shared_state import SharedRingState
+from .snapshot import read_snapshot, write_snapshot
+from .strategies import create_strategy, parse_strategy_routes
+
+# Headers that describe a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
 
 class LoadBalancer:
-    def __init__(self, num_servers=3, num_slots=512, num_virtual_servers=9):
-        self.app = Flask(__name__)
-        CORS(self.app)
+    admission_class = AdmissionController
+    transport_errors = (requests.exceptions.RequestException,)  # what a failed upstream attempt raises
+    
+    def __init__(self, num_servers=3, num_slots=512, num_virtual_servers=9, hash_bits=None,
+                 pool_size=100, chunk_size=64 * 1024, state_path=None, health_check_interval=5,
+                 health_check_timeout=2, health_check_jitter=0.2, unhealthy_threshold=3,
+                 healthy_threshold=2, outlier_error_rate=0.5, outlier_latency_factor=3.0,
+                 outlier_ejection_time=10, max_attempts=3, attempt_timeout=2, request_deadline=5,
+                 load_epsilon=None, strategy='consistent_hash', strategy_routes=None,
+                 access_log_sample=0.01, cache_max_bytes=0, cache_ttl=0, cache_routes=None,
+                 cache_vary=('Accept', 'Accept-Encoding'), key_rules=None, max_in_flight=None,
+                 admission_queue_size=100, admission_queue_timeout=1.0, adaptive_limit=False,
+                 reject_status=503, retry_after=1, drain_timeout=30, snapshot_path=None,
+                 autoscale_provisioner=None, autoscale_min_servers=1, autoscale_max_servers=10,
+                 autoscale_target_in_flight=50, autoscale_latency_slo=0.5, autoscale_interval=5,
+                 autoscale_out_cooldown=30, autoscale_in_cooldown=120, hedge_percentile=None, hedge_budget=0.05,
+                 health_check_port=None):
+        """
+        Initialize the load balancer
+        :param num_servers: Number of initial servers
+        :param num_slots: Total number of slots in the hash map
+        :param num_virtual_servers: Number of virtual servers per physical server
+        :param hash_bits: Use the full 32- or 64-bit hash ring instead of num_slots
+        :param pool_size: Maximum keep-alive connections kept per backend
+        :param chunk_size: Bytes buffered at a time when streaming bodies through
+        :param state_path: File through which worker processes share the ring;
+            None keeps the ring private to this process
+        :param health_check_interval: Seconds between health check sweeps
+        :param health_check_timeout: Deadline in seconds for each heartbeat probe
+        :param health_check_jitter: Random +/- fraction applied to the sweep interval
+        :param unhealthy_threshold: Consecutive failed probes before a server is ejected
+        :param healthy_threshold: Consecutive successful probes before it is re-admitted
+        :param outlier_error_rate: Recent error rate that temporarily ejects a backend
+        :param outlier_latency_factor: Mean latency, relative to the other backends, that ejects a backend
+        :param outlier_ejection_time: Seconds of the first ejection; doubles on each repeat
+        :param max_attempts: Distinct ring owners a failed idempotent request is tried on
+        :param attempt_timeout: Seconds each attempt may wait to connect and for each read
+        :param request_deadline: Seconds all attempts of a request may take together
+        :param load_epsilon: Enable consistent hashing with bounded loads: no server takes
+            more than (1 + load_epsilon) times the mean number of in-flight requests
+        :param strategy: Balancing strategy name (see strategies.STRATEGIES)
+        :param strategy_routes: {path_prefix: strategy name} overriding the strategy per route
+        :param access_log_sample: Fraction of proxied requests logged at INFO level
+        :param cache_max_bytes: Size of the response cache for GETs; 0 disables it
+        :param cache_ttl: Seconds responses without Cache-Control max-age are cached (0: not cached)
+        :param cache_routes: {path_prefix: seconds} overriding cache_ttl per route
+        :param cache_vary: Request headers that are part of the cache key
+        :param key_rules: KeyRules that pick the string a request is hashed by (see keys.parse_key_rules)
+        :param max_in_flight: Most requests in flight on each backend; None disables admission control
+        :param admission_queue_size: Most requests waiting for a slot on each backend
+        :param admission_queue_timeout: Seconds a request may wait for a slot
+        :param adaptive_limit: Lower and raise each backend's limit with its latency (AIMD), up to max_in_flight
+        :param reject_status: Status code of requests turned away by admission control (503 or 429)
+        :param retry_after: Retry-After seconds sent with rejected requests
+        :param drain_timeout: Seconds in-flight requests get to finish after SIGTERM
+        :param snapshot_path: File the ring is saved to on every membership change and restored from
+            at startup, instead of starting with num_servers fresh servers
+        :param autoscale_provisioner: Provisioner the autoscaler starts servers with (see
+            autoscaler.create_provisioner); None disables autoscaling
+        :param autoscale_min_servers: Fewest servers the autoscaler keeps on the ring
+        :param autoscale_max_servers: Most servers the autoscaler grows the ring to
+        :param autoscale_target_in_flight: Requests in flight per backend that count as full load
+        :param autoscale_latency_slo: p90 upstream latency in seconds that counts as full load
+        :param autoscale_interval: Seconds between the autoscaler's load measurements
+        :param autoscale_out_cooldown: Seconds after a ring change before scaling out again
+        :param autoscale_in_cooldown: Seconds after a ring change before scaling in
+        :param hedge_percentile: Percentile of recent response times after which an idempotent request
+            is also sent to the next ring owner; None disables hedging
+        :param hedge_budget: Most hedged requests per request, on average
+        :param health_check_port: Port heartbeats are sent to when servers answer them on a port of their
+            own (server/gunicorn.conf.py HEARTBEAT_PORT); servers not listening on it, and all servers if
+            None, are probed on the port requests go to
+        """
+        self.app = self._create_app()
         
         # Initialize consistent hash
-        self.consistent_hash = ConsistentHash(
-            num_slots=num_slots,
-            num_virtual_servers=num_virtual_servers
-        )
+        self.ring_config = {
+            'num_slots': num_slots,
+            'num_virtual_servers': num_virtual_servers,
+            'hash_bits': hash_bits
+        }
+        self.consistent_hash = ConsistentHash(**self.ring_config)
+        
+        # Ring membership shared with the other worker processes, if any
+        self.shared_state = SharedRingState(state_path) if state_path else None
+        self.ring_version = 0
+        self.membership_lock = threading.Lock()
+        self.snapshot_path = snapshot_path
         
         # Server configuration
         self.servers = {}
         self.server_port = 5000  # All servers run on port 5000 internally
-        self.health_check_interval = 5  # seconds
+        self.health_check_interval = health_check_interval  # seconds
+        self.health_check_timeout = health_check_timeout
+        self.health_check_jitter = health_check_jitter
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.health_check_port = health_check_port
         self.base_server_name = "Server"
+        self.pool_size = pool_size
+        self.chunk_size = chunk_size
+        
+        # Passive health tracking from proxied responses
+        self.outlier_detector = OutlierDetector(
+            error_rate=outlier_error_rate,
+            latency_factor=outlier_latency_factor,
+            ejection_time=outlier_ejection_time
+        )
+        
+        # Requests in flight per backend, for bounded-load hashing
+        self.in_flight = InFlightCounter()
+        self.load_epsilon = load_epsilon
+        
+        # What a request is hashed by, so a client keeps landing on the same backend
+        self.key_extractor = KeyExtractor(parse_key_rules(DEFAULT_KEY_RULES) if key_rules is None else key_rules)
+        
+        # How requests are spread, for the whole deployment and per path prefix
+        self.strategy = create_strategy(strategy)
+        self.strategy_routes = sorted(
+            ((prefix, create_strategy(name)) for prefix, name in (strategy_routes or {}).items()),
+            key=lambda route: len(route[0]),
+            reverse=True
+        )
+        
+        # Retries move on to the next ring owner within one deadline
+        self.failover_policy = FailoverPolicy(
+            max_attempts=max_attempts,
+            attempt_timeout=attempt_timeout,
+            deadline=request_deadline
+        )
+        
+        # Optional per-backend concurrency limits; excess requests queue briefly, then are turned away
+        self.admission = self.admission_class(
+            max_in_flight,
+            queue_size=admission_queue_size,
+            queue_timeout=admission_queue_timeout,
+            adaptive=adaptive_limit
+        ) if max_in_flight else None
+        self.reject_status = reject_status
+        self.retry_after = retry_after
+        self.drain_timeout = drain_timeout
+        
+        # Optional hedging: slow idempotent requests race a second copy on the next ring owner
+        self.hedging = HedgePolicy(hedge_percentile, budget=hedge_budget) if hedge_percentile else None
+        self.hedge_executor = self._create_hedge_executor() if self.hedging else None
+        
+        # Optional cache of GET responses; concurrent misses share one upstream fetch
+        self.response_cache = ResponseCache(
+            cache_max_bytes,
+            default_ttl=cache_ttl,
+            route_ttls=cache_routes,
+            vary=cache_vary
+        ) if cache_max_bytes else None
+        self.cache_flight = SingleFlight()
+        
+        # Optional autoscaler that adds and removes servers as the backends' load changes
+        self.autoscaler = Autoscaler(
+            self,
+            create_provisioner(autoscale_provisioner),
+            min_servers=autoscale_min_servers,
+            max_servers=autoscale_max_servers,
+            target_in_flight=autoscale_target_in_flight,
+            latency_slo=autoscale_latency_slo,
+            interval=autoscale_interval,
+            scale_out_cooldown=autoscale_out_cooldown,
+            scale_in_cooldown=autoscale_in_cooldown,
+            drain_timeout=drain_timeout,
+            state_path=state_path
+        ) if autoscale_provisioner else None
+        
+        # Latency per proxy stage, served at /metrics, and a sampled access log
+        self.metrics = ProxyMetrics(self)
+        self.access_log = AccessLog(access_log_sample)
+        
+        # Keep-alive connections to the backends
+        self.session = self._create_session()
         
         # Register routes
         self._register_routes()
@@ -34,206 +219,911 @@ class LoadBalancer:
         
         # Start health check thread
         self._start_health_check()
+        
+        if self.autoscaler is not None:
+            self.autoscaler.start()
+    
+    def _create_app(self):
+        app = Flask(__name__)
+        CORS(app)
+        return app
+    
+    def _create_session(self):
+        # One pool per backend host; new connections are timed for the connect latency metric
+        session = requests.Session()
+        session.mount('http://', TimedHTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size))
+        return session
+    
+    def _create_hedge_executor(self):
+        # Hedged attempts block, so each runs on a thread of its own
+        return ThreadPoolExecutor(self.pool_size, thread_name_prefix='hedge')
     
     def _add_initial_servers(self, count):
-        for i in range(1, count + 1):
-            server_name = f"{self.base_server_name}_{i}"
-            hostname = f"server{i}"
-            self.consistent_hash.add_server(server_name, hostname)
-            self.servers[server_name] = {
-                'hostname': hostname,
-                'port': self.server_port,
-                'status': 'healthy'
-            }
-            print(f"Added initial server: {server_name} ({hostname})")
+        with self._membership_change():
+            if self.ring_version:
+                # Another worker has already set up the shared ring
+                return
+            
+            membership = self._read_snapshot()
+            if membership:
+                # Restored at their saved slots, so keys map exactly as before the restart
+                self._apply_batch(restore=membership)
+                print(f"Restored {len(membership)} servers from ring snapshot {self.snapshot_path}")
+                return
+            
+            additions = []
+            for i in range(1, count + 1):
+                server_name = f"{self.base_server_name}_{i}"
+                hostname = f"server{i}"
+                additions.append((server_name, hostname, 1))
+                self.servers[server_name] = {
+                    'hostname': hostname,
+                    'port': self.server_port,
+                    'status': 'healthy'
+                }
+                print(f"Added initial server: {server_name} ({hostname})")
+            self._apply_batch(add=additions)
+    
+    def _load_membership(self, version, membership):
+        consistent_hash = ConsistentHash(**self.ring_config)
+        consistent_hash.set_membership(membership or [])
+        # A single reference swap, so request threads never see a partial ring
+        self.consistent_hash = consistent_hash
+        self.ring_version = version
+    
+    def _sync_ring(self):
+        """Pick up ring changes published by other workers"""
+        if self.shared_state is None or self.shared_state.version == self.ring_version:
+            return
+        self._load_membership(*self.shared_state.read())
+    
+    @contextmanager
+    def _membership_change(self):
+        """Apply ring changes on top of the latest shared membership, then publish them"""
+        with self.membership_lock:
+            if self.shared_state is None:
+                yield
+                self._save_snapshot()
+                return
+            
+            with self.shared_state.lock() as (version, membership):
+                if version != self.ring_version:
+                    self._load_membership(version, membership)
+                yield
+                self.ring_version = self.shared_state.publish(self.consistent_hash.get_membership())
+                self._save_snapshot()
+    
+    def _read_snapshot(self):
+        """Get the membership saved in the ring snapshot, or None if there is none to use"""
+        if not self.snapshot_path:
+            return None
+        try:
+            return read_snapshot(self.snapshot_path, self.consistent_hash.num_slots, self.consistent_hash.hash_bits)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring ring snapshot {self.snapshot_path}: {e}")
+            return None
+    
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            write_snapshot(self.snapshot_path, self.consistent_hash)
+        except OSError as e:
+            print(f"Could not save ring snapshot {self.snapshot_path}: {e}")
+    
+    def _apply_batch(self, **changes):
+        """
+        Apply ConsistentHash.apply_batch changes and swap in the new ring; call inside
+        _membership_change(). Request threads keep using the old ring until the swap.
+        """
+        self.consistent_hash, report = self.consistent_hash.apply_batch(**changes)
+        if report['added'] or report['removed'] or report['reweighted']:
+            print(f"Ring updated: added {report['added']}, removed {report['removed']}, "
+                  f"reweighted {report['reweighted']}; {report['moved_fraction']:.1%} of keys moved "
+                  f"in {len(report['moved'])} ranges")
+        return report
+    
+    def get_replicas(self):
+        """Handle /rep; returns the response payload and status code"""
+        servers = []
+        for server_name in self.consistent_hash.get_servers():
+            server_info = self.consistent_hash.get_server_info(server_name)
+            servers.append({
+                'name': server_name,
+                'hostname': server_info['hostname']
+            })
+        
+        return {
+            'message': {
+                'N': len(servers),
+                'replicas': [s['name'] for s in servers]
+            },
+            'status': 'successful'
+        }, 200
+    
+    def _check_add(self, data):
+        """Validate an /add body; returns an error response or None"""
+        if not data or 'n' not in data:
+            return {
+                'message': 'Invalid request',
+                'status': 'failure'
+            }, 400
+        
+        n = data['n']
+        hostnames = data.get('hostnames', [])
+        weights = data.get('weights', [])
+        
+        if len(hostnames) > n:
+            return {
+                'message': 'Number of hostnames exceeds number of servers to add',
+                'status': 'failure'
+            }, 400
+        
+        if len(weights) > n:
+            return {
+                'message': 'Number of weights exceeds number of servers to add',
+                'status': 'failure'
+            }, 400
+        
+        if not all(_is_weight(w) for w in weights):
+            return {
+                'message': 'Weights must be positive numbers',
+                'status': 'failure'
+            }, 400
+        return None
+    
+    def _additions(self, data):
+        """Get the (server_name, hostname, weight) of each server a valid /add body adds"""
+        hostnames = data.get('hostnames', [])
+        weights = data.get('weights', [])
+        taken = set(self.consistent_hash.get_servers())
+        index = len(taken)
+        additions = []
+        for i in range(data['n']):
+            # Given hostnames name the server and are where it is reached
+            hostname = hostnames[i] if i < len(hostnames) else None
+            weight = weights[i] if i < len(weights) else 1
+            if hostname:
+                server_name = hostname
+            else:
+                index += 1
+                while f"{self.base_server_name}_{index}" in taken:
+                    index += 1
+                server_name = f"{self.base_server_name}_{index}"
+            taken.add(server_name)
+            additions.append((server_name, hostname, weight))
+        return additions
+    
+    def add_servers(self, data):
+        """Handle /add; returns the response payload and status code"""
+        error = self._check_add(data)
+        if error:
+            return error
+        
+        try:
+            with self._membership_change():
+                # All servers join the ring in one swap
+                self._apply_batch(add=self._additions(data))
+        except ValueError as e:
+            # Too many virtual servers for the ring; nothing was changed
+            return {
+                'message': str(e),
+                'status': 'failure'
+            }, 400
+        
+        return {
+            'message': {
+                'N': self.consistent_hash.get_server_count(),
+                'replicas': self.consistent_hash.get_servers()
+            },
+            'status': 'successful'
+        }, 200
+    
+    def _check_weights(self, data):
+        """Validate a /weight body; returns an error response or None"""
+        if not data or not isinstance(data.get('weights'), dict):
+            return {
+                'message': 'Invalid request',
+                'status': 'failure'
+            }, 400
+        
+        weights = data['weights']
+        if not all(_is_weight(w) for w in weights.values()):
+            return {
+                'message': 'Weights must be positive numbers',
+                'status': 'failure'
+            }, 400
+        
+        unknown = [name for name in weights if name not in self.consistent_hash.servers]
+        if unknown:
+            return {
+                'message': f"Unknown servers: {', '.join(unknown)}",
+                'status': 'failure'
+            }, 400
+        return None
+    
+    def set_weights(self, data):
+        """Handle /weight; returns the response payload and status code"""
+        error = self._check_weights(data)
+        if error:
+            return error
+        
+        try:
+            with self._membership_change():
+                # Only the difference in virtual servers is added or removed
+                self._apply_batch(weights=data['weights'])
+        except ValueError as e:
+            return {
+                'message': str(e),
+                'status': 'failure'
+            }, 400
+        
+        return {
+            'message': {
+                'weights': {
+                    name: self.consistent_hash.get_server_info(name)['weight']
+                    for name in self.consistent_hash.get_servers()
+                }
+            },
+            'status': 'successful'
+        }, 200
+    
+    def _check_remove(self, data):
+        """Validate an /rm body; returns an error response or None"""
+        if not data or 'n' not in data:
+            return {
+                'message': 'Invalid request',
+                'status': 'failure'
+            }, 400
+        
+        n = data['n']
+        hostnames = data.get('hostnames', [])
+        
+        if n > self.consistent_hash.get_server_count():
+            return {
+                'message': 'Cannot remove more servers than available',
+                'status': 'failure'
+            }, 400
+        
+        if len(hostnames) > n:
+            return {
+                'message': 'Number of hostnames exceeds number of servers to remove',
+                'status': 'failure'
+            }, 400
+        return None
+    
+    def _removals(self, data):
+        """Get the names of the servers a valid /rm body removes"""
+        # Remove specified servers
+        servers = self.consistent_hash.get_servers()
+        removals = [hostname for hostname in dict.fromkeys(data.get('hostnames', [])) if hostname in servers]
+        
+        # If we still need to remove more servers, remove random ones
+        others = [server_name for server_name in servers if server_name not in removals]
+        removals += random.sample(others, min(data['n'] - len(removals), len(others)))
+        return removals
+    
+    def remove_servers(self, data):
+        """Handle /rm; returns the response payload and status code"""
+        error = self._check_remove(data)
+        if error:
+            return error
+        
+        with self._membership_change():
+            # All servers leave the ring in one swap
+            report = self._apply_batch(remove=self._removals(data))
+        
+        for server_name in report['removed']:
+            self.health_checker.forget(server_name)
+            self.outlier_detector.forget(server_name)
+        if self.autoscaler is not None:
+            self.autoscaler.removed(report['removed'])
+        
+        return {
+            'message': {
+                'N': self.consistent_hash.get_server_count(),
+                'replicas': self.consistent_hash.get_servers()
+            },
+            'status': 'successful'
+        }, 200
+    
+    def preview_changes(self, data):
+        """
+        Handle /preview; reports how many keys the /add, /rm and /weight bodies under
+        'add', 'rm' and 'weights' would move, without applying them
+        """
+        data = data or {}
+        changes = {}
+        if 'add' in data:
+            error = self._check_add(data['add'])
+            if error:
+                return error
+            changes['add'] = self._additions(data['add'])
+        if 'rm' in data:
+            error = self._check_remove(data['rm'])
+            if error:
+                return error
+            changes['remove'] = self._removals(data['rm'])
+        if 'weights' in data:
+            error = self._check_weights(data)
+            if error:
+                return error
+            changes['weights'] = data['weights']
+        
+        current = self.consistent_hash
+        try:
+            preview, report = current.apply_batch(**changes)
+        except ValueError as e:
+            return {
+                'message': str(e),
+                'status': 'failure'
+            }, 400
+        analysis = compare_rings(current, preview)
+        analysis.update(added=report['added'], removed=report['removed'], reweighted=report['reweighted'])
+        return {
+            'message': analysis,
+            'status': 'successful'
+        }, 200
+    
+    def _request_id(self, path, headers, cookies, query, remote_addr):
+        """Get the key a request is hashed by on the ring, or None if it has none"""
+        return self.key_extractor.extract(path, headers, cookies, query, remote_addr)
+    
+    def _strategy_for(self, path):
+        """Balancing strategy of the longest matching path prefix, or the default one"""
+        path = '/' + path.lstrip('/')
+        for prefix, strategy in self.strategy_routes:
+            if path.startswith(prefix):
+                return strategy
+        return self.strategy
+    
+    def _select_servers(self, path, request_id, count):
+        """Get up to count distinct servers for a request, best first"""
+        strategy = self._strategy_for(path)
+        start = time.perf_counter()
+        servers = strategy.select(self, request_id, count)
+        self.metrics.lookup_seconds.observe(time.perf_counter() - start, strategy.name)
+        return servers
+    
+    def _record_connect(self, server_name):
+        """Record the connect time of the upstream request just sent, if it opened a connection"""
+        seconds = pop_connect_time()
+        if seconds is not None:
+            self.metrics.connect_seconds.observe(seconds, server_name)
+    
+    def _record_request(self, method, path, server_name, status, arrived, attempts):
+        """Count a finished request and log it if it is sampled"""
+        elapsed = time.monotonic() - arrived
+        backend = server_name or 'none'
+        status = str(status)
+        self.metrics.requests.inc(backend, status)
+        self.metrics.total_seconds.observe(elapsed, backend, status)
+        if self.access_log.enabled():
+            self.access_log.log(method=method, path='/' + path.lstrip('/'), backend=backend, status=status,
+                                attempts=attempts, ms=f"{elapsed * 1000:.1f}")
+    
+    def _record_admission(self, server_name, queued, rejected):
+        self.metrics.admission_wait_seconds.observe(time.monotonic() - queued, server_name)
+        if rejected:
+            self.metrics.admission_rejected.inc(server_name, rejected)
+    
+    def _admit(self, server_name, timeout):
+        """Wait for a slot on a backend under admission control; returns why the request was turned away, or None"""
+        if self.admission is None:
+            return None
+        queued = time.monotonic()
+        rejected = self.admission.acquire(server_name, timeout)
+        self._record_admission(server_name, queued, rejected)
+        return rejected
+    
+    def _release(self, server_name):
+        """Give back the slot a request held on a backend"""
+        self.in_flight.release(server_name)
+        if self.admission is not None:
+            self.admission.release(server_name)
+    
+    def _record_outcome(self, server_name, ok, latency):
+        """Feed an upstream result to outlier detection, the adaptive concurrency limit, the autoscaler and hedging"""
+        self.outlier_detector.record(server_name, ok, latency)
+        if ok and self.hedging is not None:
+            self.hedging.observe(latency)
+        if self.admission is not None:
+            self.admission.observe(server_name, latency, ok)
+        if self.autoscaler is not None:
+            self.autoscaler.observe(latency)
+    
+    def _backend_url(self, server_name):
+        """Get the base URL of a server, or None if it is not on the ring"""
+        server_info = self.consistent_hash.get_server_info(server_name)
+        if not server_info:
+            return None
+        return self._hostname_url(server_info.get('hostname'))
+    
+    def _hostname_url(self, server_hostname):
+        # Hostnames may carry their own port, e.g. for backends outside Docker
+        if ':' in server_hostname:
+            return f"http://{server_hostname}"
+        return f"http://{server_hostname}:{self.server_port}"
+    
+    def _set_server_status(self, server_name, status):
+        if server_name in self.servers:
+            self.servers[server_name]['status'] = status
+    
+    def _forward_headers(self, headers, overrides=None):
+        """Request headers to send upstream; overrides replace headers, and None drops them"""
+        forwarded = {k: v for k, v in headers.items()
+                     if k.lower() != 'host' and k.lower() not in HOP_BY_HOP_HEADERS}
+        for name, value in (overrides or {}).items():
+            for k in [k for k in forwarded if k.lower() == name.lower()]:
+                del forwarded[k]
+            if value is not None:
+                forwarded[name] = value
+        return forwarded
+    
+    def _upstream_url(self, server_url, path, query_string):
+        """Full URL of a request on a backend, keeping the client's query string"""
+        url = f"{server_url}/{path}"
+        if query_string:
+            url += '?' + (query_string.decode('latin-1') if isinstance(query_string, bytes) else query_string)
+        return url
+    
+    def _request_body(self):
+        """Stream the client's body upstream in chunk_size pieces, or None if it has none"""
+        if request.content_length:
+            return _BodyReader(request.stream, request.content_length)
+        if 'chunked' in request.headers.get('Transfer-Encoding', '').lower():
+            return iter(lambda: request.stream.read(self.chunk_size), b'')  # sent chunked
+        return None
     
     def _register_routes(self):
+        self.app.before_request(self._sync_ring)
+        
         @self.app.route('/rep', methods=['GET'])
         def get_replicas():
-            servers = []
-            for server_name in self.consistent_hash.get_servers():
-                server_info = self.consistent_hash.get_server_info(server_name)
-                servers.append({
-                    'name': server_name,
-                    'hostname': server_info['hostname']
-                })
-            
-            return jsonify({
-                'message': {
-                    'N': len(servers),
-                    'replicas': [s['name'] for s in servers]
-                },
-                'status': 'successful'
-            }), 200
+            payload, status = self.get_replicas()
+            return jsonify(payload), status
         
         @self.app.route('/add', methods=['POST'])
         def add_servers():
-            data = request.get_json()
-            if not data or 'n' not in data:
-                return jsonify({
-                    'message': 'Invalid request',
-                    'status': 'failure'
-                }), 400
-            
-            n = data['n']
-            hostnames = data.get('hostnames', [])
-            
-            if len(hostnames) > n:
-                return jsonify({
-                    'message': 'Number of hostnames exceeds number of servers to add',
-                    'status': 'failure'
-                }), 400
-            
-            added_servers = []
-            for i in range(n):
-                server_name = hostnames[i] if i < len(hostnames) else f"{self.base_server_name}_{len(self.consistent_hash.get_servers()) + 1}"
-                if self.consistent_hash.add_server(server_name):
-                    added_servers.append(server_name)
-            
-            return jsonify({
-                'message': {
-                    'N': self.consistent_hash.get_server_count(),
-                    'replicas': self.consistent_hash.get_servers()
-                },
-                'status': 'successful'
-            }), 200
+            payload, status = self.add_servers(request.get_json())
+            return jsonify(payload), status
+        
+        @self.app.route('/weight', methods=['PUT'])
+        def set_weights():
+            payload, status = self.set_weights(request.get_json())
+            return jsonify(payload), status
+        
+        @self.app.route('/preview', methods=['POST'])
+        def preview_changes():
+            payload, status = self.preview_changes(request.get_json())
+            return jsonify(payload), status
         
         @self.app.route('/rm', methods=['DELETE'])
         def remove_servers():
-            data = request.get_json()
-            if not data or 'n' not in data:
-                return jsonify({
-                    'message': 'Invalid request',
-                    'status': 'failure'
-                }), 400
-            
-            n = data['n']
-            hostnames = data.get('hostnames', [])
-            
-            if n > self.consistent_hash.get_server_count():
-                return jsonify({
-                    'message': 'Cannot remove more servers than available',
-                    'status': 'failure'
-                }), 400
-            
-            if len(hostnames) > n:
-                return jsonify({
-                    'message': 'Number of hostnames exceeds number of servers to remove',
-                    'status': 'failure'
-                }), 400
-            
-            # Remove specified servers
-            removed = 0
-            for hostname in hostnames:
-                if self.consistent_hash.remove_server(hostname):
-                    removed += 1
-            
-            # If we still need to remove more servers, remove random ones
-            remaining = n - removed
-            servers = self.consistent_hash.get_servers()
-            for _ in range(min(remaining, len(servers))):
-                if servers:
-                    self.consistent_hash.remove_server(servers[0])
-            
-            return jsonify({
-                'message': {
-                    'N': self.consistent_hash.get_server_count(),
-                    'replicas': self.consistent_hash.get_servers()
-                },
-                'status': 'successful'
-            }), 200
+            payload, status = self.remove_servers(request.get_json())
+            return jsonify(payload), status
+        
+        @self.app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            return Response(self.metrics.render(), content_type=ProxyMetrics.CONTENT_TYPE)
         
         @self.app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
         def route_request(path):
-            # Get request ID from header or generate one
-            request_id = int(request.headers.get('X-Request-ID', hash(request.remote_addr + str(time.time()))))
+            if self._use_cache(request.method, request.headers):
+                return self._cached_request(path)
+            return self._forward_request(path)
+    
+    def _forward_request(self, path, header_overrides=None):
+        """Proxy the current request to its backends with failover, streaming the response"""
+        arrived = time.monotonic()
+        request_id = self._request_id(path, request.headers, request.cookies, request.args, request.remote_addr)
+        body = self._request_body()
+        
+        # Read here because hedged attempts run on other threads, outside the request context
+        method, query_string, cookies = request.method, request.query_string, request.cookies
+        headers = self._forward_headers(request.headers, header_overrides)
+        
+        def send(server_name, server_url, timeout):
+            url = self._upstream_url(server_url, path, query_string)
+            return self._send(server_name, timeout, method=method, url=url, headers=headers, data=body, cookies=cookies)
+        
+        try:
+            server_name, response, attempts = self._run(self._proxy(method, path, request_id, body is not None), send)
+        except UpstreamError as e:
+            self._record_request(method, path, None, e.status, arrived, e.attempts)
+            return jsonify({"message": e.message, "status": "failure"}), e.status, e.headers
+        
+        def finish():
+            response.close()
+            self._release(server_name)
+            self._record_request(method, path, server_name, response.status_code, arrived, attempts)
+        
+        # Return the response from the server; raw bytes, so Content-Encoding and Content-Length stay valid
+        proxied = Response(
+            response.raw.stream(self.chunk_size, decode_content=False),
+            status=response.status_code,
+            headers=[(k, v) for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+        )
+        # Not the end of the body: HEAD, 204 and 304 responses are never iterated, but always closed
+        proxied.call_on_close(finish)
+        return proxied
+    
+    def _proxy(self, method, path, request_id, has_body):
+        """
+        Target selection, admission, failover and hedging of one request, apart from its I/O
+        A generator run by _run: it yields the I/O it needs as ('admit', server_name, timeout),
+        ('send', server_name, server_url, timeout), ('start', server_name, server_url, timeout) and
+        ('wait', attempts, timeout), and is sent the result or thrown the transport error. Returns
+        (server_name, response, attempts) of the backend response to relay; raises UpstreamError if
+        there is none.
+        """
+        policy = self.failover_policy
+        
+        # The chosen server first, then the ones to fail over to
+        candidates = self._select_servers(path, request_id, policy.attempts(method, has_body))
+        if not candidates:
+            raise UpstreamError(503, "No available servers", 0)
+        
+        deadline = policy.start()
+        error = None
+        overloaded = 0
+        tried = set()  # servers a hedge was already sent to
+        for attempt, server_name in enumerate(candidates):
+            if server_name in tried:
+                continue
             
-            # Get server for this request
-            server_name = self.consistent_hash.get_server(request_id)
-            if server_name is None:
-                return jsonify({"message": "No available servers", "status": "failure"}), 503
+            timeout = policy.timeout(deadline)
+            if timeout is None:
+                raise UpstreamError(504, "Upstream deadline exceeded", attempt)
             
-            server_info = self.consistent_hash.get_server_info(server_name)
-            if not server_info:
-                return jsonify({"message": f"Server {server_name} not found", "status": "failure"}), 503
-                
-            server_hostname = server_info.get('hostname')
-            server_url = f"http://{server_hostname}:{self.server_port}"
-            print(f"Routing request to {server_url}/{path}")
+            server_url = self._backend_url(server_name)
+            if not server_url:
+                continue
+            
+            # Wait for a slot on the backend; a full one fails over like a failed attempt
+            rejected = yield 'admit', server_name, timeout
+            if rejected:
+                overloaded += 1
+                error = f"Server {server_name} is overloaded ({rejected})"
+                continue
             
             try:
-                # Forward the request to the selected server
-                response = requests.request(
-                    method=request.method,
-                    url=f"{server_url}/{path}",
-                    headers={k: v for k, v in request.headers if k != 'Host'},
-                    data=request.get_data(),
-                    cookies=request.cookies,
-                    allow_redirects=False,
-                    timeout=5
-                )
-                
-                # Return the response from the server
-                return (
-                    response.content,
-                    response.status_code,
-                    dict(response.headers)
-                )
-                
-            except requests.exceptions.RequestException as e:
-                # If request fails, remove the server and try again with a different one
-                self.consistent_hash.remove_server(server_name)
-                return self.route_request(path)
-    
-    def _health_check(self):
-        while True:
-            time.sleep(self.health_check_interval)
+                # Only idempotent requests without a body have a next owner to hedge to
+                if self.hedging is not None and attempt + 1 < len(candidates):
+                    server_name, response = yield from self._hedge(server_name, server_url, candidates[attempt + 1],
+                                                                   timeout, tried)
+                else:
+                    response = yield 'send', server_name, server_url, timeout
+            except self.transport_errors as e:
+                error = f"Server {server_name} failed: {e!r}"
+                continue
             
-            for server_name in self.consistent_hash.get_servers()[:]:
-                try:
-                    server_info = self.consistent_hash.get_server_info(server_name)
-                    if not server_info:
-                        print(f"Server {server_name} not found in consistent hash")
-                        continue
-                        
-                    server_hostname = server_info.get('hostname')
-                    if not server_hostname:
-                        print(f"No hostname for server {server_name}")
+            status = self._status(response)
+            if status in policy.retry_statuses and attempt + 1 < len(candidates):
+                self._discard(server_name, response)
+                error = f"Server {server_name} returned {status}"
+                continue
+            return server_name, response, attempt + 1
+        
+        if overloaded == len(candidates):
+            # Every backend is at its limit; tell the client when to come back
+            raise UpstreamError(self.reject_status, error, 0, {'Retry-After': str(self.retry_after)})
+        raise UpstreamError(502, error or "No available servers", len(candidates))
+    
+    def _hedge(self, primary, primary_url, backup, timeout, tried):
+        """
+        Send to the primary server, and to the backup too if the primary has not answered within the
+        hedge delay; returns (server_name, response) of the first to answer without a server error.
+        The other attempt is abandoned. Part of the _proxy generator.
+        """
+        delay = self.hedging.start()
+        if delay is None:
+            response = yield 'send', primary, primary_url, timeout
+            return primary, response
+        
+        attempts = {(yield 'start', primary, primary_url, timeout): primary}
+        winner = error = None
+        pending = set(attempts)
+        try:
+            done, _ = yield 'wait', pending, delay
+            if not done:
+                backup_url = self._backend_url(backup)
+                if not self.hedging.try_hedge():
+                    self.metrics.hedged_requests.inc('no_budget')
+                elif backup_url and not (yield 'admit', backup, 0):
+                    tried.add(backup)
+                    attempts[(yield 'start', backup, backup_url, timeout)] = backup
+                    pending = set(attempts)
+            
+            while pending and winner is None:
+                done, pending = yield 'wait', pending, None
+                for attempt in done:
+                    try:
+                        response = attempt.result()
+                    except self.transport_errors as e:
+                        error = e
                         continue
-                        
-                    response = requests.get(
-                        f"http://{server_hostname}:{self.server_port}/heartbeat",
-                        timeout=2
-                    )
-                    if response.status_code != 200:
-                        print(f"Server {server_name} failed health check with status {response.status_code}")
-                        self.consistent_hash.remove_server(server_name)
-                        if server_name in self.servers:
-                            del self.servers[server_name]
-                        print(f"Removed server {server_name} from pool")
-                        
-                except requests.exceptions.RequestException as e:
-                    print(f"Health check failed for {server_name}: {str(e)}")
-                    self.consistent_hash.remove_server(server_name)
-                    if server_name in self.servers:
-                        del self.servers[server_name]
-                    print(f"Removed server {server_name} from pool due to error")
+                    if winner is None and (self._status(response) < 500 or not pending):
+                        winner = attempt
+                    else:
+                        self._discard(attempts[attempt], response)
+        finally:
+            # Also when the client went away meanwhile
+            for attempt in pending:
+                self._abandon(attempts[attempt], attempt)
+        
+        if len(attempts) > 1:
+            self.metrics.hedged_requests.inc('won' if winner is not None and attempts[winner] == backup else 'lost')
+        if winner is None:
+            raise error
+        return attempts[winner], winner.result()
+    
+    def _run(self, steps, send):
+        """Run a _proxy generator, doing its I/O with blocking calls and hedge threads"""
+        io = {
+            'admit': self._admit,
+            'send': send,
+            'start': lambda *args: self.hedge_executor.submit(send, *args),
+            'wait': lambda attempts, timeout: wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+        }
+        result = error = None
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            op, *args = step
+            try:
+                result, error = io[op](*args), None
+            except self.transport_errors as e:
+                result, error = None, e
+    
+    def _send(self, server_name, timeout, **kwargs):
+        """Send one attempt to a backend; returns the response once its headers are in"""
+        self.in_flight.acquire(server_name)
+        start = time.monotonic()
+        try:
+            # A pooled connection, streaming both bodies instead of buffering them
+            response = self.session.request(allow_redirects=False, timeout=timeout, stream=True, **kwargs)
+        except requests.exceptions.RequestException:
+            # Count the failure; repeated failures eject the server for a while
+            pop_connect_time()  # a failed connect counts as an upstream error instead
+            self.metrics.upstream_errors.inc(server_name)
+            self._release(server_name)
+            self._record_outcome(server_name, False, time.monotonic() - start)
+            raise
+        
+        # With stream=True the call returns once the response headers are in
+        ttfb = time.monotonic() - start
+        self._record_connect(server_name)
+        self.metrics.ttfb_seconds.observe(ttfb, server_name, str(response.status_code))
+        self._record_outcome(server_name, response.status_code < 500, ttfb)
+        return response
+    
+    def _status(self, response):
+        return response.status_code
+    
+    def _discard(self, server_name, response):
+        response.close()
+        self._release(server_name)
+    
+    def _abandon(self, server_name, attempt):
+        """Drop a hedged attempt that lost; a blocking request cannot be cancelled, so its response goes once it is in"""
+        attempt.add_done_callback(partial(self._discard_attempt, server_name))
+    
+    def _discard_attempt(self, server_name, attempt):
+        if attempt.exception() is None:
+            self._discard(server_name, attempt.result())
+    
+    def _use_cache(self, method, headers):
+        return self.response_cache is not None and self.response_cache.accepts(method, headers)
+    
+    def _cache_lookup(self, method, path, query_string, headers):
+        """Get the cache key of a request and its entry, fresh, stale or None"""
+        key = self.response_cache.key(method, path, query_string, headers)
+        return key, self.response_cache.get(key)
+    
+    def _cache_revalidated(self, path, key, entry, status, headers):
+        """Whether a backend response confirmed a stale entry, which is then fresh again"""
+        if status != 304 or entry is None:
+            return False
+        self.response_cache.refresh(key, entry, path, headers)
+        self.metrics.cache_requests.inc('REVALIDATED')
+        return True
+    
+    def _cache_ttl(self, path, status, headers, content_length):
+        """Seconds to cache a backend response for, or None to pass it on uncached"""
+        cache = self.response_cache
+        ttl = cache.ttl_for(path, status, headers)
+        if ttl is None or not cache.fits(content_length):
+            self.metrics.cache_requests.inc('UNCACHEABLE')
+            return None
+        return ttl
+    
+    def _cache_store(self, key, status, headers, body, ttl):
+        entry = CachedResponse(status, headers, body, ttl)
+        self.response_cache.put(key, entry)
+        self.metrics.cache_requests.inc('MISS')
+        return entry
+    
+    def _cached_answer(self, entry, state, if_none_match):
+        """(status, headers, body) answering a client from a cache entry; 304 if the client already has it"""
+        if etag_matches(entry.etag, if_none_match):
+            return 304, [('ETag', entry.etag), ('X-Cache', state)], b''
+        return entry.status, entry.headers + [('Age', str(entry.age())), ('X-Cache', state)], entry.body
+    
+    def _cached_request(self, path):
+        """Answer a GET from the response cache; concurrent misses for one key share a single fetch"""
+        arrived = time.monotonic()
+        key, entry = self._cache_lookup(request.method, path, request.query_string, request.headers)
+        if entry is not None and entry.is_fresh():
+            return self._cache_hit(path, entry, 'HIT', arrived)
+        
+        def fetch():
+            # A stale entry with an ETag is revalidated instead of fetched again; the
+            # client's own conditional headers would make the response unstorable
+            etag = entry.etag if entry is not None else None
+            response = self._forward_request(path, {'If-None-Match': etag, 'If-Modified-Since': None})
+            return self._store_response(path, key, entry, response)
+        
+        response = self.cache_flight.do(key, fetch, self.failover_policy.deadline)
+        if response is not None:
+            return response
+        
+        # Another request has just fetched the key
+        _, entry = self._cache_lookup(request.method, path, request.query_string, request.headers)
+        if entry is not None and entry.is_fresh():
+            return self._cache_hit(path, entry, 'COALESCED', arrived)
+        return self._forward_request(path)
+    
+    def _store_response(self, path, key, entry, response):
+        """Cache a backend response if it may be stored, and answer the client"""
+        if not isinstance(response, Response):
+            return response  # the load balancer's own error
+        
+        if self._cache_revalidated(path, key, entry, response.status_code, response.headers):
+            response.close()  # releases the backend
+            return self._cache_response(entry, 'REVALIDATED')
+        
+        ttl = self._cache_ttl(path, response.status_code, response.headers, response.content_length)
+        if ttl is None:
+            return response
+        
+        try:
+            body = b''.join(response.response)
+        finally:
+            response.close()
+        entry = self._cache_store(key, response.status_code, list(response.headers.items()), body, ttl)
+        return self._cache_response(entry, 'MISS')
+    
+    def _cache_hit(self, path, entry, state, arrived):
+        self.metrics.cache_requests.inc(state)
+        response = self._cache_response(entry, state)
+        self._record_request(request.method, path, 'cache', response.status_code, arrived, 0)
+        return response
+    
+    def _cache_response(self, entry, state):
+        status, headers, body = self._cached_answer(entry, state, request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
     
     def _start_health_check(self):
-        health_check_thread = threading.Thread(target=self._health_check, daemon=True)
-        health_check_thread.start()
+        self.health_checker = HealthChecker(
+            self,
+            interval=self.health_check_interval,
+            timeout=self.health_check_timeout,
+            jitter=self.health_check_jitter,
+            fall=self.unhealthy_threshold,
+            rise=self.healthy_threshold,
+            port=self.health_check_port
+        )
+        self.health_checker.start()
     
     def run(self, host='0.0.0.0', port=5000):
-        # Add initial servers
-        for i in range(1, 4):
-            self.consistent_hash.add_server(f"{self.base_server_name}_{i}", f"server{i}")
+        """Serve on Werkzeug's threaded server, without the debugger or reloader"""
+        print(f"Load balancer listening on {host}:{port}")
+        self._serve_until_stopped(make_server(host, port, self.app, threaded=True))
+    
+    def serve(self, sock):
+        """Serve on an already listening socket"""
+        host, port = sock.getsockname()[:2]
+        self._serve_until_stopped(make_server(host, port, self.app, threaded=True, fd=sock.fileno()))
+    
+    def _serve_until_stopped(self, server):
+        """Serve until SIGTERM, then stop accepting and let in-flight requests finish"""
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever() to return, so it must not run on its thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
         
-        self.app.run(host=host, port=port, debug=True, threaded=True)
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_forever()
+        server.server_close()
+        self.drain(self.drain_timeout)
+    
+    def drain(self, timeout):
+        """Wait up to timeout seconds for the requests in flight on the backends to finish"""
+        deadline = time.monotonic() + timeout
+        while self.in_flight.total and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.in_flight.total:
+            print(f"Drain timed out with {self.in_flight.total} requests in flight")
+
+def _is_weight(value):
+    # bool is an int subclass, but True is not a weight
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+class _BodyReader:
+    """File-like view of a request body of known length
+
+    requests sends it with a Content-Length header, reading it in blocks
+    instead of loading the whole body into memory.
+    """
+    
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.len = length
+    
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+def config_from_env():
+    """Read LoadBalancer settings from the environment"""
+    hash_bits = os.environ.get('HASH_BITS')
+    return {
+        'num_servers': int(os.environ.get('NUM_SERVERS', 3)),
+        'num_slots': int(os.environ.get('NUM_SLOTS', 512)),
+        'num_virtual_servers': int(os.environ.get('NUM_VIRTUAL_SERVERS', 9)),
+        'hash_bits': int(hash_bits) if hash_bits else None,
+        'pool_size': int(os.environ.get('POOL_SIZE', 100)),
+        'chunk_size': int(os.environ.get('CHUNK_SIZE', 64 * 1024)),
+        'state_path': os.environ.get('RING_STATE_PATH'),
+        'snapshot_path': os.environ.get('RING_SNAPSHOT_PATH'),
+        'autoscale_provisioner': os.environ.get('AUTOSCALE_PROVISIONER') or None,
+        'autoscale_min_servers': int(os.environ.get('AUTOSCALE_MIN_SERVERS', 1)),
+        'autoscale_max_servers': int(os.environ.get('AUTOSCALE_MAX_SERVERS', 10)),
+        'autoscale_target_in_flight': float(os.environ.get('AUTOSCALE_TARGET_IN_FLIGHT', 50)),
+        'autoscale_latency_slo': float(os.environ.get('AUTOSCALE_LATENCY_SLO', 0.5)),
+        'autoscale_interval': float(os.environ.get('AUTOSCALE_INTERVAL', 5)),
+        'autoscale_out_cooldown': float(os.environ.get('AUTOSCALE_OUT_COOLDOWN', 30)),
+        'autoscale_in_cooldown': float(os.environ.get('AUTOSCALE_IN_COOLDOWN', 120)),
+        'hedge_percentile': float(os.environ['HEDGE_PERCENTILE']) if os.environ.get('HEDGE_PERCENTILE') else None,
+        'hedge_budget': float(os.environ.get('HEDGE_BUDGET', 0.05)),
+        'health_check_interval': float(os.environ.get('HEALTH_CHECK_INTERVAL', 5)),
+        'health_check_timeout': float(os.environ.get('HEALTH_CHECK_TIMEOUT', 2)),
+        'health_check_jitter': float(os.environ.get('HEALTH_CHECK_JITTER', 0.2)),
+        'health_check_port': int(os.environ.get('HEALTH_CHECK_PORT', 0)) or None,
+        'unhealthy_threshold': int(os.environ.get('UNHEALTHY_THRESHOLD', 3)),
+        'healthy_threshold': int(os.environ.get('HEALTHY_THRESHOLD', 2)),
+        'outlier_error_rate': float(os.environ.get('OUTLIER_ERROR_RATE', 0.5)),
+        'outlier_latency_factor': float(os.environ.get('OUTLIER_LATENCY_FACTOR', 3.0)),
+        'outlier_ejection_time': float(os.environ.get('OUTLIER_EJECTION_TIME', 10)),
+        'max_attempts': int(os.environ.get('MAX_ATTEMPTS', 3)),
+        'attempt_timeout': float(os.environ.get('ATTEMPT_TIMEOUT', 2)),
+        'request_deadline': float(os.environ.get('REQUEST_DEADLINE', 5)),
+        'load_epsilon': float(os.environ['LOAD_EPSILON']) if os.environ.get('LOAD_EPSILON') else None,
+        'strategy': os.environ.get('LB_STRATEGY', 'consistent_hash'),
+        'strategy_routes': parse_strategy_routes(os.environ.get('LB_STRATEGY_ROUTES', '')),
+        'key_rules': parse_key_rules(os.environ.get('LB_KEY_RULES', DEFAULT_KEY_RULES)),
+        'max_in_flight': int(os.environ.get('BACKEND_MAX_IN_FLIGHT', 0)) or None,
+        'admission_queue_size': int(os.environ.get('ADMISSION_QUEUE_SIZE', 100)),
+        'admission_queue_timeout': float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 1.0)),
+        'adaptive_limit': os.environ.get('ADAPTIVE_LIMIT', '').lower() in ('1', 'true', 'yes'),
+        'reject_status': int(os.environ.get('REJECT_STATUS', 503)),
+        'retry_after': int(os.environ.get('RETRY_AFTER', 1)),
+        'drain_timeout': float(os.environ.get('DRAIN_TIMEOUT', 30)),
+        'access_log_sample': float(os.environ.get('ACCESS_LOG_SAMPLE', 0.01)),
+        'cache_max_bytes': int(os.environ.get('CACHE_MAX_BYTES', 0)),
+        'cache_ttl': float(os.environ.get('CACHE_TTL', 0)),
+        'cache_routes': parse_route_ttls(os.environ.get('CACHE_ROUTES', '')),
+        'cache_vary': tuple(h.strip() for h in os.environ.get('CACHE_VARY', 'Accept,Accept-Encoding').split(',') if h.strip())
+    }
 
 def create_app():
-    lb = LoadBalancer()
+    """WSGI app for production servers, e.g. gunicorn -c load_balancer/gunicorn.conf.py"""
+    configure_logging()
+    lb = LoadBalancer(**config_from_env())
     return lb.app
 
 if __name__ == '__main__':
-    lb = LoadBalancer()
+    configure_logging()
+    lb = LoadBalancer(**config_from_env())
     lb.run()
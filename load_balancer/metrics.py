@@ -0,0 +1,240 @@
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Ring lookups take microseconds, so they get finer buckets
+LOOKUP_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3)
+
+
+def _escape_label(value):
+    # The text format only allows \\, \" and \n escapes in label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonic counter per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> count
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        # Only the bucket the value falls in is incremented; samples() accumulates
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: list(counts) for labels, counts in self.values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames + ('le',), labels + (bound,))
+                yield self.name + '_bucket', le, cumulative
+            label_str = _format_labels(self.labelnames, labels)
+            yield self.name + '_sum', label_str, counts[-1]
+            yield self.name + '_count', label_str, cumulative
+
+
+class Gauge:
+    """Value read from a callback when the metrics are rendered"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames, read):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.read = read  # () -> {label values: value}
+
+    def samples(self):
+        for labels, value in sorted(self.read().items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Metrics:
+    """Registry of the load balancer's metrics, rendered in the Prometheus text format"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames, read):
+        return self._register(Gauge(name, help, labelnames, read))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class ProxyMetrics(Metrics):
+    """Where proxy time goes: ring lookup, upstream connect, time to first byte and total"""
+
+    def __init__(self, lb):
+        super().__init__()
+        self.requests = self.counter(
+            'lb_requests_total', 'Proxied requests by backend and status code', ('backend', 'status'))
+        self.upstream_errors = self.counter(
+            'lb_upstream_errors_total', 'Upstream attempts that failed to connect or timed out', ('backend',))
+        self.lookup_seconds = self.histogram(
+            'lb_ring_lookup_seconds', 'Time to pick the backends of a request', ('strategy',), LOOKUP_BUCKETS)
+        self.connect_seconds = self.histogram(
+            'lb_upstream_connect_seconds', 'Time to open a new upstream connection', ('backend',))
+        self.ttfb_seconds = self.histogram(
+            'lb_upstream_ttfb_seconds', 'Time from sending a request upstream to its response headers',
+            ('backend', 'status'))
+        self.total_seconds = self.histogram(
+            'lb_request_seconds', 'Time from receiving a request to sending the last byte of the response',
+            ('backend', 'status'))
+        self.admission_rejected = self.counter(
+            'lb_admission_rejected_total', 'Requests turned away by admission control', ('backend', 'reason'))
+        self.admission_wait_seconds = self.histogram(
+            'lb_admission_wait_seconds', 'Time requests waited for a slot on a backend', ('backend',))
+        self.gauge('lb_concurrency_limit', 'Concurrency limit of each backend', ('backend',),
+                   lambda: {(name,): limit for name, (limit, _, _) in self._admission_snapshot(lb).items()})
+        self.gauge('lb_admission_queued_requests', 'Requests waiting for a slot on each backend', ('backend',),
+                   lambda: {(name,): queued for name, (_, _, queued) in self._admission_snapshot(lb).items()})
+        self.cache_requests = self.counter(
+            'lb_cache_requests_total', 'Cacheable GETs by cache result', ('result',))
+        self.gauge('lb_cache_bytes', 'Size of the cached responses', (),
+                   lambda: {(): lb.response_cache.size if lb.response_cache else 0})
+        self.gauge('lb_in_flight_requests', 'Requests in flight on each backend', ('backend',),
+                   lambda: {(name,): count for name, count in lb.in_flight.snapshot().items()})
+        self.gauge('lb_servers', 'Servers on the hash ring', (),
+                   lambda: {(): lb.consistent_hash.get_server_count()})
+        self.hedged_requests = self.counter(
+            'lb_hedged_requests_total', 'Requests whose hedge delay passed, by which copy answered first',
+            ('result',))
+        self.autoscaler_actions = self.counter(
+            'lb_autoscaler_actions_total', 'Ring changes made by the autoscaler', ('direction',))
+        self.gauge('lb_autoscaler_load', 'Backend load the autoscaler last measured (1: at target)', (),
+                   lambda: {(): lb.autoscaler.load} if lb.autoscaler is not None and lb.autoscaler.active else {})
+
+    @staticmethod
+    def _admission_snapshot(lb):
+        return lb.admission.snapshot() if lb.admission is not None else {}
+
+
+# Time taken by the last new upstream connection opened on this thread
+_connect_times = threading.local()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """urllib3 connection that records how long connect() takes"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_times.seconds = time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """requests adapter whose plain HTTP connections are timed by TimedHTTPConnection"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme, http=TimedHTTPConnectionPool)
+
+
+def pop_connect_time():
+    """Get and clear the connect time recorded on this thread; None if the connection was reused"""
+    seconds = getattr(_connect_times, 'seconds', None)
+    _connect_times.seconds = None
+    return seconds
+
+
+class AccessLog:
+    """Sampled key=value access log, skipped entirely unless INFO is enabled"""
+
+    def __init__(self, sample_rate=0.01, logger=None):
+        self.sample_rate = sample_rate
+        self.logger = logger or logging.getLogger('load_balancer.access')
+
+    def enabled(self):
+        """Whether to log the current request; cheap enough to call on every request"""
+        return self.sample_rate > 0 and self.logger.isEnabledFor(logging.INFO) and random.random() < self.sample_rate
+
+    def log(self, **fields):
+        self.logger.info(' '.join(f"{key}={value}" for key, value in fields.items()))
+
+
+def configure_logging():
+    """Set up logging from LOG_LEVEL (default INFO)"""
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s')
+    # The development server would log every request; AccessLog samples them instead
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
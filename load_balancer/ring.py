@@ -0,0 +1,112 @@
+import bisect
+
+
+def arc_length(start, end, space):
+    """Length of the arc after `start` up to `end` on a ring of `space` positions"""
+    # start == end only when a single position owns the whole ring
+    return (end - start) % space or space
+
+
+class HashRing:
+    """Sorted array of occupied ring positions and the servers that own them.
+
+    Lookups resolve the first occupied position clockwise from a hash with a
+    binary search, so their cost depends on the number of virtual servers on
+    the ring rather than on the size of the hash space.
+    """
+
+    def __init__(self):
+        self.positions = []  # sorted occupied positions
+        self.owners = []  # owners[i] is the server owning positions[i]
+
+    def copy(self):
+        """Get an independent copy of the ring"""
+        ring = HashRing()
+        ring.positions = list(self.positions)
+        ring.owners = list(self.owners)
+        return ring
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, position):
+        i = bisect.bisect_left(self.positions, position)
+        return i < len(self.positions) and self.positions[i] == position
+
+    def insert(self, position, owner):
+        """Place a virtual server of `owner` at `position`"""
+        i = bisect.bisect_left(self.positions, position)
+        # Keep owners sharing a position ordered by name so lookups are deterministic
+        while i < len(self.positions) and self.positions[i] == position and self.owners[i] < owner:
+            i += 1
+        self.positions.insert(i, position)
+        self.owners.insert(i, owner)
+
+    def remove(self, position, owner):
+        """Remove the virtual server of `owner` at `position`"""
+        i = bisect.bisect_left(self.positions, position)
+        while i < len(self.positions) and self.positions[i] == position:
+            if self.owners[i] == owner:
+                del self.positions[i]
+                del self.owners[i]
+                return True
+            i += 1
+        return False
+
+    def lookup(self, position):
+        """Get the owner of the first occupied position at or after `position`"""
+        if not self.positions:
+            return None
+        i = bisect.bisect_left(self.positions, position)
+        if i == len(self.positions):
+            i = 0  # wrap around the ring
+        return self.owners[i]
+
+    def iter_owners(self, position):
+        """Yield each distinct owner once, clockwise from `position`"""
+        n = len(self.positions)
+        if not n:
+            return
+        start = bisect.bisect_left(self.positions, position)
+        seen = set()
+        for k in range(n):
+            owner = self.owners[(start + k) % n]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+
+    def arc_lengths(self, space):
+        """Get the length of the ring arc owned by each server in a ring of `space` positions"""
+        arcs = {}
+        previous = self.positions[-1] - space if self.positions else 0
+        for position, owner in zip(self.positions, self.owners):
+            # A position owns the keys after the previous position up to itself
+            arcs[owner] = arcs.get(owner, 0) + position - previous
+            previous = position
+        return arcs
+
+    def moved_arcs(self, other):
+        """Yield (start, end, owner, other_owner) for each arc whose owner differs in `other`
+
+        An arc holds the keys after `start` up to and including `end`; the arc
+        crossing zero has start > end. Adjacent arcs with the same change are merged.
+        """
+        positions = sorted(set(self.positions) | set(other.positions))
+        arc = None
+        previous = positions[-1] if positions else None
+        for position in positions:
+            # No position of either ring lies inside the arc, so one lookup covers it
+            owners = (self.lookup(position), other.lookup(position))
+            if owners[0] == owners[1]:
+                if arc:
+                    yield arc
+                    arc = None
+            elif arc and arc[2:] == owners:
+                arc = (arc[0], position) + owners
+            else:
+                if arc:
+                    yield arc
+                arc = (previous, position) + owners
+            previous = position
+        if arc:
+            yield arc
@@ -0,0 +1,91 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+def default_state_path():
+    """Fresh per-run ring state file, in memory when /dev/shm is available"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f"lb-ring-{os.getpid()}")
+
+
+class SharedRingState:
+    """Ring membership shared between worker processes through an mmap'd file
+
+    The file starts with a version counter and the payload length, followed
+    by the membership as JSON. Workers compare the counter with the version
+    they last loaded before using their ring, which costs one 8-byte read
+    from shared memory. Writers hold an exclusive flock while they read,
+    modify and republish the membership, so concurrent changes made by
+    different workers are applied one after the other.
+
+    flock locks belong to the open file, which all threads of a worker share:
+    one thread's shared lock would replace, and its unlock drop, another
+    thread's exclusive one. So threads also take a process-local lock first.
+    """
+
+    HEADER = struct.Struct('<QQ')  # version, payload length
+
+    def __init__(self, path, size=16 << 20):
+        """
+        Open (or create) the shared state file
+        :param path: File backing the state; use tmpfs (/dev/shm) to keep it in memory
+        :param size: Maximum size of the file in bytes
+        """
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.size = os.fstat(self.fd).st_size
+        self.mm = mmap.mmap(self.fd, self.size)
+        self.thread_lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Version of the published membership; 0 if nothing was published yet"""
+        return struct.unpack_from('<Q', self.mm, 0)[0]
+
+    def _read(self):
+        version, length = self.HEADER.unpack_from(self.mm, 0)
+        if not version:
+            return 0, None
+        return version, json.loads(self.mm[self.HEADER.size:self.HEADER.size + length])
+
+    def read(self):
+        """Get the current version and membership (None if nothing was published yet)"""
+        with self.thread_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+            try:
+                return self._read()
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def lock(self):
+        """Hold the writer lock; yields the current version and membership"""
+        with self.thread_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield self._read()
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def publish(self, membership):
+        """Write a new membership and bump the version; call while holding lock()"""
+        payload = json.dumps(membership, separators=(',', ':')).encode('utf-8')
+        if self.HEADER.size + len(payload) > self.size:
+            raise ValueError(f"Ring state of {len(payload)} bytes does not fit in {self.path}")
+
+        version = self.version + 1
+        self.mm[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(self.mm, 0, version, len(payload))
+        return version
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
@@ -0,0 +1,96 @@
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b'LBRS'
+FORMAT_VERSION = 1
+# magic, format version, hash bits (0: num_slots ring), num_slots (0: full hash ring), number of servers
+HEADER = struct.Struct('<4sHHQI')
+# server id, weight, name length, hostname length, number of slots
+SERVER = struct.Struct('<IdHHI')
+CHECKSUM = struct.Struct('<I')
+
+
+def _slot_typecode(hash_bits):
+    # Slots below 2**32 take 4 bytes each
+    return 'Q' if hash_bits == 64 else 'I'
+
+
+def dump_ring(consistent_hash):
+    """
+    Encode the membership of a ring as a compact binary snapshot
+    Every server's slots are stored as a fixed-width little-endian array,
+    followed by a CRC32 of everything before it.
+    """
+    typecode = _slot_typecode(consistent_hash.hash_bits)
+    membership = consistent_hash.get_membership()
+    num_slots = 0 if consistent_hash.full_ring else consistent_hash.num_slots
+    parts = [HEADER.pack(MAGIC, FORMAT_VERSION, consistent_hash.hash_bits or 0, num_slots, len(membership))]
+    for server_name, hostname, server_id, slots, weight in membership:
+        name, host = server_name.encode('utf-8'), hostname.encode('utf-8')
+        slot_array = array(typecode, slots)
+        if sys.byteorder == 'big':
+            slot_array.byteswap()
+        parts += [SERVER.pack(server_id, weight, len(name), len(host), len(slots)), name, host,
+                  slot_array.tobytes()]
+    data = b''.join(parts)
+    return data + CHECKSUM.pack(zlib.crc32(data))
+
+
+def load_ring(data, num_slots, hash_bits=None):
+    """
+    Decode a dump_ring() snapshot into ConsistentHash.get_membership() entries
+    :raises ValueError: If the snapshot is corrupt or was taken of a ring with a different slot space
+    """
+    if len(data) < HEADER.size + CHECKSUM.size:
+        raise ValueError("Ring snapshot is truncated")
+    body, (checksum,) = data[:-CHECKSUM.size], CHECKSUM.unpack(data[-CHECKSUM.size:])
+    if zlib.crc32(body) != checksum:
+        raise ValueError("Ring snapshot checksum mismatch")
+
+    magic, version, snapshot_bits, snapshot_slots, count = HEADER.unpack_from(body, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a ring snapshot, or written by an unsupported version")
+    if (snapshot_bits or None) != hash_bits or (not hash_bits and snapshot_slots != num_slots):
+        raise ValueError(f"Ring snapshot has num_slots={snapshot_slots}, hash_bits={snapshot_bits or None}; "
+                         f"this ring has num_slots={num_slots}, hash_bits={hash_bits}")
+
+    typecode = _slot_typecode(hash_bits)
+    offset = HEADER.size
+    membership = []
+    for _ in range(count):
+        server_id, weight, name_len, host_len, slot_count = SERVER.unpack_from(body, offset)
+        offset += SERVER.size
+        server_name = body[offset:offset + name_len].decode('utf-8')
+        offset += name_len
+        hostname = body[offset:offset + host_len].decode('utf-8')
+        offset += host_len
+        slots = array(typecode)
+        slots.frombytes(body[offset:offset + slot_count * slots.itemsize])
+        offset += slot_count * slots.itemsize
+        if sys.byteorder == 'big':
+            slots.byteswap()
+        membership.append([server_name, hostname, server_id, slots.tolist(), weight])
+    return membership
+
+
+def write_snapshot(path, consistent_hash):
+    """Atomically replace the snapshot at path with the ring's current membership"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dump_ring(consistent_hash))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, num_slots, hash_bits=None):
+    """Get the membership saved at path, or None if there is no snapshot yet"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return load_ring(data, num_slots, hash_bits)
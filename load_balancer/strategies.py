@@ -0,0 +1,154 @@
+import math
+import random
+import threading
+
+
+class Strategy:
+    """Policy that picks the backends a request is sent to
+
+    select() returns up to `count` distinct servers, best first; the ones
+    after the first are used for failover.
+    """
+
+    name = None
+
+    def select(self, lb, request_id, count):
+        raise NotImplementedError
+
+    def _available(self, lb):
+        """Servers on the ring that are not ejected as outliers (all of them if every one is)"""
+        servers = lb.consistent_hash.get_servers()
+        available = [s for s in servers if lb.outlier_detector.is_available(s)]
+        return available or servers
+
+
+class ConsistentHashStrategy(Strategy):
+    """Ring owner of the request key, then the next distinct servers clockwise
+
+    With the load balancer's load_epsilon set, servers holding more than
+    (1 + load_epsilon) times the mean in-flight load are passed over when
+    picking the primary (consistent hashing with bounded loads).
+    """
+
+    name = 'consistent_hash'
+
+    def _load_capacity(self, lb):
+        """Most requests one server may have in flight in bounded-load mode, or None"""
+        if lb.load_epsilon is None:
+            return None
+        num_servers = lb.consistent_hash.get_server_count()
+        if not num_servers:
+            return None
+        # Counting the request being placed keeps the bound at least 1
+        return math.ceil((1 + lb.load_epsilon) * (lb.in_flight.total + 1) / num_servers)
+
+    def select(self, lb, request_id, count):
+        capacity = self._load_capacity(lb)
+        servers = []
+        owner = None
+        for server_name in lb.consistent_hash.iter_servers(request_id):
+            owner = owner or server_name
+            if not lb.outlier_detector.is_available(server_name):
+                continue
+            if not servers and capacity is not None and lb.in_flight.get(server_name) >= capacity:
+                # Bounded loads: pass over full servers clockwise to pick the primary
+                continue
+            servers.append(server_name)
+            if len(servers) == count:
+                break
+        # Every server is ejected; the ring owner is still better than failing
+        return servers or ([owner] if owner else [])
+
+
+class LeastOutstandingStrategy(Strategy):
+    """Servers with the fewest requests in flight first"""
+
+    name = 'least_outstanding'
+
+    def select(self, lb, request_id, count):
+        servers = self._available(lb)
+        random.shuffle(servers)  # break ties randomly
+        servers.sort(key=lb.in_flight.get)
+        return servers[:count]
+
+
+class PowerOfTwoChoicesStrategy(Strategy):
+    """The less busy of two servers picked at random
+
+    Nearly as good as least-outstanding at spreading load, without every
+    load balancer worker herding onto the same idlest server.
+    """
+
+    name = 'power_of_two'
+
+    def select(self, lb, request_id, count):
+        servers = self._available(lb)
+        if len(servers) < 2:
+            return servers[:count]
+        first, second = random.sample(servers, 2)
+        if lb.in_flight.get(second) < lb.in_flight.get(first):
+            first, second = second, first
+        rest = [s for s in servers if s != first and s != second]
+        random.shuffle(rest)
+        return ([first, second] + rest)[:count]
+
+
+class WeightedRoundRobinStrategy(Strategy):
+    """Smooth weighted round-robin over the servers' weights
+
+    Each pick adds every server's weight to its running score and takes the
+    highest, which interleaves heavy and light servers evenly.
+    """
+
+    name = 'weighted_round_robin'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scores = {}  # server_name -> current score
+
+    def select(self, lb, request_id, count):
+        servers = self._available(lb)
+        if not servers:
+            return []
+        weights = {}
+        for server_name in servers:
+            server_info = lb.consistent_hash.get_server_info(server_name) or {}
+            weights[server_name] = server_info.get('weight', 1)
+
+        with self.lock:
+            total = sum(weights.values())
+            for server_name, weight in weights.items():
+                self.scores[server_name] = self.scores.get(server_name, 0) + weight
+            best = max(servers, key=lambda s: self.scores[s])
+            self.scores[best] -= total
+            # Drop servers that left the pool
+            for server_name in list(self.scores):
+                if server_name not in weights:
+                    del self.scores[server_name]
+
+        rest = [s for s in servers if s != best]
+        random.shuffle(rest)
+        return ([best] + rest)[:count]
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (ConsistentHashStrategy, LeastOutstandingStrategy, PowerOfTwoChoicesStrategy,
+                WeightedRoundRobinStrategy)
+}
+
+
+def create_strategy(name):
+    """Build a strategy from its name"""
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown balancing strategy {name!r}, expected one of {sorted(STRATEGIES)}")
+    return STRATEGIES[name]()
+
+
+def parse_strategy_routes(spec):
+    """Parse "/prefix=strategy,..." into a {prefix: strategy_name} dict"""
+    routes = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        prefix, _, name = item.partition('=')
+        routes[prefix.strip()] = name.strip()
+    return routes
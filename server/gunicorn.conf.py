@@ -0,0 +1,76 @@
+"""gunicorn settings for a backend server: gunicorn -c gunicorn.conf.py server:app
+
+WORKERS processes with THREADS threads each serve the app. With
+HEARTBEAT_PORT set, the master process answers /heartbeat on that port
+itself, so health checks still get through when every worker thread is busy
+with requests. It answers 200 while any worker has touched its liveness file
+in the last HEARTBEAT_STALE seconds, and 503 once they all stopped serving.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+# server.py sits next to this file, wherever gunicorn is started from
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WORKERS') or os.cpu_count() or 1)
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 8))
+backlog = 2048
+# The load balancer keeps pooled connections open between requests
+keepalive = int(os.environ.get('KEEPALIVE', 30))
+accesslog = None
+
+
+HEARTBEAT_PORT = os.environ.get('HEARTBEAT_PORT')
+HEARTBEAT_STALE = float(os.environ.get('HEARTBEAT_STALE', 5))
+# Made by the master before it forks, so the workers inherit it
+liveness_dir = None
+
+
+def _liveness_path(pid):
+    return os.path.join(liveness_dir, str(pid))
+
+
+def _any_worker_alive(server):
+    now = time.time()
+    for pid in list(server.WORKERS):
+        try:
+            if now - os.stat(_liveness_path(pid)).st_mtime < HEARTBEAT_STALE:
+                return True
+        except FileNotFoundError:
+            pass  # a worker still starting up
+    return False
+
+
+def on_starting(server):
+    global liveness_dir
+    if HEARTBEAT_PORT:
+        liveness_dir = tempfile.mkdtemp(prefix='server-liveness-')
+
+
+def when_ready(server):
+    if HEARTBEAT_PORT:
+        from server import serve_heartbeat
+        serve_heartbeat(int(HEARTBEAT_PORT), lambda: _any_worker_alive(server))
+
+
+def post_worker_init(worker):
+    if HEARTBEAT_PORT:
+        from server import LivenessStamp
+        worker.wsgi = LivenessStamp(worker.wsgi, _liveness_path(worker.pid), worker.cfg.threads,
+                                    stall=HEARTBEAT_STALE)
+
+
+def child_exit(server, worker):
+    if HEARTBEAT_PORT:
+        try:
+            os.remove(_liveness_path(worker.pid))
+        except FileNotFoundError:
+            pass
+
+
+def on_exit(server):
+    if HEARTBEAT_PORT:
+        shutil.rmtree(liveness_dir, ignore_errors=True)
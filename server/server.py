@@ -2,6 +2,9 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 import os
 import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 app = Flask(__name__)
 CORS(app)
@@ -29,8 +32,95 @@ def handle_other_paths(path):
         "status": "failure"
     }), 404
 
+class StaticResponses:
+    """WSGI middleware that answers fixed GET endpoints with responses rendered once at startup
+
+    Each response is produced by the app itself, so clients get the same bytes
+    as before; the hot endpoints just skip routing, CORS and JSON encoding on
+    every request. Everything else goes on to the app.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app.wsgi_app
+        self.responses = {}
+        client = app.test_client()
+        for path in paths:
+            response = client.get(path)
+            self.responses[path] = (response.status, list(response.headers.items()), response.get_data())
+
+    def __call__(self, environ, start_response):
+        response = self.responses.get(environ['PATH_INFO']) if environ['REQUEST_METHOD'] == 'GET' else None
+        if response is None:
+            return self.app(environ, start_response)
+        status, headers, body = response
+        start_response(status, headers)
+        return [body]
+
+app.wsgi_app = StaticResponses(app, ['/home', '/heartbeat'])
+
+class LivenessStamp:
+    """WSGI middleware that touches `path` every `interval` seconds while the app can take requests
+
+    A worker can take requests while it has a free thread, or while its busy
+    threads keep finishing requests. Once all `threads` have been stuck for
+    `stall` seconds, or the whole process stops running, the file's
+    modification time goes stale.
+    """
+
+    def __init__(self, app, path, threads, interval=1, stall=5):
+        self.app = app
+        self.path = path
+        self.threads = threads
+        self.interval = interval
+        self.stall = stall
+        self.lock = threading.Lock()
+        self.active = 0
+        self.finished = time.monotonic()
+        open(path, 'a').close()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.active += 1
+        try:
+            return self.app(environ, start_response)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.finished = time.monotonic()
+
+    def is_alive(self):
+        return self.active < self.threads or time.monotonic() - self.finished < self.stall
+
+    def _run(self):
+        while True:
+            if self.is_alive():
+                os.utime(self.path)
+            time.sleep(self.interval)
+
+def serve_heartbeat(port, is_alive=lambda: True):
+    """Answer GET /heartbeat on a port of its own from a daemon thread, so busy request workers never delay it"""
+    class HeartbeatHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/heartbeat':
+                self.send_response(404)
+            else:
+                self.send_response(200 if is_alive() else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            # Probes arrive every few seconds from every load balancer worker
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), HeartbeatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
 if __name__ == '__main__':
     # Get port from environment variable or use default 5000
     port = int(os.environ.get('PORT', 5000))
+    if os.environ.get('HEARTBEAT_PORT'):
+        serve_heartbeat(int(os.environ['HEARTBEAT_PORT']))
     app.run(host='0.0.0.0', port=port, threaded=True)
-
@@ -0,0 +1,449 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+from aiohttp import web
+
+from load_balancer.consistent_hash import ConsistentHash
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCENTILES = {'p50': 50, 'p95': 95, 'p99': 99, 'p999': 99.9}
+
+
+# --- Statistics -------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+def summarize(latencies, statuses, servers, errors, elapsed):
+    """
+    Reduce raw samples to the figures a run is compared on
+    :param latencies: Seconds per completed request
+    :param statuses: {status code: count}
+    :param servers: {server id from the response body: count}
+    :param errors: Requests that failed without a response
+    :param elapsed: Wall-clock seconds of the run
+    """
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    failed = errors + sum(count for status, count in statuses.items() if status >= 500)
+    latency_ms = {name: round(percentile(latencies, p) * 1000, 3) if latencies else None
+                  for name, p in PERCENTILES.items()}
+    latency_ms['mean'] = round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None
+    latency_ms['max'] = round(latencies[-1] * 1000, 3) if latencies else None
+    return {
+        'requests': total,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round((total - failed) / elapsed, 1) if elapsed else 0,
+        'error_rate': round(failed / total, 5) if total else 0,
+        'latency_ms': latency_ms,
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'servers': dict(sorted(servers.items()))
+    }
+
+
+class Recorder:
+    """Collects the outcome of each request of a run"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.servers = {}
+        self.errors = 0
+
+    async def send(self, session, url, request_id, started=None):
+        """Send one GET; latency counts from `started` (the intended send time) if given"""
+        started = started or time.perf_counter()
+        try:
+            async with session.get(url, headers={'X-Request-ID': str(request_id)}) as response:
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            return
+        self.latencies.append(time.perf_counter() - started)
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        if response.status == 200 and b'Server:' in body:
+            server_id = json.loads(body)['message'].split('Server:')[-1].strip()
+            self.servers[server_id] = self.servers.get(server_id, 0) + 1
+
+    def summary(self, elapsed):
+        return summarize(self.latencies, self.statuses, self.servers, self.errors, elapsed)
+
+
+def request_ids(seed, count):
+    """Reproducible request IDs, sent as X-Request-ID"""
+    rng = random.Random(seed)
+    return [rng.getrandbits(63) for _ in range(count)]
+
+
+# --- Load generation ----------------------------------------------------------
+
+async def closed_loop(url, num_requests, concurrency, seed=0, timeout=10):
+    """`concurrency` clients that each send their next request as soon as the previous one completes"""
+    ids = request_ids(seed, num_requests)
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def client(offset):
+            for request_id in ids[offset::concurrency]:
+                await recorder.send(session, url, request_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        return recorder.summary(time.perf_counter() - start)
+
+
+async def open_loop(url, rate, duration, seed=0, timeout=10):
+    """
+    Requests arriving at a constant `rate` per second for `duration` seconds, whether or not
+    earlier ones have completed. Latency is measured from each request's scheduled send
+    time, so a stalled load balancer shows up in the tail instead of slowing the arrivals.
+    """
+    ids = request_ids(seed, int(rate * duration))
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        tasks = []
+        max_lag = 0
+        start = time.perf_counter()
+        for i, request_id in enumerate(ids):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            tasks.append(asyncio.ensure_future(recorder.send(session, url, request_id, scheduled)))
+        await asyncio.gather(*tasks)
+        summary = recorder.summary(time.perf_counter() - start)
+    summary['offered_rps'] = rate
+    # A large lag means the generator itself could not keep up with the rate
+    summary['max_send_lag_ms'] = round(max_lag * 1000, 3)
+    return summary
+
+
+# --- Fake backends and the load balancer under test ---------------------------
+
+def fake_backend_app(server_id, delay=0.0):
+    """Stand-in for server/server.py that answers the same endpoints, optionally after a delay"""
+    home = json.dumps({"message": f"Hello from Server: {server_id}", "status": "successful"})
+
+    async def handle_home(request):
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(text=home, content_type='application/json')
+
+    async def handle_heartbeat(request):
+        return web.Response(status=200)
+
+    async def handle_other(request):
+        return web.json_response({
+            "message": f"Endpoint /{request.match_info['path']} not found on server {server_id}",
+            "status": "failure"
+        }, status=404)
+
+    app = web.Application()
+    app.router.add_get('/home', handle_home)
+    app.router.add_get('/heartbeat', handle_heartbeat)
+    app.router.add_route('*', '/{path:.*}', handle_other)
+    return app
+
+
+async def serve_fake_backends(ports, delay):
+    for i, port in enumerate(ports, start=1):
+        runner = web.AppRunner(fake_backend_app(i, delay), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+    await asyncio.Event().wait()
+
+
+def serve_lb(mode, port, backends):
+    """Run a load balancer with the given backends on the ring; settings come from the environment"""
+    if mode == 'async':
+        from load_balancer.async_proxy import AsyncLoadBalancer as lb_class, config_from_env_async as config_from_env
+    else:
+        from load_balancer.load_balancer import LoadBalancer as lb_class, config_from_env
+
+    lb = lb_class(**dict(config_from_env(), num_servers=0))
+    lb.add_servers({'n': len(backends), 'hostnames': backends})
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', port))
+    sock.listen(1024)
+    lb.serve(sock)
+
+
+def free_ports(count):
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start_backends(ports, backend, delay, workers=1):
+    """Start the backends in subprocesses: one fake-backend process, or one server/server.py each,
+    on the Flask development server or under gunicorn (server/gunicorn.conf.py)"""
+    if backend == 'gunicorn':
+        procs = [
+            subprocess.Popen(['gunicorn', '-c', os.path.join(REPO_ROOT, 'server', 'gunicorn.conf.py'), 'server:app'],
+                             env=dict(os.environ, SERVER_ID=str(i), PORT=str(port), WORKERS=str(workers)),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for i, port in enumerate(ports, start=1)
+        ]
+    elif backend == 'server':
+        procs = [
+            subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'server', 'server.py')],
+                             env=dict(os.environ, SERVER_ID=str(i), PORT=str(port)),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for i, port in enumerate(ports, start=1)
+        ]
+    else:
+        procs = [subprocess.Popen(
+            [sys.executable, '-m', 'tests.benchmark', 'backends', '--delay-ms', str(delay * 1000),
+             '--ports', ','.join(map(str, ports))],
+            cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+    for port in ports:
+        wait_for_port(port)
+    return procs
+
+
+def start_lb(mode, port, backend_ports, env, serve='dev', workers=1):
+    """Start a load balancer on the development server or under gunicorn (gunicorn.conf.py)"""
+    hostnames = [f'127.0.0.1:{p}' for p in backend_ports]
+    env = dict(os.environ, LOG_LEVEL='WARNING', **env)
+    if serve == 'gunicorn':
+        command = ['gunicorn', '-c', os.path.join('load_balancer', 'gunicorn.conf.py')]
+        env.update(LB_MODE=mode, SERVER_PORT=str(port), NUM_SERVERS='0', WORKERS=str(workers))
+    else:
+        command = [sys.executable, '-m', 'tests.benchmark', 'lb', '--mode', mode, '--port', str(port),
+                   '--backends', ','.join(hostnames)]
+    proc = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+
+    if serve == 'gunicorn':
+        # The workers share the ring, so adding the backends through any of them is enough
+        body = json.dumps({'n': len(hostnames), 'hostnames': hostnames}).encode()
+        add = urllib.request.Request(f'http://127.0.0.1:{port}/add', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(add, timeout=10).close()
+    return proc
+
+
+def run_load(args):
+    """Run the closed- and open-loop scenarios against a fresh local stack or against --target"""
+    procs = []
+    try:
+        if args.target:
+            url = args.target.rstrip('/') + '/home'
+        else:
+            backend_ports = free_ports(args.servers)
+            procs += start_backends(backend_ports, args.backend, args.delay_ms / 1000, args.backend_workers)
+            lb_port = free_ports(1)[0]
+            procs.append(start_lb(args.mode, lb_port, backend_ports, {'HEALTH_CHECK_INTERVAL': '60'},
+                                  serve=args.serve, workers=args.workers))
+            url = f'http://127.0.0.1:{lb_port}/home'
+
+        # Warm up connection pools and hash memos before measuring
+        asyncio.run(closed_loop(url, min(200, args.requests), args.concurrency, seed=args.seed + 1))
+        return {
+            'closed_loop': asyncio.run(closed_loop(url, args.requests, args.concurrency, seed=args.seed)),
+            'open_loop': asyncio.run(open_loop(url, args.rate, args.duration, seed=args.seed))
+        }
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+# --- ConsistentHash microbenchmarks ----------------------------------------
+
+def _per_op_us(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return round((time.perf_counter() - start) / repeat * 1e6, 3)
+
+
+def build_ring(num_servers, num_virtual_servers, hash_bits=None, hash_cache_size=0):
+    ch = ConsistentHash(num_virtual_servers=num_virtual_servers, hash_bits=hash_bits,
+                        hash_cache_size=hash_cache_size)
+    for i in range(1, num_servers + 1):
+        ch.add_server(f"Server_{i}", f"server{i}")
+    return ch
+
+
+def bench_lookup(num_requests=50000, seed=0):
+    """Per-request lookup cost, uncached, for the default ring and a large full-hash ring"""
+    ids = request_ids(seed, num_requests)
+    results = {}
+    for name, ring in (('slots_512_n3_k9', build_ring(3, 9)),
+                       ('full64_n100_k100', build_ring(100, 100, hash_bits=64))):
+        start = time.perf_counter()
+        for request_id in ids:
+            ring.get_server(request_id)
+        results[name] = {'get_server_us': round((time.perf_counter() - start) / num_requests * 1e6, 3)}
+        try:
+            import numpy as np
+        except ImportError:
+            continue
+        bulk_ids = np.array(ids, dtype=np.int64)
+        start = time.perf_counter()
+        ring.get_servers_bulk(bulk_ids)
+        results[name]['get_servers_bulk_us'] = round((time.perf_counter() - start) / num_requests * 1e6, 3)
+    return results
+
+
+def bench_membership():
+    """Cost of adding and removing servers, one at a time and as a copy-on-write batch"""
+    results = {}
+    for name, num_servers, k, hash_bits in (('slots_512_n3_k9', 3, 9, None),
+                                            ('full64_n100_k100', 100, 100, 64)):
+        ring = build_ring(num_servers, k, hash_bits)
+        counter = iter(range(10 ** 9))
+
+        def add_remove():
+            server_name = f"extra_{next(counter)}"
+            ring.add_server(server_name)
+            ring.remove_server(server_name)
+
+        def batch():
+            ring.apply_batch(add=[(f"extra_{next(counter)}", None, 1)], remove=["Server_1"])
+
+        results[name] = {
+            'add_remove_us': _per_op_us(add_remove, 200),
+            'apply_batch_us': _per_op_us(batch, 20)
+        }
+    return results
+
+
+def bench_distribution():
+    """Imbalance (max/mean owned arc) and keys moved when one server joins"""
+    results = {}
+    for name, k, hash_bits in (('slots_512_k9', 9, None), ('full64_k100', 100, 64)):
+        for num_servers in (3, 10, 50):
+            ring = build_ring(num_servers, k, hash_bits)
+            _, report = ring.apply_batch(add=[("extra", None, 1)])
+            results[f'{name}_n{num_servers}'] = {
+                'max_mean_ratio': round(ring.get_distribution(report=True)['max_mean_ratio'], 4),
+                'moved_fraction_on_add': round(report['moved_fraction'], 4),
+                'ideal_moved_fraction': round(1 / (num_servers + 1), 4)
+            }
+    return results
+
+
+def run_micro(args):
+    return {
+        'lookup': bench_lookup(seed=args.seed),
+        'membership': bench_membership(),
+        'distribution': bench_distribution()
+    }
+
+
+# --- Command line -------------------------------------------------------------
+
+def metadata(args):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k != 'command'}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load balancer benchmark suite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('all', 'load', 'micro'):
+        command = commands.add_parser(name)
+        command.add_argument('--output', help="Write the results as JSON to this file")
+        command.add_argument('--seed', type=int, default=0)
+        if name == 'micro':
+            continue
+        command.add_argument('--mode', choices=('flask', 'async'), default='flask')
+        command.add_argument('--serve', choices=('dev', 'gunicorn'), default='dev',
+                             help="Run the local load balancer on the development server or under gunicorn")
+        command.add_argument('--workers', type=int, default=1, help="gunicorn worker processes")
+        command.add_argument('--target', help="Benchmark a running load balancer instead of a local stack")
+        command.add_argument('--backend', choices=('fake', 'server', 'gunicorn'), default='fake',
+                             help="In-process fake backends, or server/server.py on the development server "
+                                  "or under gunicorn")
+        command.add_argument('--backend-workers', type=int, default=1,
+                             help="gunicorn worker processes per backend with --backend gunicorn")
+        command.add_argument('--servers', type=int, default=3)
+        command.add_argument('--delay-ms', type=float, default=0, help="Fake backend response delay")
+        command.add_argument('--requests', type=int, default=5000, help="Closed-loop requests")
+        command.add_argument('--concurrency', type=int, default=32, help="Closed-loop clients")
+        command.add_argument('--rate', type=float, default=500, help="Open-loop arrivals per second")
+        command.add_argument('--duration', type=float, default=10, help="Open-loop seconds")
+
+    backends = commands.add_parser('backends', help="Serve fake backends (used by load)")
+    backends.add_argument('--ports', required=True)
+    backends.add_argument('--delay-ms', type=float, default=0)
+
+    lb = commands.add_parser('lb', help="Serve a load balancer (used by load)")
+    lb.add_argument('--mode', choices=('flask', 'async'), default='flask')
+    lb.add_argument('--port', type=int, required=True)
+    lb.add_argument('--backends', required=True)
+
+    args = parser.parse_args()
+    if args.command == 'backends':
+        asyncio.run(serve_fake_backends([int(p) for p in args.ports.split(',')], args.delay_ms / 1000))
+        return
+    if args.command == 'lb':
+        serve_lb(args.mode, args.port, args.backends.split(','))
+        return
+
+    results = {'meta': metadata(args)}
+    if args.command in ('all', 'micro'):
+        results['micro'] = run_micro(args)
+    if args.command in ('all', 'load'):
+        results['load'] = run_load(args)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
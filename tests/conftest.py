@@ -0,0 +1,142 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+from aiohttp import web
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+from load_balancer.async_proxy import AsyncLoadBalancer
+from load_balancer.load_balancer import LoadBalancer
+
+# The performance test drives a running docker-compose deployment, not the test suite
+collect_ignore = ['performance_test.py']
+
+ETAG = '"v1"'
+
+
+def backend_app(server_id, state):
+    """A stand-in for server/server.py whose answers the tests can change through `state`"""
+    app = Flask(__name__)
+
+    @app.route('/heartbeat')
+    def heartbeat():
+        return '', 200
+
+    @app.route('/home', methods=['GET', 'POST'])
+    def home():
+        if state.get('status'):
+            return jsonify({"message": f"Failing on purpose: {server_id}"}), state['status']
+        time.sleep(state.get('delay', 0))
+        return jsonify({"message": f"Hello from Server: {server_id}", "status": "successful"})
+
+    @app.route('/empty')
+    def empty():
+        return '', 204
+
+    @app.route('/etag')
+    def etag():
+        # No Cache-Control on the 304, as many backends answer
+        if request.headers.get('If-None-Match') == ETAG:
+            return Response(status=304, headers={'ETag': ETAG})
+        return Response(server_id, headers={'ETag': ETAG, 'Cache-Control': 'max-age=60'})
+
+    return app
+
+
+class Backend:
+    """A backend server running on a thread of the test process"""
+
+    def __init__(self):
+        self.state = {}
+        self.server = make_server('127.0.0.1', 0, None, threaded=True)
+        self.hostname = f"127.0.0.1:{self.server.server_port}"
+        self.server.app = backend_app(self.hostname, self.state)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Proxy:
+    """A load balancer in Flask or async mode, listening on a free local port"""
+
+    def __init__(self, mode, **config):
+        config = dict(num_servers=0, health_check_interval=3600, **config)
+        if mode == 'flask':
+            self.lb = LoadBalancer(**config)
+            self.server = make_server('127.0.0.1', 0, self.lb.app, threaded=True)
+            port = self.server.server_port
+            self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        else:
+            self.loop = asyncio.new_event_loop()
+            self.lb = self.loop.run_until_complete(self._create_async(config))
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+            self.runner = web.AppRunner(self.lb.app)
+            self.loop.run_until_complete(self.runner.setup())
+            self.loop.run_until_complete(web.SockSite(self.runner, sock).start())
+            self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.mode = mode
+        self.url = f"http://127.0.0.1:{port}"
+        self.thread.start()
+
+    @staticmethod
+    async def _create_async(config):
+        # aiohttp objects must be created on the loop that runs them
+        return AsyncLoadBalancer(**config)
+
+    def add(self, backends):
+        payload, status = self.lb.add_servers({'n': len(backends), 'hostnames': [b.hostname for b in backends]})
+        assert status == 200, payload
+
+    def stop(self):
+        if self.mode == 'flask':
+            self.server.shutdown()
+            self.server.server_close()
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+
+def wait_for(condition, timeout=2):
+    """Poll until condition() holds; the proxy releases a backend after the client has its response"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def backends():
+    started = []
+
+    def start(count):
+        new = [Backend() for _ in range(count)]
+        started.extend(new)
+        return new
+
+    yield start
+    for backend in started:
+        backend.stop()
+
+
+@pytest.fixture(params=['flask', 'async'])
+def proxy(request):
+    """Factory for load balancers in both modes; keyword arguments are LoadBalancer settings"""
+    started = []
+
+    def start(**config):
+        started.append(Proxy(request.param, **config))
+        return started[-1]
+
+    yield start
+    for proxy in started:
+        proxy.stop()
@@ -1,11 +1,14 @@
 import asyncio
 import aiohttp
+import sys
 import time
 import matplotlib.pyplot as plt
 import numpy as np
-from collections import defaultdict
 import json
 
+from load_balancer.consistent_hash import ConsistentHash
+from tests.benchmark import closed_loop
+
 class LoadBalancerTester:
     def __init__(self, base_url="http://localhost:5000"):
         self.base_url = base_url
@@ -19,30 +22,14 @@ class LoadBalancerTester:
         if self.session:
             await self.session.close()
     
-    async def send_requests(self, endpoint, num_requests):
-        results = defaultdict(int)
-        url = f"{self.base_url}{endpoint}"
-        
-        async def make_request():
-            try:
-                async with self.session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if 'message' in data and 'Server:' in data['message']:
-                            server_id = data['message'].split('Server:')[-1].strip()
-                            return server_id
-            except Exception as e:
-                print(f"Request failed: {e}")
-            return None
-        
-        tasks = [make_request() for _ in range(num_requests)]
-        server_ids = await asyncio.gather(*tasks)
-        
-        for server_id in server_ids:
-            if server_id:
-                results[server_id] += 1
-        
-        return dict(results)
+    async def send_requests(self, endpoint, num_requests, concurrency=100):
+        """Send requests with at most `concurrency` in flight; returns the hits per server"""
+        summary = await closed_loop(f"{self.base_url}{endpoint}", num_requests, concurrency)
+        latency = summary['latency_ms']
+        print(f"{summary['throughput_rps']} req/s, {summary['error_rate']:.2%} errors, "
+              f"latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, "
+              f"p99 {latency['p99']} ms, p99.9 {latency['p999']} ms")
+        return summary['servers']
     
     async def add_servers(self, count):
         url = f"{self.base_url}/add"
@@ -61,6 +48,17 @@ class LoadBalancerTester:
         async with self.session.get(url) as response:
             return await response.json()
 
+def simulate_requests(num_servers, num_requests, num_slots=512, num_virtual_servers=9):
+    """Map random request IDs to servers offline, without sending HTTP requests"""
+    ch = ConsistentHash(num_slots=num_slots, num_virtual_servers=num_virtual_servers)
+    for i in range(1, num_servers + 1):
+        ch.add_server(str(i), f"server{i}")
+    
+    # Random 63-bit IDs stand for distinct clients, each keyed by its own X-Request-ID
+    request_ids = np.random.randint(0, 2**63 - 1, size=num_requests, dtype=np.int64)
+    servers, counts = np.unique(ch.get_servers_bulk(request_ids).astype(str), return_counts=True)
+    return {server: int(count) for server, count in zip(servers, counts)}
+
 async def plot_request_distribution(results, title, filename):
     if not results:
         print("No results to plot")
@@ -80,8 +78,18 @@ async def plot_request_distribution(results, title, filename):
     plt.close()
     print(f"Saved plot to {filename}")
 
-async def test_a1():
+async def test_a1(offline=False):
     """Test A-1: Launch 10000 requests on 3 servers"""
+    if offline:
+        results = simulate_requests(3, 10000)
+        print("Request distribution:", json.dumps(results, indent=2))
+        await plot_request_distribution(
+            results,
+            "Request Distribution with 3 Servers (10000 requests, offline)",
+            "a1_distribution.png"
+        )
+        return results
+    
     async with LoadBalancerTester() as tester:
         # Ensure we have exactly 3 servers
         await tester.remove_servers(10)  # Remove all servers first
@@ -104,22 +112,25 @@ async def test_a1():
         )
         return results
 
-async def test_a2():
+async def test_a2(offline=False):
     """Test A-2: Test scalability from 2 to 6 servers"""
     results = {}
     
     async with LoadBalancerTester() as tester:
         for n in range(2, 7):  # Test with 2 to 6 servers
-            # Reset to N servers
-            await tester.remove_servers(10)  # Remove all servers first
-            await tester.add_servers(n)
-            
-            # Wait for servers to be ready
-            await asyncio.sleep(2)
-            
-            # Send requests
             print(f"\nTesting with {n} servers...")
-            distribution = await tester.send_requests("/home", 10000)
+            if offline:
+                distribution = simulate_requests(n, 10000)
+            else:
+                # Reset to N servers
+                await tester.remove_servers(10)  # Remove all servers first
+                await tester.add_servers(n)
+                
+                # Wait for servers to be ready
+                await asyncio.sleep(2)
+                
+                # Send requests
+                distribution = await tester.send_requests("/home", 10000)
             
             # Calculate metrics
             total_requests = sum(distribution.values())
@@ -179,13 +190,15 @@ async def main():
     print("Starting Load Balancer Performance Tests")
     print("=" * 50)
     
+    # --offline maps requests with ConsistentHash directly instead of over HTTP
+    offline = "--offline" in sys.argv
+    
     # Install required packages if not already installed
     try:
         import aiohttp
         import matplotlib
     except ImportError:
         print("Installing required packages...")
-        import sys
         import subprocess
         subprocess.check_call([sys.executable, "-m", "pip", "install", "aiohttp", "matplotlib"])
     
@@ -193,17 +206,18 @@ async def main():
     print("\n" + "="*50)
     print("TEST A-1: Request Distribution with 3 Servers")
     print("="*50)
-    await test_a1()
+    await test_a1(offline)
     
     print("\n" + "="*50)
     print("TEST A-2: Scalability Test (2-6 Servers)")
     print("="*50)
-    await test_a2()
+    await test_a2(offline)
     
-    print("\n" + "="*50)
-    print("TEST A-3: Failure Recovery")
-    print("="*50)
-    await test_a3()
+    if not offline:
+        print("\n" + "="*50)
+        print("TEST A-3: Failure Recovery")
+        print("="*50)
+        await test_a3()
     
     print("\nTests completed. Check the generated plots for results.")
 
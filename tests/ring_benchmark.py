@@ -0,0 +1,88 @@
+import random
+import time
+
+from load_balancer.consistent_hash import ConsistentHash
+
+
+# 32-bit FNV-1a, written out again so the reference does not share ConsistentHash's code
+FNV_OFFSET_BASIS = 2166136261
+FNV_PRIME = 16777619
+
+
+def fnv1a_32(text):
+    h = FNV_OFFSET_BASIS
+    for byte in text.encode('utf-8'):
+        h = ((h ^ byte) * FNV_PRIME) % 2 ** 32
+    return h
+
+
+class ReferenceRing:
+    """Slot-by-slot model of a num_slots ring, looked up with the clockwise scan used before the sorted ring
+
+    Built only from server names, replica indexes and FNV-1a, so a wrong
+    placement or hash in ConsistentHash gives a different owner.
+    """
+
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self.owners = {}  # slot -> server_name
+
+    def place(self, server_name, replicas, first=0):
+        """Place replicas first..replicas-1 of a server, probing past taken slots"""
+        for j in range(first, replicas):
+            slot = fnv1a_32(f"{server_name}:{j}") % self.num_slots
+            while slot in self.owners:
+                slot = (slot + 1) % self.num_slots
+            self.owners[slot] = server_name
+
+    def remove(self, server_name):
+        self.owners = {slot: owner for slot, owner in self.owners.items() if owner != server_name}
+
+    def lookup(self, request_id):
+        slot = fnv1a_32(str(request_id)) % self.num_slots
+        for i in range(self.num_slots):
+            current_slot = (slot + i) % self.num_slots
+            if current_slot in self.owners:
+                return self.owners[current_slot]
+        return None
+
+
+def build_ring(num_slots, num_servers=3, num_virtual_servers=9):
+    ch = ConsistentHash(num_slots=num_slots, num_virtual_servers=num_virtual_servers)
+    for i in range(1, num_servers + 1):
+        ch.add_server(f"Server_{i}", f"server{i}")
+    return ch
+
+
+def build_reference(num_slots, num_servers=3, num_virtual_servers=9):
+    reference = ReferenceRing(num_slots)
+    for i in range(1, num_servers + 1):
+        reference.place(f"Server_{i}", num_virtual_servers)
+    return reference
+
+
+def time_lookups(lookup, request_ids):
+    start = time.perf_counter()
+    for request_id in request_ids:
+        lookup(request_id)
+    return (time.perf_counter() - start) / len(request_ids)
+
+
+def main(num_requests=20000):
+    # tests/test_consistent_hash.py checks that both lookups agree
+    request_ids = [random.getrandbits(63) for _ in range(num_requests)]
+    print(f"{'num_slots':>12} {'ring lookup (us)':>18} {'linear scan (us)':>18}")
+    for bits in (9, 12, 16, 20, 24, 32):
+        ch = build_ring(2 ** bits)
+        ring_us = time_lookups(ch.get_server, request_ids) * 1e6
+        # The reference scan is O(num_slots), so only run it where it finishes
+        if bits <= 12:
+            scan_us = time_lookups(build_reference(2 ** bits).lookup, request_ids[:200]) * 1e6
+            scan = f"{scan_us:18.2f}"
+        else:
+            scan = f"{'-':>18}"
+        print(f"{'2^' + str(bits):>12} {ring_us:18.2f} {scan}")
+
+
+if __name__ == "__main__":
+    main()
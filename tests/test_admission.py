@@ -0,0 +1,161 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+from load_balancer.admission import (QUEUE_FULL, QUEUE_TIMEOUT, AdmissionController, AsyncAdmissionController,
+                                     ConcurrencyLimit)
+from tests.conftest import wait_for
+
+
+def wait_for_admitted(p):
+    return wait_for(lambda: any(admitted for _, admitted, _ in p.lb.admission.snapshot().values()))
+
+
+def test_sync_requests_queue_up_to_the_limit():
+    controller = AdmissionController(2, queue_size=1, queue_timeout=5)
+    assert controller.acquire('a', 1) is None
+    assert controller.acquire('a', 1) is None
+
+    results = []
+    queued = threading.Thread(target=lambda: results.append(controller.acquire('a', 5)), daemon=True)
+    queued.start()
+    queued.join(0.1)
+    assert queued.is_alive()  # waiting in the queue
+    assert controller.acquire('a', 1) == QUEUE_FULL
+    assert controller.snapshot()['a'] == (2, 2, 1)
+
+    controller.release('a')
+    queued.join(1)
+    assert results == [None]
+    assert controller.snapshot()['a'] == (2, 2, 0)
+
+
+def test_sync_queued_requests_time_out():
+    controller = AdmissionController(1, queue_size=10, queue_timeout=0.05)
+    assert controller.acquire('a', 1) is None
+    assert controller.acquire('a', 1) == QUEUE_TIMEOUT
+    # The request's own deadline can be shorter than the queue timeout
+    controller.queue_timeout = 5
+    assert controller.acquire('a', 0.05) == QUEUE_TIMEOUT
+    assert controller.snapshot()['a'] == (1, 1, 0)
+
+
+def test_async_requests_queue_up_to_the_limit():
+    async def scenario():
+        controller = AsyncAdmissionController(2, queue_size=1, queue_timeout=5)
+        assert await controller.acquire('a', 1) is None
+        assert await controller.acquire('a', 1) is None
+
+        queued = asyncio.ensure_future(controller.acquire('a', 5))
+        await asyncio.sleep(0.01)
+        assert not queued.done()
+        assert await controller.acquire('a', 1) == QUEUE_FULL
+        assert controller.snapshot()['a'] == (2, 2, 1)
+
+        controller.release('a')
+        assert await asyncio.wait_for(queued, 1) is None
+        assert controller.snapshot()['a'] == (2, 2, 0)
+
+    asyncio.run(scenario())
+
+
+def test_async_queued_requests_time_out_or_are_cancelled():
+    async def scenario():
+        controller = AsyncAdmissionController(1, queue_size=10, queue_timeout=0.05)
+        assert await controller.acquire('a', 1) is None
+        assert await controller.acquire('a', 1) == QUEUE_TIMEOUT
+
+        # A client that goes away leaves the queue
+        controller.queue_timeout = 5
+        queued = asyncio.ensure_future(controller.acquire('a', 5))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert controller.snapshot()['a'] == (1, 1, 0)
+
+    asyncio.run(scenario())
+
+
+def test_adaptive_limit_shrinks_and_grows():
+    limit = ConcurrencyLimit(10, adaptive=True, min_limit=2)
+    limit.observe(0.01, True)
+    assert limit.get() == 10
+
+    # Slow responses and failures back off multiplicatively, down to the floor
+    limit.observe(0.1, True)
+    assert limit.value == pytest.approx(9)
+    limit.observe(0.01, False)
+    assert limit.value == pytest.approx(8.1)
+    for _ in range(50):
+        limit.observe(0.01, False)
+    assert limit.get() == 2
+
+    # Fast responses add about one per limit's worth of requests, up to the ceiling
+    for _ in range(4):
+        limit.observe(0.01, True)
+    assert limit.get() == 3
+    for _ in range(200):
+        limit.observe(0.01, True)
+    assert limit.get() == 10
+
+
+def test_fixed_limit_ignores_latency():
+    limit = ConcurrencyLimit(10)
+    for _ in range(10):
+        limit.observe(10, False)
+    assert limit.get() == 10
+
+
+@pytest.mark.parametrize('controller_class', [AdmissionController, AsyncAdmissionController])
+def test_controllers_follow_the_adaptive_limit(controller_class):
+    controller = controller_class(4, adaptive=True, min_limit=1)
+    controller.observe('a', 0.01, True)
+    for _ in range(10):
+        controller.observe('a', 0.01, False)
+    assert controller.snapshot()['a'][0] == 1
+    for _ in range(100):
+        controller.observe('a', 0.01, True)
+    assert controller.snapshot()['a'][0] == 4
+
+    # Observations do nothing without adaptive limits
+    fixed = controller_class(4)
+    fixed.observe('a', 0.01, False)
+    assert 'a' not in fixed.snapshot()
+
+
+def test_overflow_is_rejected_with_retry_after(proxy, backends):
+    p = proxy(max_in_flight=1, admission_queue_size=0, reject_status=429, retry_after=3)
+    backend, = backends(1)
+    p.add([backend])
+    backend.state['delay'] = 0.5
+
+    slow = threading.Thread(target=requests.get, args=(f"{p.url}/home",), daemon=True)
+    slow.start()
+    try:
+        assert wait_for_admitted(p)
+        response = requests.get(f"{p.url}/home")
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '3'
+    finally:
+        slow.join()
+
+
+def test_queue_timeout_is_rejected_with_retry_after(proxy, backends):
+    p = proxy(max_in_flight=1, admission_queue_size=5, admission_queue_timeout=0.1, reject_status=429)
+    backend, = backends(1)
+    p.add([backend])
+    backend.state['delay'] = 0.5
+
+    slow = threading.Thread(target=requests.get, args=(f"{p.url}/home",), daemon=True)
+    slow.start()
+    try:
+        assert wait_for_admitted(p)
+        response = requests.get(f"{p.url}/home")
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        slow.join()
+
@@ -0,0 +1,90 @@
+import pytest
+
+from load_balancer.analytics import compare_rings
+from load_balancer.consistent_hash import ConsistentHash
+from load_balancer.load_balancer import LoadBalancer
+
+
+def build_ring():
+    ch = ConsistentHash(num_slots=512, num_virtual_servers=9)
+    for i in range(1, 5):
+        ch.add_server(f"Server_{i}", f"server{i}")
+    return ch
+
+
+def slot_owner_map(ch):
+    """Owner of every slot, found by walking clockwise to the nearest slot in the servers' own slot lists"""
+    placed = {slot: name for name, info in ch.servers.items() for slot in info['virtual_servers']}
+    owners = []
+    for slot in range(ch.num_slots):
+        current = slot
+        while current not in placed:
+            current = (current + 1) % ch.num_slots
+        owners.append(placed[current])
+    return owners
+
+
+CHANGES = {
+    'add': {'add': [("Server_5", "server5", 1)]},
+    'remove': {'remove': ["Server_2"]},
+    'reweight': {'weights': {"Server_3": 2.5}},
+    'mixed': {'add': [("Server_5", "server5", 0.5)], 'remove': ["Server_1"], 'weights': {"Server_4": 0.3}},
+}
+
+
+@pytest.mark.parametrize('change', CHANGES.values(), ids=CHANGES.keys())
+def test_moved_keys_match_a_sweep_of_every_slot(change):
+    old = build_ring()
+    new, report = old.apply_batch(**change)
+    before, after = slot_owner_map(old), slot_owner_map(new)
+    moved = {slot: (before[slot], after[slot]) for slot in range(512) if before[slot] != after[slot]}
+    assert moved
+
+    analysis = compare_rings(old, new)
+    assert analysis['moved_fraction'] == len(moved) / 512
+    assert report['moved_fraction'] == len(moved) / 512
+    pairs = {}
+    for pair in moved.values():
+        pairs[pair] = pairs.get(pair, 0) + 1
+    assert {(m['from'], m['to']): m['fraction'] * 512 for m in analysis['moved']} == pytest.approx(pairs)
+
+    # The arcs cover exactly the remapped slots: after start, up to and including end
+    covered = {}
+    for arc in report['moved']:
+        slot = arc['start']
+        while slot != arc['end']:
+            slot = (slot + 1) % 512
+            assert slot not in covered
+            covered[slot] = (arc['from'], arc['to'])
+    assert covered == moved
+
+    # Keys hash uniformly onto the slots, so about that fraction of real keys moves
+    keys = [f"user-{i}" for i in range(20000)]
+    remapped = sum(old.get_server(key) != new.get_server(key) for key in keys) / len(keys)
+    assert remapped == pytest.approx(analysis['moved_fraction'], abs=0.02)
+
+
+def test_preview_leaves_the_live_ring_alone():
+    lb = LoadBalancer(num_servers=4, health_check_interval=3600)
+    membership = lb.consistent_hash.get_membership()
+    ring = lb.consistent_hash
+
+    payload, status = lb.preview_changes({
+        'add': {'n': 1, 'hostnames': ['server5']},
+        'rm': {'n': 1, 'hostnames': ['Server_2']},
+        'weights': {'Server_3': 2}
+    })
+    assert status == 200
+    assert payload['message']['added'] == ['server5']
+    assert payload['message']['removed'] == ['Server_2']
+    assert payload['message']['reweighted'] == ['Server_3']
+    assert 0 < payload['message']['moved_fraction'] < 1
+
+    assert lb.consistent_hash is ring
+    assert lb.consistent_hash.get_membership() == membership
+
+    # The same changes, applied, move what the preview said
+    lb.add_servers({'n': 1, 'hostnames': ['server5']})
+    lb.remove_servers({'n': 1, 'hostnames': ['Server_2']})
+    lb.set_weights({'weights': {'Server_3': 2}})
+    assert compare_rings(ring, lb.consistent_hash)['moved_fraction'] == payload['message']['moved_fraction']
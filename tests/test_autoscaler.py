@@ -0,0 +1,132 @@
+import socket
+import time
+
+import pytest
+
+from load_balancer.autoscaler import Autoscaler, LoadBoard, LocalProcessProvisioner, Provisioner
+from load_balancer.load_balancer import LoadBalancer
+
+
+class FakeProvisioner(Provisioner):
+    """Hands out made-up hostnames without starting anything"""
+
+    def __init__(self):
+        self.started = 0
+        self.running = set()
+
+    def provision(self, count):
+        hostnames = [f"10.0.0.{self.started + i + 1}:5000" for i in range(count)]
+        self.started += count
+        self.running.update(hostnames)
+        return hostnames
+
+    def release(self, hostname):
+        self.running.discard(hostname)
+
+
+@pytest.fixture
+def lb():
+    return LoadBalancer(num_servers=0, health_check_interval=3600)
+
+
+def autoscaler(lb, **config):
+    config = dict(dict(target_in_flight=10, latency_slo=0.5, interval=1, scale_out_cooldown=0, scale_in_cooldown=0,
+                       out_periods=1, in_periods=1, min_samples=5, drain_timeout=0), **config)
+    lb.autoscaler = Autoscaler(lb, FakeProvisioner(), **config)
+    return lb.autoscaler
+
+
+def measure(scaler, elapsed=1.0):
+    scaler.window_start = time.monotonic() - elapsed
+    return scaler.measure()
+
+
+def test_measure_littles_law(lb):
+    lb.add_servers({'n': 2, 'hostnames': ['a:1', 'b:1']})
+    scaler = autoscaler(lb, latency_slo=100)
+    # 10 busy seconds in one second: 10 requests in flight on average, 5 per backend
+    for _ in range(100):
+        scaler.observe(0.1)
+    assert measure(scaler) == pytest.approx(0.5, rel=0.01)
+    # Counted once: the next interval starts empty
+    assert measure(scaler) == pytest.approx(0, abs=0.01)
+
+
+def test_measure_p90_latency(lb):
+    lb.add_servers({'n': 1, 'hostnames': ['a:1']})
+    scaler = autoscaler(lb, target_in_flight=1000)
+    for _ in range(100):
+        scaler.observe(0.4)
+    assert measure(scaler, elapsed=1000) == pytest.approx(0.8, rel=0.2)
+
+
+def test_measure_sums_all_workers(lb, tmp_path):
+    # Two load boards on one file stand in for two worker processes
+    lb.add_servers({'n': 1, 'hostnames': ['a:1']})
+    scaler = autoscaler(lb, latency_slo=100, state_path=str(tmp_path / 'ring'))
+    other = LoadBoard(str(tmp_path / 'ring.load'))
+    for _ in range(50):
+        scaler.observe(0.1)
+        other.observe(0.1)
+    other.publish(0)
+    assert measure(scaler) == pytest.approx(1.0, rel=0.01)
+
+    # Requests stuck in flight on the other worker count too
+    other.publish(30)
+    assert measure(scaler) == pytest.approx(3.0, rel=0.01)
+
+
+def test_step_scales_out_and_in(lb):
+    lb.add_servers({'n': 1, 'hostnames': ['a:1']})
+    scaler = autoscaler(lb, latency_slo=100, target_load=0.5)
+    for _ in range(150):
+        scaler.observe(0.1)
+    scaler.window_start = time.monotonic() - 1
+    scaler.step()
+    # Load 1.5 on one server; three servers bring it to 0.5
+    assert lb.consistent_hash.get_server_count() == 3
+    assert len(scaler.provisioner.running) == 2
+
+    scaler.window_start = time.monotonic() - 1
+    scaler.step()
+    assert lb.consistent_hash.get_server_count() == 2
+    assert scaler.provisioner.running == set(scaler.provisioned)
+
+
+def test_removed_servers_are_released_and_ejected_ones_kept(lb):
+    lb.add_servers({'n': 1, 'hostnames': ['a:1']})
+    scaler = autoscaler(lb, in_periods=100)
+    scaler.scale_out(2)
+    removed, ejected = scaler.provisioned
+
+    lb.remove_servers({'n': 1, 'hostnames': [removed]})
+    with lb._membership_change():
+        lb._apply_batch(remove=[ejected])  # as a failed health check does
+    scaler.step()
+    assert scaler.provisioner.running == {ejected}
+    assert scaler.provisioned == [ejected]
+
+
+def test_provisioned_servers_survive_health_checks_on_a_heartbeat_port():
+    # The heartbeat port other servers use accepts connections but never answers
+    hung = socket.socket()
+    hung.bind(('127.0.0.1', 0))
+    hung.listen(8)
+    free = socket.socket()
+    free.bind(('127.0.0.1', 0))
+    base_port = free.getsockname()[1]
+    free.close()
+
+    lb = LoadBalancer(num_servers=0, health_check_interval=3600, health_check_timeout=0.5, unhealthy_threshold=1,
+                      health_check_port=hung.getsockname()[1])
+    provisioner = LocalProcessProvisioner(base_port=base_port)
+    lb.autoscaler = Autoscaler(lb, provisioner)
+    try:
+        hostnames = provisioner.provision(1)
+        assert len(hostnames) == 1
+        lb.add_servers({'n': 1, 'hostnames': hostnames})
+        lb.health_checker.sweep()
+        assert lb.consistent_hash.get_servers() == hostnames
+    finally:
+        provisioner.close()
+        hung.close()
@@ -0,0 +1,22 @@
+from load_balancer.cache import CachedResponse, ResponseCache
+
+
+def revalidate(cache, stored_headers, headers):
+    entry = CachedResponse(200, stored_headers, b'body', 0)
+    cache.refresh('key', entry, '/home', headers)
+    return entry.expires - entry.stored_at
+
+
+def test_304_without_freshness_keeps_stored_max_age():
+    cache = ResponseCache(10000)
+    assert revalidate(cache, [('Cache-Control', 'max-age=60'), ('ETag', '"v1"')], {}) == 60
+
+
+def test_304_freshness_overrides_stored():
+    cache = ResponseCache(10000)
+    assert revalidate(cache, [('Cache-Control', 'max-age=60'), ('ETag', '"v1"')], {'Cache-Control': 'max-age=5'}) == 5
+
+
+def test_304_without_freshness_falls_back_to_route_ttl():
+    cache = ResponseCache(10000, route_ttls={'/home': 7})
+    assert revalidate(cache, [('ETag', '"v1"')], {}) == 7
@@ -0,0 +1,75 @@
+import pytest
+
+from load_balancer.consistent_hash import ConsistentHash
+from tests.ring_benchmark import build_reference, build_ring
+
+
+def assert_matches_reference(ch, reference, num_requests=2000):
+    for request_id in list(range(num_requests)) + [f"user-{i}" for i in range(num_requests)]:
+        assert ch.get_server(request_id) == reference.lookup(request_id), request_id
+
+
+@pytest.mark.parametrize('num_slots', [512, 4096])
+def test_ring_lookup_matches_reference_ring(num_slots):
+    assert_matches_reference(build_ring(num_slots), build_reference(num_slots))
+
+
+def test_ring_lookup_matches_reference_ring_after_changes():
+    ch = build_ring(512, num_servers=5)
+    reference = build_reference(512, num_servers=5)
+    ch.remove_server("Server_2")
+    reference.remove("Server_2")
+    ch.set_weight("Server_3", 3)
+    reference.place("Server_3", 27, first=9)
+    ch.add_server("Server_6", "server6")
+    reference.place("Server_6", 9)
+    assert_matches_reference(ch, reference)
+
+
+def test_more_virtual_servers_than_slots_are_rejected():
+    ch = ConsistentHash(num_slots=512, num_virtual_servers=9)
+    ch.add_server("a", weight=50)
+    ring = list(ch.ring.positions)
+
+    with pytest.raises(ValueError):
+        ch.add_server("b", weight=10)
+    with pytest.raises(ValueError):
+        ch.set_weight("a", 60)
+    with pytest.raises(ValueError):
+        ch.apply_batch(add=[("b", None, 10)])
+
+    assert ch.get_servers() == ["a"]
+    assert ch.get_server_info("a")['weight'] == 50
+    assert ch.ring.positions == ring
+
+    # The full hash ring shares positions instead of probing, so it takes any weight
+    full = ConsistentHash(num_virtual_servers=9, hash_bits=32)
+    full.add_server("a", weight=50)
+    full.add_server("b", weight=10)
+
+
+@pytest.mark.parametrize('config', [{'num_slots': 512}, {'hash_bits': 32}, {'hash_bits': 64}],
+                         ids=['slots_512', 'full32', 'full64'])
+def test_bulk_lookups_match_single_ones(config):
+    np = pytest.importorskip('numpy')
+    ch = ConsistentHash(num_virtual_servers=9, **config)
+    for i in range(1, 6):
+        ch.add_server(f"Server_{i}", f"server{i}")
+
+    ints = list(range(-50, 450)) + [2 ** 62 + 7]
+    strs = [f"user-{i}" for i in range(500)] + ["", "ünïcode-键"]
+    inputs = [ints, strs, np.array(ints, dtype=np.int64), np.array(strs), np.array(ints[:50] + strs[:50], dtype=object)]
+
+    def assert_bulk_matches():
+        for ids in inputs:
+            keys = list(ids.tolist() if isinstance(ids, np.ndarray) else ids)
+            assert ch.hash_requests(ids).tolist() == [ch.hash_request(key) for key in keys]
+            assert ch.get_servers_bulk(ids).tolist() == [ch.get_server(key) for key in keys]
+
+    assert_bulk_matches()
+    # The memoized single lookups keep agreeing once servers come and go
+    ch.add_server("Server_6", "server6")
+    ch.remove_server("Server_2")
+    assert_bulk_matches()
+    ch, _ = ch.apply_batch(add=[("Server_7", "server7", 2)], remove=["Server_1"])
+    assert_bulk_matches()
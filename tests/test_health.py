@@ -0,0 +1,78 @@
+import socket
+
+from load_balancer.health import OutlierDetector
+from load_balancer.load_balancer import LoadBalancer
+
+
+def record(detector, server_name, count, ok=True, latency=0.01):
+    for _ in range(count):
+        detector.record(server_name, ok, latency)
+
+
+def test_error_rate_ejects():
+    detector = OutlierDetector(error_rate=0.5, window=20, min_requests=10)
+    record(detector, 'a', 20)
+    record(detector, 'b', 20)
+    record(detector, 'c', 9, ok=False)
+    assert detector.is_available('c')
+    record(detector, 'c', 1, ok=False)
+    assert not detector.is_available('c')
+
+
+def test_errors_leave_the_window():
+    detector = OutlierDetector(error_rate=0.5, window=10, min_requests=10)
+    record(detector, 'a', 4, ok=False)
+    record(detector, 'a', 20)
+    assert detector.stats['a'].errors == 0
+    assert detector.is_available('a')
+
+
+def test_slow_backend_ejected_against_median_of_others():
+    detector = OutlierDetector(latency_factor=3, window=20, min_requests=10, baseline_every=10)
+    for name in ('a', 'b', 'c'):
+        record(detector, name, 20, latency=0.01)
+    record(detector, 'd', 10, latency=0.01)
+    assert detector.is_available('d')
+    # The slow results push the mean past 3x the others' median once the baseline is recomputed
+    record(detector, 'd', 20, latency=0.1)
+    assert not detector.is_available('d')
+    assert all(detector.is_available(name) for name in ('a', 'b', 'c'))
+
+
+def test_hung_backends_do_not_fail_healthy_ones(backends):
+    # Listening sockets that are never accepted: connects succeed, heartbeats never answer
+    hung = []
+    for _ in range(100):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(8)
+        hung.append(sock)
+    healthy = [backend.hostname for backend in backends(3)]
+    hostnames = [f"127.0.0.1:{sock.getsockname()[1]}" for sock in hung] + healthy
+
+    lb = LoadBalancer(num_servers=0, hash_bits=32, health_check_interval=3600, health_check_timeout=0.3,
+                      unhealthy_threshold=1)
+    lb.add_servers({'n': len(hostnames), 'hostnames': hostnames})
+    try:
+        lb.health_checker.sweep()
+        lb.health_checker.sweep()
+        assert sorted(lb.consistent_hash.get_servers()) == sorted(healthy)
+    finally:
+        for sock in hung:
+            sock.close()
+
+
+def test_servers_without_a_heartbeat_port_are_probed_on_their_own(backends):
+    # A port nothing listens on, as on servers started without HEARTBEAT_PORT
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    heartbeat_port = sock.getsockname()[1]
+    sock.close()
+
+    alive, dead = backends(2)
+    dead.stop()
+    lb = LoadBalancer(num_servers=0, health_check_interval=3600, health_check_timeout=0.3, unhealthy_threshold=1,
+                      health_check_port=heartbeat_port)
+    lb.add_servers({'n': 2, 'hostnames': [alive.hostname, dead.hostname]})
+    lb.health_checker.sweep()
+    assert lb.consistent_hash.get_servers() == [alive.hostname]
@@ -0,0 +1,86 @@
+from collections import Counter
+
+import pytest
+
+from load_balancer.consistent_hash import ConsistentHash
+from load_balancer.keys import DEFAULT_KEY_RULES, KeyExtractor, KeyRule, parse_key_rules
+
+REQUEST = {
+    'path': 'users/42/orders',
+    'headers': {'X-Request-ID': 'req-1', 'X-Tenant': 'acme'},
+    'cookies': {'session': 'abc'},
+    'query': {'user': 'u7'},
+    'remote_addr': '10.0.0.1'
+}
+
+
+def extract(spec, **request):
+    return KeyExtractor(parse_key_rules(spec)).extract(**dict(REQUEST, **request))
+
+
+@pytest.mark.parametrize('spec, key', [
+    ('header:X-Tenant', 'acme'),
+    ('cookie:session', 'abc'),
+    ('query:user', 'u7'),
+    ('ip', '10.0.0.1'),
+    ('path', 'users'),
+    ('path:1', '42'),
+    ('path:2', 'orders'),
+])
+def test_each_source(spec, key):
+    assert extract(spec) == key
+
+
+def test_missing_values_do_not_match():
+    assert extract('header:X-Missing') is None
+    assert extract('cookie:missing') is None
+    assert extract('query:missing') is None
+    assert extract('path:3') is None
+    assert extract('cookie:session', cookies={'session': ''}) is None
+
+
+def test_first_matching_rule_wins():
+    assert extract('cookie:session,header:X-Request-ID') == 'abc'
+    assert extract('header:X-Request-ID,cookie:session') == 'req-1'
+    # Rules that do not match fall through to the next
+    assert extract('cookie:missing, query:user, ip') == 'u7'
+    assert extract('cookie:missing,query:missing,ip') == '10.0.0.1'
+    assert extract('cookie:missing,query:missing') is None
+
+
+def test_default_rules_use_the_request_id_header():
+    assert extract(DEFAULT_KEY_RULES) == 'req-1'
+    assert extract(DEFAULT_KEY_RULES, headers={}) is None
+
+
+def test_parse_key_rules():
+    rules = parse_key_rules(' Cookie:session , header:X-Request-ID,,ip,path:2 ')
+    assert [repr(rule) for rule in rules] == ['cookie:session', 'header:X-Request-ID', 'ip', 'path:2']
+    assert parse_key_rules('') == []
+
+    with pytest.raises(ValueError, match='Unknown key source'):
+        parse_key_rules('body:id')
+    with pytest.raises(ValueError, match='needs a name'):
+        KeyRule('header')
+    with pytest.raises(ValueError):
+        parse_key_rules('path:first')
+
+
+def test_keyless_requests_bypass_the_hash_memo():
+    ch = ConsistentHash(num_virtual_servers=9)
+    for i in range(1, 4):
+        ch.add_server(f"Server_{i}", f"server{i}")
+    extractor = KeyExtractor(parse_key_rules('header:X-Request-ID'))
+    ch.get_server("sticky")
+
+    owners = Counter()
+    for _ in range(3000):
+        key = extractor.extract('home', {}, {}, {}, '10.0.0.1')
+        assert key is None
+        owners[ch.get_server(key)] += 1
+        next(ch.iter_servers(key))
+    assert ch.hash_request.cache_info().currsize == 1
+
+    # Still spread over the whole ring
+    assert set(owners) == set(ch.get_servers())
+    assert min(owners.values()) > 300
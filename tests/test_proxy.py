@@ -0,0 +1,170 @@
+import threading
+import time
+
+import requests
+
+from tests.conftest import ETAG, wait_for
+
+
+def test_bodiless_responses_release_backend(proxy, backends):
+    p = proxy(max_in_flight=2)
+    p.add(backends(1))
+
+    # Werkzeug never iterates the body of these, so only closing the response releases the backend
+    for _ in range(3):
+        requests.head(f"{p.url}/home")
+        assert requests.get(f"{p.url}/etag", headers={'If-None-Match': ETAG}).status_code == 304
+        assert requests.get(f"{p.url}/empty").status_code == 204
+
+    assert wait_for(lambda: p.lb.in_flight.total == 0)
+    assert requests.get(f"{p.url}/home").status_code == 200
+
+
+def test_cached_responses_release_backend(proxy, backends):
+    p = proxy(cache_max_bytes=1 << 20)
+    p.add(backends(1))
+
+    assert requests.get(f"{p.url}/etag").headers['X-Cache'] == 'MISS'
+    assert requests.get(f"{p.url}/etag").headers['X-Cache'] == 'HIT'
+    assert wait_for(lambda: p.lb.in_flight.total == 0)
+
+
+def test_weights_beyond_the_ring_are_rejected(proxy, backends):
+    p = proxy()
+    servers = backends(2)
+
+    # 60 x 9 virtual servers do not fit in 512 slots
+    response = requests.post(f"{p.url}/add", json={'n': 1, 'hostnames': [servers[0].hostname], 'weights': [60]})
+    assert response.status_code == 400
+    response = requests.post(f"{p.url}/add", json={'n': 1, 'hostnames': [servers[0].hostname], 'weights': [50]})
+    assert response.status_code == 200
+    response = requests.put(f"{p.url}/weight", json={'weights': {servers[0].hostname: 60}})
+    assert response.status_code == 400
+
+    # The membership lock was released, so the ring still takes changes
+    response = requests.post(f"{p.url}/add", json={'n': 1, 'hostnames': [servers[1].hostname]})
+    assert response.status_code == 200
+    assert requests.get(f"{p.url}/home").status_code == 200
+
+
+def keys_owned_by(lb, server_name, count=10):
+    """Request IDs whose ring owner is server_name, with the server each fails over to"""
+    keys = {}
+    for i in range(10000):
+        key = f"key-{i}"
+        owners = list(lb.consistent_hash.iter_servers(key))
+        if owners[0] == server_name:
+            keys[key] = owners[1]
+            if len(keys) == count:
+                break
+    return keys
+
+
+def served_by(response):
+    return response.json()['message'].rsplit(' ', 1)[-1]
+
+
+def test_dead_backend_fails_over_to_next_ring_owner(proxy, backends):
+    p = proxy()
+    servers = backends(3)
+    p.add(servers)
+    dead = servers[0]
+    dead.stop()
+
+    for key, next_owner in keys_owned_by(p.lb, dead.hostname).items():
+        response = requests.get(f"{p.url}/home", headers={'X-Request-ID': key})
+        assert response.status_code == 200
+        assert served_by(response) == next_owner
+
+
+def test_unavailable_backend_fails_over_to_next_ring_owner(proxy, backends):
+    p = proxy()
+    servers = backends(3)
+    p.add(servers)
+    servers[0].state['status'] = 503
+
+    for key, next_owner in keys_owned_by(p.lb, servers[0].hostname).items():
+        response = requests.get(f"{p.url}/home", headers={'X-Request-ID': key})
+        assert response.status_code == 200
+        assert served_by(response) == next_owner
+    assert wait_for(lambda: p.lb.in_flight.total == 0)
+
+
+def test_requests_with_a_body_are_not_retried(proxy, backends):
+    p = proxy()
+    servers = backends(2)
+    p.add(servers)
+    servers[0].state['status'] = 503
+
+    # Bodies are streamed upstream and cannot be replayed
+    key = next(iter(keys_owned_by(p.lb, servers[0].hostname, count=1)))
+    response = requests.post(f"{p.url}/home", data=b'body', headers={'X-Request-ID': key})
+    assert response.status_code == 503
+
+
+def test_ring_changes_under_load_cause_no_errors(proxy, backends):
+    p = proxy()
+    servers = backends(6)
+    p.add(servers[:3])
+    for server in servers:
+        server.state['delay'] = 0.005
+
+    statuses = []
+    stop = threading.Event()
+
+    def client(seed):
+        session = requests.Session()
+        i = 0
+        while not stop.is_set():
+            i += 1
+            statuses.append(session.get(f"{p.url}/home", headers={'X-Request-ID': f"{seed}-{i}"}).status_code)
+
+    clients = [threading.Thread(target=client, args=(seed,)) for seed in range(8)]
+    for thread in clients:
+        thread.start()
+    try:
+        # Grow and shrink the ring through the admin API while requests are in flight
+        for _ in range(5):
+            for server in servers[3:]:
+                response = requests.post(f"{p.url}/add", json={'n': 1, 'hostnames': [server.hostname]})
+                assert response.status_code == 200
+                time.sleep(0.02)
+            # Down to the first server, then back to three
+            for server in servers[1:]:
+                response = requests.delete(f"{p.url}/rm", json={'n': 1, 'hostnames': [server.hostname]})
+                assert response.status_code == 200
+                time.sleep(0.02)
+            response = requests.post(f"{p.url}/add", json={'n': 2, 'hostnames': [s.hostname for s in servers[1:3]]})
+            assert response.status_code == 200
+    finally:
+        stop.set()
+        for thread in clients:
+            thread.join()
+
+    assert len(statuses) > 100
+    assert set(statuses) == {200}
+    assert wait_for(lambda: p.lb.in_flight.total == 0)
+
+
+def test_slow_backend_is_hedged_to_next_ring_owner(proxy, backends):
+    p = proxy(hedge_percentile=50, hedge_budget=1, outlier_latency_factor=1000)
+    servers = backends(3)
+    p.add(servers)
+
+    # The hedge delay is only known once enough response times are in
+    session = requests.Session()
+    for i in range(100):
+        assert session.get(f"{p.url}/home", headers={'X-Request-ID': f"warmup-{i}"}).status_code == 200
+
+    slow = servers[0]
+    slow.state['delay'] = 1
+    for key, next_owner in keys_owned_by(p.lb, slow.hostname, count=3).items():
+        start = time.monotonic()
+        response = session.get(f"{p.url}/home", headers={'X-Request-ID': key})
+        assert response.status_code == 200
+        assert served_by(response) == next_owner
+        assert time.monotonic() - start < 0.5
+    assert p.lb.metrics.hedged_requests.values[('won',)] == 3
+
+    # The slow copies are dropped once they answer
+    assert wait_for(lambda: p.lb.in_flight.total == 0, timeout=3)
@@ -0,0 +1,31 @@
+import os
+import threading
+import time
+
+from server.server import LivenessStamp
+
+
+def test_liveness_goes_stale_while_every_thread_is_stuck(tmp_path):
+    release = threading.Event()
+
+    def app(environ, start_response):
+        release.wait()
+        start_response('200 OK', [])
+        return [b'']
+
+    path = tmp_path / 'worker'
+    stamp = LivenessStamp(app, str(path), threads=2, interval=0.05, stall=0.3)
+    assert stamp.is_alive()
+
+    stuck = [threading.Thread(target=stamp, args=({}, lambda *args: None), daemon=True) for _ in range(2)]
+    for thread in stuck:
+        thread.start()
+    try:
+        time.sleep(0.8)
+        assert not stamp.is_alive()
+        assert time.time() - os.stat(path).st_mtime >= 0.3
+    finally:
+        release.set()
+    for thread in stuck:
+        thread.join()
+    assert stamp.is_alive()
@@ -0,0 +1,35 @@
+import fcntl
+import threading
+
+from load_balancer.shared_state import SharedRingState
+
+
+def test_reads_keep_another_threads_writer_lock(tmp_path):
+    path = str(tmp_path / 'ring')
+    worker = SharedRingState(path, size=1 << 16)
+    other_worker = SharedRingState(path, size=1 << 16)  # a second process has a file of its own
+    try:
+        with worker.lock() as (version, membership):
+            assert (version, membership) == (0, None)
+            # A request thread of the same worker picking up ring changes meanwhile
+            reader = threading.Thread(target=worker.read, daemon=True)
+            reader.start()
+            reader.join(0.2)
+            assert reader.is_alive()
+
+            # The writer lock still keeps the other worker out
+            try:
+                fcntl.flock(other_worker.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                taken = True
+            except BlockingIOError:
+                taken = False
+            assert not taken
+            worker.publish([["a", "a", 0, [1], 1]])
+
+        reader.join(2)
+        assert not reader.is_alive()
+        with other_worker.lock() as (version, membership):
+            assert (version, membership) == (1, [["a", "a", 0, [1], 1]])
+    finally:
+        worker.close()
+        other_worker.close()
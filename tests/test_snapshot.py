@@ -0,0 +1,77 @@
+import pytest
+
+from load_balancer.consistent_hash import ConsistentHash
+from load_balancer.load_balancer import LoadBalancer
+from load_balancer.snapshot import dump_ring, load_ring, read_snapshot, write_snapshot
+
+
+def build_ring(**config):
+    ch = ConsistentHash(num_virtual_servers=9, **config)
+    for i in range(1, 5):
+        ch.add_server(f"Server_{i}", f"server{i}", weight=i / 2)
+    ch.remove_server("Server_2")
+    return ch
+
+
+@pytest.mark.parametrize('config', [{'num_slots': 512}, {'hash_bits': 32}, {'hash_bits': 64}],
+                         ids=['slots_512', 'full32', 'full64'])
+def test_dump_load_round_trip(config):
+    ch = build_ring(**config)
+    membership = load_ring(dump_ring(ch), ch.num_slots, ch.hash_bits)
+    assert membership == ch.get_membership()
+
+    restored = ConsistentHash(num_virtual_servers=9, **config)
+    restored.set_membership(membership)
+    assert restored.ring.positions == ch.ring.positions
+    assert restored.ring.owners == ch.ring.owners
+
+
+def test_corrupt_snapshot_is_rejected(tmp_path):
+    path = str(tmp_path / 'ring.snapshot')
+    write_snapshot(path, build_ring())
+    data = bytearray(open(path, 'rb').read())
+    data[len(data) // 2] ^= 0xff
+    open(path, 'wb').write(bytes(data))
+
+    with pytest.raises(ValueError, match='checksum'):
+        read_snapshot(path, 512)
+    with pytest.raises(ValueError, match='truncated'):
+        load_ring(bytes(data[:8]), 512)
+
+
+def test_slot_space_mismatch_is_rejected():
+    data = dump_ring(build_ring())
+    with pytest.raises(ValueError, match='num_slots'):
+        load_ring(data, 1024)
+    with pytest.raises(ValueError, match='hash_bits'):
+        load_ring(data, 512, hash_bits=32)
+    with pytest.raises(ValueError, match='hash_bits'):
+        load_ring(dump_ring(build_ring(hash_bits=32)), 512, hash_bits=64)
+
+
+def owners(lb, keys):
+    return {key: lb.consistent_hash.get_server(key) for key in keys}
+
+
+def test_restart_keeps_key_mapping(tmp_path):
+    path = str(tmp_path / 'ring.snapshot')
+    keys = [f"key-{i}" for i in range(1000)]
+    lb = LoadBalancer(num_servers=3, health_check_interval=3600, snapshot_path=path)
+    lb.add_servers({'n': 2, 'hostnames': ['extra1', 'extra2'], 'weights': [2, 0.5]})
+    lb.remove_servers({'n': 1, 'hostnames': ['Server_2']})
+    before = owners(lb, keys)
+
+    # A fresh start would add NUM_SERVERS new servers; the snapshot brings back the ring as it was
+    restarted = LoadBalancer(num_servers=3, health_check_interval=3600, snapshot_path=path)
+    assert restarted.consistent_hash.get_membership() == lb.consistent_hash.get_membership()
+    assert owners(restarted, keys) == before
+
+
+def test_snapshot_of_another_slot_space_is_ignored(tmp_path, capsys):
+    path = str(tmp_path / 'ring.snapshot')
+    lb = LoadBalancer(num_servers=0, health_check_interval=3600, snapshot_path=path)
+    lb.add_servers({'n': 1, 'hostnames': ['extra1']})
+
+    restarted = LoadBalancer(num_servers=2, hash_bits=32, health_check_interval=3600, snapshot_path=path)
+    assert sorted(restarted.consistent_hash.get_servers()) == ['Server_1', 'Server_2']
+    assert 'Ignoring ring snapshot' in capsys.readouterr().out
@@ -0,0 +1,140 @@
+import random
+import time
+from collections import Counter
+
+import pytest
+
+from load_balancer.load_balancer import LoadBalancer
+from load_balancer.strategies import (STRATEGIES, ConsistentHashStrategy, LeastOutstandingStrategy,
+                                      PowerOfTwoChoicesStrategy, WeightedRoundRobinStrategy, create_strategy,
+                                      parse_strategy_routes)
+
+SERVERS = ['a:1', 'b:1', 'c:1']
+
+
+def balancer(**config):
+    lb = LoadBalancer(num_servers=0, health_check_interval=3600, **config)
+    lb.add_servers({'n': len(SERVERS), 'hostnames': SERVERS})
+    return lb
+
+
+def key_owned_by(lb, server_name):
+    """A request key whose ring owner is server_name, and the owners clockwise after it"""
+    for i in range(10000):
+        owners = list(lb.consistent_hash.iter_servers(f"key-{i}"))
+        if owners[0] == server_name:
+            return f"key-{i}", owners
+
+
+def test_full_server_spills_to_next_ring_owner_and_gets_its_keys_back():
+    lb = balancer(load_epsilon=0.25)
+    strategy = ConsistentHashStrategy()
+    key, owners = key_owned_by(lb, 'a:1')
+    assert strategy.select(lb, key, 1) == ['a:1']
+
+    # 3 in flight, all on a: the cap is ceil(1.25 * 4 / 3) = 2, so a is full
+    for _ in range(3):
+        lb.in_flight.acquire('a:1')
+    assert strategy.select(lb, key, 2) == owners[1:3]
+
+    # With a single request left on a it is still at the cap, ceil(1.25 * 2 / 3) = 1
+    lb.in_flight.release('a:1')
+    lb.in_flight.release('a:1')
+    assert strategy.select(lb, key, 1) == [owners[1]]
+
+    # Once load drops below the cap the key returns to its owner
+    lb.in_flight.release('a:1')
+    assert strategy.select(lb, key, 1) == ['a:1']
+
+
+def test_unbounded_ring_ignores_load():
+    lb = balancer()
+    key, owners = key_owned_by(lb, 'a:1')
+    for _ in range(100):
+        lb.in_flight.acquire('a:1')
+    assert ConsistentHashStrategy().select(lb, key, 3) == owners
+
+
+def eject(lb, server_name):
+    lb.outlier_detector.ejected_until[server_name] = time.monotonic() + 60
+
+
+def load(lb, **counts):
+    for server_name, count in counts.items():
+        for _ in range(count):
+            lb.in_flight.acquire(f"{server_name}:1")
+
+
+def test_consistent_hash_picks_ring_owners_clockwise():
+    lb = balancer()
+    strategy = ConsistentHashStrategy()
+    key, owners = key_owned_by(lb, 'a:1')
+    assert strategy.select(lb, key, 3) == owners
+    assert strategy.select(lb, key, 1) == owners[:1]
+
+    # Ejected outliers are passed over, unless every server is ejected
+    eject(lb, 'a:1')
+    assert strategy.select(lb, key, 3) == owners[1:]
+    for server_name in owners[1:]:
+        eject(lb, server_name)
+    assert strategy.select(lb, key, 3) == ['a:1']
+
+
+def test_least_outstanding_picks_the_idlest_first():
+    lb = balancer()
+    load(lb, a=2, c=1)
+    strategy = LeastOutstandingStrategy()
+    for _ in range(10):
+        assert strategy.select(lb, 'any', 3) == ['b:1', 'c:1', 'a:1']
+    eject(lb, 'b:1')
+    assert strategy.select(lb, 'any', 2) == ['c:1', 'a:1']
+
+
+def test_power_of_two_never_prefers_the_busier_of_its_pair():
+    random.seed(0)
+    lb = balancer()
+    load(lb, c=5)
+    strategy = PowerOfTwoChoicesStrategy()
+    firsts = Counter(strategy.select(lb, 'any', 3)[0] for _ in range(200))
+    assert set(firsts) == {'a:1', 'b:1'}
+    assert sorted(strategy.select(lb, 'any', 3)) == SERVERS
+
+    # With two servers it is least-outstanding
+    eject(lb, 'a:1')
+    assert strategy.select(lb, 'any', 2) == ['b:1', 'c:1']
+
+
+def test_weighted_round_robin_follows_weights_smoothly():
+    lb = balancer()
+    lb.set_weights({'weights': {'a:1': 3}})
+    strategy = WeightedRoundRobinStrategy()
+    picks = [strategy.select(lb, 'any', 1)[0] for _ in range(50)]
+    assert Counter(picks) == {'a:1': 30, 'b:1': 10, 'c:1': 10}
+    # Interleaved rather than in runs
+    assert all(picks[i:i + 3] != ['a:1'] * 3 for i in range(len(picks)))
+
+    # A server that leaves the pool stops being picked
+    lb.remove_servers({'n': 1, 'hostnames': ['c:1']})
+    picks = [strategy.select(lb, 'any', 2)[0] for _ in range(8)]
+    assert Counter(picks) == {'a:1': 6, 'b:1': 2}
+
+
+def test_strategies_by_name_and_route():
+    for name, cls in STRATEGIES.items():
+        assert isinstance(create_strategy(name), cls)
+        assert create_strategy(name).name == name
+
+    lb = balancer(strategy='least_outstanding',
+                  strategy_routes=parse_strategy_routes('/api=power_of_two, /api/v2=weighted_round_robin'))
+    assert lb._strategy_for('home').name == 'least_outstanding'
+    assert lb._strategy_for('api/users').name == 'power_of_two'
+    assert lb._strategy_for('/api/v2/users').name == 'weighted_round_robin'
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match='round_robin'):
+        create_strategy('round_robin')
+    with pytest.raises(ValueError):
+        LoadBalancer(num_servers=0, health_check_interval=3600, strategy='random')
+    with pytest.raises(ValueError):
+        LoadBalancer(num_servers=0, health_check_interval=3600, strategy_routes={'/api': 'random'})